@@ -0,0 +1,83 @@
+"""Per-step observation latency of TextualBrowserEnv.
+
+- serial: what `_get_obs` used to do, i.e. extract the elements twice from scratch, read the
+  scroll status with four scripts, then fetch the url and take a screenshot, one after another
+- cold: one snapshot script with a freshly installed extractor, i.e. a full DOM walk
+- fresh: one snapshot script on an unchanged page as after an action, i.e. a root scan served by the resident extractor's cache
+- text-only: fresh, without the screenshot (the fields used by examples/browser_agent.py)
+- unchanged: a `pass` step on an unchanged page, i.e. one version check and no extraction
+
+Usage: PYTHONPATH=. python benchmarks/browser_observation.py [--urls https://en.wikipedia.org/wiki/Web_browser ...] [--steps 20]
+"""
+import argparse
+import statistics
+import time
+
+from luka.tools.browser import TextualBrowserEnv
+from luka.tools.browser.envs import OBS_FIELDS
+from luka.tools.browser.observations import assign_ids, get_text_representation, js_retrieve_elements
+
+js_uninstall = """
+    if (window.__textualBrowserEnv !== undefined) {
+        window.__textualBrowserEnv.disconnect();
+        delete window.__textualBrowserEnv;
+    }
+"""
+
+
+def serial_chain(driver):
+    for _ in range(2):
+        driver.execute_script(js_uninstall)
+        elements, _ = assign_ids(driver.execute_script(js_retrieve_elements)["elements"])
+    for script in [
+        "return window.scrollY;",
+        "return document.body.scrollHeight - window.innerHeight;",
+        "return window.scrollX;",
+        "return document.body.scrollWidth - window.innerWidth;",
+    ]:
+        driver.execute_script(script)
+    driver.current_url
+    driver.get_screenshot_as_base64()
+    return get_text_representation(elements)
+
+
+def cold_obs(env):
+    env._driver.execute_script(js_uninstall)
+    env._snapshot = None
+    return env._get_obs()
+
+
+def timed(fn, steps):
+    samples = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", nargs="+", default=["https://en.wikipedia.org/wiki/Web_browser", "https://news.ycombinator.com"])
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+
+    env = TextualBrowserEnv(headless=True)
+    try:
+        print(f"{'url':<50} {'serial ms':>10} {'cold ms':>8} {'fresh ms':>9} {'text-only ms':>13} {'unchanged ms':>13}")
+        for url in args.urls:
+            env.reset(options={"url": url})
+            serial = timed(lambda: serial_chain(env._driver), args.steps)
+            cold = timed(lambda: cold_obs(env), args.steps)
+            fresh = timed(env._get_obs, args.steps)
+            env._obs_fields = ("url", "scroll_status", "page_text", "action_result")
+            text_only = timed(env._get_obs, args.steps)
+            env._obs_fields = OBS_FIELDS
+            unchanged = timed(lambda: env._get_obs(reuse=True), args.steps)
+            print(f"{url[:50]:<50} {serial:>10.1f} {cold:>8.1f} {fresh:>9.1f} {text_only:>13.1f} {unchanged:>13.1f}")
+    finally:
+        env.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Element extraction time of the two TextualBrowserEnv backends on generated fixture pages.
+
+- js cold: the resident extractor freshly installed, i.e. a full DOM walk in page JavaScript
+- js warm: the resident extractor after a mutation in one paragraph, re-processing that subtree
+- cdp: one DOMSnapshot.captureSnapshot, rebuilt into elements in Python
+
+Each page is also checked to produce the same page text with both backends.
+
+Usage: PYTHONPATH=. python benchmarks/extraction_backends.py [--scale 1] [--steps 10]
+"""
+import argparse
+import pathlib
+import statistics
+import tempfile
+import time
+
+from selenium import webdriver
+
+from luka.tools.browser.dom_snapshot import get_dom_snapshot
+from luka.tools.browser.observations import get_snapshot, get_text_representation
+
+js_uninstall = """
+    if (window.__textualBrowserEnv !== undefined) {
+        window.__textualBrowserEnv.disconnect();
+        delete window.__textualBrowserEnv;
+    }
+"""
+
+js_touch = """
+    const p = document.querySelector("p");
+    if (p !== null) {
+        p.dataset.touched = (parseInt(p.dataset.touched || "0") + 1).toString();
+    }
+"""
+
+PARAGRAPH = "The quick brown fox jumps over the lazy dog while the checkout page lists the <b>Pro plan</b> at $20 per month. "
+
+
+def article(n):
+    """A long article with headings, paragraphs, inline links and lists"""
+    sections = []
+    for i in range(n):
+        items = "".join(f"<li><a href='#item-{i}-{j}'>Item {j}</a></li>" for j in range(5))
+        sections.append(f"<section><h2>Section {i}</h2><p>{PARAGRAPH * 3}<a href='#s{i}'>more</a></p><ul>{items}</ul></section>")
+    return "<main>" + "".join(sections) + "</main>"
+
+
+def nested(depth):
+    """Deeply nested layout, e.g. comment threads"""
+    return "<div style='padding-left: 2px'>" * depth + PARAGRAPH + "</div>" * depth
+
+
+def form(n):
+    """A long form with every kind of input"""
+    rows = []
+    for i in range(n):
+        rows.append(
+            f"<div><label>Field {i}</label><input type='text' placeholder='Value {i}' name='f{i}'>"
+            f"<select name='s{i}'><option>One</option><option>Two</option></select>"
+            f"<input type='checkbox' name='c{i}'><input type='date' name='d{i}'><div role='button'>Apply</div></div>"
+        )
+    return "<form>" + "".join(rows) + "</form>"
+
+
+def timed(fn, steps):
+    samples = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def js_cold(driver):
+    driver.execute_script(js_uninstall)
+    return get_snapshot(driver)
+
+
+def js_warm(driver):
+    driver.execute_script(js_touch)
+    return get_snapshot(driver)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=10)
+    args = parser.parse_args()
+
+    pages = {
+        "article": article(200 * args.scale),
+        "nested": nested(300),
+        "form": form(200 * args.scale),
+    }
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    options.add_argument("--window-size=1024,768")
+    driver = webdriver.Chrome(options=options)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            print(f"{'page':<10} {'elements':>9} {'same text':>10} {'js cold ms':>11} {'js warm ms':>11} {'cdp ms':>8}")
+            for name, body in pages.items():
+                path = pathlib.Path(directory) / f"{name}.html"
+                path.write_text(f"<!DOCTYPE html><html><body>{body}</body></html>")
+                driver.get(path.as_uri())
+
+                js, cdp = js_cold(driver), get_dom_snapshot(driver)
+                same = get_text_representation(js.elements) == get_text_representation(cdp.elements)
+                cold = timed(lambda: js_cold(driver), args.steps)
+                warm = timed(lambda: js_warm(driver), args.steps)
+                snapshot = timed(lambda: get_dom_snapshot(driver), args.steps)
+                print(f"{name:<10} {len(js.element_index):>9} {str(same):>10} {cold:>11.1f} {warm:>11.1f} {snapshot:>8.1f}")
+    finally:
+        driver.quit()
+
+
+if __name__ == "__main__":
+    main()
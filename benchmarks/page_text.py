@@ -0,0 +1,164 @@
+"""Rendering time of get_text_representation on large synthetic pages.
+
+- legacy: the recursive renderer it replaced, which prepends every child rendering to its
+  parent's string and so copies deep subtrees once per ancestor
+- stream: the one-pass renderer, joined into a string
+- first 4KB: the generator form, stopped once 4096 characters have been produced
+
+Both renderers are checked to produce identical output on every page, and on a batch of
+random pages first.
+
+Usage: PYTHONPATH=. python benchmarks/page_text.py [--scale 1] [--steps 5]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from luka.tools.browser.observations import assign_ids, get_text_representation, iter_text_representation
+
+
+def legacy_text_representation(elements):
+    text_repr = ""
+    for e in elements:
+        if e["tag"] in ["textinput", "select", "datepicker"]:
+            text_attrs = ["text", "placeholder"]
+            meta_attrs = ["type", "alt", "title", "aria_label", "value", "required", "checked", "min", "max"]
+        elif e["tag"] == "text":
+            text_attrs = ["text"]
+            meta_attrs = []
+        else:
+            text_attrs = ["text", "aria_label", "alt"]
+            meta_attrs = ["type", "value"]
+
+        text = [x for x in filter(lambda x: x is not None and len(x) > 0, [e.get(attr) for attr in text_attrs])]
+        text = text[0] if len(text) > 0 else None
+        if text != None and text != e.get("text"):
+            text = "(" + text + ")"
+
+        if e.get("children") != None:
+            text = "" if text == None else text
+            text = legacy_text_representation(e["children"]) + text
+
+        if text == None:
+            text = ""
+
+        meta_str = " ".join([attr + "=\"" + e[attr] + "\"" for attr in meta_attrs if e.get(attr) is not None])
+        if len(meta_str) > 0:
+            meta_str = " " + meta_str
+
+        if e["tag"] == "text":
+            text_repr += text
+            continue
+        if e["tag"] in ["img", "map", "area", "canvas", "figcaption", "figure", "picture", "svg"]:
+            text_repr += f"![{e['tag']}]({text})"
+            continue
+
+        if len(text.split("\n")) > 1:
+            text = text.strip()
+            text_repr += f"<{e['tag']} id=\"{e['id']}\"{meta_str}>\n{text}\n</{e['tag']}>\n"
+        else:
+            text_repr += f"<{e['tag']} id=\"{e['id']}\"{meta_str}>{text}</{e['tag']}>\n"
+
+    return text_repr
+
+
+PARAGRAPH = "The quick brown fox jumps over the lazy dog while the checkout page lists the Pro plan at $20 per month. "
+
+
+def text(rng):
+    return {"tag": "text", "text": rng.choice(["", " ", "\n", "  \n "]) + PARAGRAPH * rng.randint(1, 4) + rng.choice(["", "\n", " "])}
+
+
+def leaf(rng):
+    return rng.choice([
+        lambda: {"tag": "link", "handle": 0, "children": [text(rng)]},
+        lambda: {"tag": "button", "handle": 0, "aria_label": "Submit", "children": []},
+        lambda: {"tag": "textinput", "handle": 0, "type": "text", "placeholder": "Search...", "children": []},
+        lambda: {"tag": "img", "handle": 0, "alt": "Logo", "children": []},
+        lambda: text(rng),
+    ])()
+
+
+def wide_page(rng, n):
+    """A long article: thousands of paragraphs and links directly under a few containers"""
+    return [{"tag": "section", "handle": 0, "children": [leaf(rng) for _ in range(n // 10)]} for _ in range(10)]
+
+
+def deep_page(rng, depth):
+    """Text at every level of a deeply nested layout, e.g. nested comment threads"""
+    root = children = []
+    for _ in range(depth):
+        node = {"tag": rng.choice(["div", "figure", "text"]), "handle": 0, "children": [text(rng), leaf(rng)]}
+        if node["tag"] == "text":
+            node["text"] = ""
+        children.append(node)
+        children = node["children"]
+    return root
+
+
+def random_page(rng, depth=0):
+    tags = ["text", "div", "link", "select", "figure", "img", "span"]
+    page = []
+    for _ in range(rng.randint(0, 4)):
+        e = {"tag": rng.choice(tags), "handle": 0}
+        for attr in ["text", "aria_label", "alt", "placeholder", "type", "value"]:
+            if rng.random() < 0.3:
+                e[attr] = rng.choice(["", " ", "\n", "a", " b\n", "c \t"])
+        if e["tag"] == "text":
+            e.setdefault("text", "x")
+        elif rng.random() < 0.8:
+            e["children"] = random_page(rng, depth + 1) if depth < 4 else []
+        page.append(e)
+    return page
+
+
+def timed(fn, steps):
+    samples = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def first_chars(elements, n):
+    chunks, size = [], 0
+    for chunk in iter_text_representation(elements):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= n:
+            break
+    return "".join(chunks)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for _ in range(2000):
+        elements, _ = assign_ids(random_page(rng))
+        assert get_text_representation(elements) == legacy_text_representation(elements)
+
+    pages = [
+        ("wide", wide_page(rng, 20000 * args.scale)),
+        ("deep", deep_page(rng, 400)),
+        ("deep x wide", [e for _ in range(10 * args.scale) for e in deep_page(rng, 400)]),
+    ]
+    print(f"{'page':<12} {'elements':>9} {'chars':>10} {'legacy ms':>10} {'stream ms':>10} {'first 4KB ms':>13}")
+    for name, page in pages:
+        elements, index = assign_ids(page)
+        rendered = get_text_representation(elements)
+        assert rendered == legacy_text_representation(elements)
+        assert rendered.startswith(first_chars(elements, 4096))
+        legacy = timed(lambda: legacy_text_representation(elements), args.steps)
+        stream = timed(lambda: get_text_representation(elements), args.steps)
+        first = timed(lambda: first_chars(elements, 4096), args.steps)
+        print(f"{name:<12} {len(index):>9} {len(rendered):>10} {legacy:>10.1f} {stream:>10.1f} {first:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
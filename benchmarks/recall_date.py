@@ -0,0 +1,46 @@
+"""Latency of date-range and "last N" queries on TransientRecallMemory, served by the timeline index.
+
+Usage: PYTHONPATH=. python benchmarks/recall_date.py [--sizes 10000 100000] [--queries 200]
+"""
+import argparse
+import random
+import time
+
+from datetime import timedelta
+
+from luka.memory import TransientRecallMemory
+
+from recall_insert import make_messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--window-s", type=int, default=60)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'messages':>10} {'date_search ms':>15} {'by role ms':>11} {'recent ms':>10}")
+    for size in args.sizes:
+        messages = make_messages(size)
+        mem = TransientRecallMemory()
+        for i in range(0, size, 1024):
+            mem.insert_many(messages[i:i + 1024])
+
+        starts = [messages[rng.randrange(size)].timestamp for _ in range(args.queries)]
+        timings = []
+        for query in [
+            lambda t: mem.date_search(t, t + timedelta(seconds=args.window_s), limit=10),
+            lambda t: mem.date_search(t, t + timedelta(seconds=args.window_s), limit=10, roles=["browser"]),
+            lambda t: mem.recent(10, roles=["user"]),
+        ]:
+            start = time.perf_counter()
+            for t in starts:
+                query(t)
+            timings.append((time.perf_counter() - start) / args.queries * 1000)
+        print(f"{size:>10} {timings[0]:>15.3f} {timings[1]:>11.3f} {timings[2]:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Insert throughput of TransientRecallMemory: one commit per message vs. batched commits.
+
+Usage: PYTHONPATH=. python benchmarks/recall_insert.py [--sizes 10000 100000 1000000] [--batch-size 256]
+"""
+import argparse
+import time
+
+from datetime import datetime, timedelta
+
+from luka.memory import TransientRecallMemory
+from luka.utils import Message
+
+
+def make_messages(n):
+    start = datetime(2024, 5, 1)
+    roles = ["user", "agent", "browser"]
+    return [
+        Message(
+            role=roles[i % 3],
+            content=f"Action successful!\n current url: https://example.com/page/{i % 997}\n step {i}",
+            timestamp=start + timedelta(seconds=i),
+        )
+        for i in range(n)
+    ]
+
+
+def bench_single(messages):
+    mem = TransientRecallMemory()
+    for message in messages:
+        mem.insert(message)
+    return mem
+
+
+def bench_insert_many(messages, batch_size):
+    mem = TransientRecallMemory()
+    for i in range(0, len(messages), batch_size):
+        mem.insert_many(messages[i:i + batch_size])
+    return mem
+
+
+def bench_buffered(messages, batch_size):
+    mem = TransientRecallMemory(buffered=True, flush_size=batch_size)
+    for message in messages:
+        mem.insert(message)
+    mem.close()
+    return mem
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--modes", nargs="+", default=["single", "insert_many", "buffered"])
+    args = parser.parse_args()
+
+    runners = {
+        "single": lambda msgs: bench_single(msgs),
+        "insert_many": lambda msgs: bench_insert_many(msgs, args.batch_size),
+        "buffered": lambda msgs: bench_buffered(msgs, args.batch_size),
+    }
+
+    print(f"{'mode':<12} {'messages':>10} {'seconds':>10} {'inserts/s':>12} {'segments':>9}")
+    for size in args.sizes:
+        messages = make_messages(size)
+        for mode in args.modes:
+            start = time.perf_counter()
+            mem = runners[mode](messages)
+            elapsed = time.perf_counter() - start
+            assert len(mem) == size
+            print(f"{mode:<12} {size:>10} {elapsed:>10.2f} {size / elapsed:>12.0f} {len(mem._index._segments()):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""RAM held by TransientRecallMemory for a repetitive browser session, with and without the ContentStore.
+
+Usage: PYTHONPATH=. python benchmarks/recall_storage.py [--messages 20000]
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+
+from datetime import datetime, timedelta
+
+from luka.memory import TransientRecallMemory
+from luka.utils import Message
+
+
+class StoredFieldsRecallMemory(TransientRecallMemory):
+    """Contents kept as Whoosh stored fields, i.e. one full copy per message."""
+    def _create_content_store(self):
+        return None
+
+
+def make_session(n, seed=0):
+    rng = random.Random(seed)
+    pages = [
+        "\n".join(f"[{j}] <a>Result {p}-{j}: how to compare laptop prices and reviews</a>" for j in range(40))
+        for p in range(50)
+    ]
+    start = datetime(2024, 5, 1)
+    messages = []
+    for i in range(n):
+        page = rng.randrange(len(pages))
+        kind = i % 3
+        if kind == 0:
+            role, content = "browser", f"Action successful!\nCurrent url: https://example.com/search?q=laptops&page={page}"
+        elif kind == 1:
+            role, content = "browser", pages[page]
+        else:
+            role, content = "agent", f"I should click on result {rng.randrange(40)} to see more details. CLICK {rng.randrange(40)}"
+        messages.append(Message(role=role, content=content, timestamp=start + timedelta(seconds=i)))
+    return messages
+
+
+def measure(cls, messages):
+    gc.collect()
+    tracemalloc.start()
+    mem = cls()
+    for i in range(0, len(messages), 512):
+        mem.insert_many(messages[i:i + 512])
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(mem) == len(messages)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20_000)
+    args = parser.parse_args()
+
+    messages = make_session(args.messages)
+    raw = sum(len(m.content.encode("utf-8")) for m in messages)
+    print(f"{'storage':<14} {'MiB':>8} {'bytes/msg':>10}   (raw contents: {raw / len(messages):.0f} bytes/msg)")
+    for name, cls in [("stored fields", StoredFieldsRecallMemory), ("content store", TransientRecallMemory)]:
+        size = measure(cls, messages)
+        print(f"{name:<14} {size / 2**20:>8.1f} {size / len(messages):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Query latency of the VectorIndex side-index behind TransientRecallMemory.hybrid_search.
+
+Usage: PYTHONPATH=. python benchmarks/recall_vector.py [--sizes 10000 100000] [--queries 200]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from luka.memory import HashingVectorizer, VectorIndex
+
+
+SYLLABLES = "pri ce plan mon th ac count pass word sear ch re sult page cli ck but ton form er ror load ing fli ght ho tel rev iew ord der".split()
+
+
+def make_texts(n, rng, vocabulary_size=5000, topics=200):
+    # Zipf-like vocabulary grouped into topics, so that texts form clusters like real messages
+    words = np.array(["".join(rng.choice(SYLLABLES, size=3)) for _ in range(vocabulary_size)])
+    topic_words = rng.integers(0, vocabulary_size, size=(topics, 40))
+    texts = []
+    for topic in rng.integers(0, topics, size=n):
+        texts.append(" ".join(words[rng.choice(topic_words[topic], size=12)]))
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embed = HashingVectorizer()
+
+    print(f"{'vectors':>10} {'mode':<6} {'build s':>8} {'query ms':>9} {'recall@10':>10}")
+    for size in args.sizes:
+        texts = make_texts(size + args.queries, np.random.default_rng(size))
+        vectors = np.stack([embed(text) for text in texts[:size]])
+        queries = [embed(text) for text in texts[size:]]
+        for mode, threshold in [("flat", size + 1), ("ivf", 0)]:
+            index = VectorIndex(dim=embed.dim, ivf_threshold=threshold)
+            start = time.perf_counter()
+            index.add(range(size), vectors)
+            build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = [index.search(query, args.k)[0] for query in queries]
+            latency = (time.perf_counter() - start) / len(queries) * 1000
+
+            exact = [set(np.argsort(-(vectors @ query), kind="stable")[:10]) for query in queries]
+            recall = np.mean([len(set(ids[:10]) & truth) / 10 for ids, truth in zip(results, exact)])
+            print(f"{size:>10} {mode:<6} {build:>8.2f} {latency:>9.3f} {recall:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Steps per second of make_vector_env with a growing number of workers.
+
+Every worker loads a generated article page and scrolls it down and up again, so each step
+extracts a fresh observation. The speedup is relative to a single worker; it should stay close
+to the number of workers until Chrome saturates the cores.
+
+Usage: PYTHONPATH=. python benchmarks/vector_env.py [--max-envs 8] [--steps 20]
+"""
+import argparse
+import functools
+import http.server
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+from luka.tools.browser import make_vector_env
+
+PARAGRAPH = "The quick brown fox jumps over the lazy dog while the checkout page lists the <b>Pro plan</b> at $20 per month. "
+
+
+def article(n):
+    """A long article with headings, paragraphs, inline links and lists"""
+    sections = []
+    for i in range(n):
+        items = "".join(f"<li><a href='#item-{i}-{j}'>Item {j}</a></li>" for j in range(5))
+        sections.append(f"<section><h2>Section {i}</h2><p>{PARAGRAPH * 3}<a href='#s{i}'>more</a></p><ul>{items}</ul></section>")
+    return "<main>" + "".join(sections) + "</main>"
+
+
+def steps_per_second(num_envs, url, steps):
+    env = make_vector_env(num_envs, start_urls=url, max_episode_steps=None, obs_fields=["url", "page_text", "action_result"])
+    try:
+        env.reset(seed=0)
+        start = time.perf_counter()
+        for i in range(steps):
+            env.step({"command": ("scroll",) * num_envs, "parameters": ({"scroll_down": i % 2 == 0},) * num_envs})
+        return steps * num_envs / (time.perf_counter() - start)
+    finally:
+        env.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-envs", type=int, default=os.cpu_count())
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        (pathlib.Path(directory) / "article.html").write_text(f"<!DOCTYPE html><html><body>{article(200)}</body></html>")
+        # The environment only visits http(s) urls
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=directory)
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/article.html"
+
+        counts = [n for n in (1, 2, 4, 8, 16, 32) if n <= args.max_envs]
+        print(f"{'envs':>5} {'steps/s':>9} {'speedup':>8}")
+        baseline = None
+        for n in counts:
+            rate = steps_per_second(n, url, args.steps)
+            baseline = rate if baseline is None else baseline
+            print(f"{n:>5} {rate:>9.1f} {rate / baseline:>8.2f}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Per-step cost of the working memories with long histories and large notes files.
+
+Each FIFOConversationMemory step inserts one message and renders the history, as the browser
+agents do; the `uncached` column re-renders every message the way `str(memory)` used to.
+Each TextEditorMemory step edits a few lines of the notes file and renders it.
+
+Usage: PYTHONPATH=. python benchmarks/working_memory.py [--messages 10000] [--lines 50000]
+"""
+import argparse
+import time
+
+from datetime import datetime, timedelta
+
+from luka.memory import FIFOConversationMemory, TextEditorMemory
+from luka.utils import Message
+
+
+def bench_fifo(args):
+    start = datetime(2024, 5, 1)
+    messages = [
+        Message(role="browser", content=f"Action successful!\n current url: https://example.com/page/{i}\n", timestamp=start + timedelta(seconds=i))
+        for i in range(args.messages + args.steps)
+    ]
+
+    # Large enough that the whole history stays in memory and nothing is evicted
+    mem = FIFOConversationMemory(tokenize=lambda x: x.split(" "), summarize=lambda x: "summary", max_size=10**9)
+    for msg in messages[:args.messages]:
+        mem.insert(msg)
+    str(mem)
+
+    begin = time.perf_counter()
+    for msg in messages[args.messages:]:
+        mem.insert(msg)
+        str(mem)
+    cached = (time.perf_counter() - begin) / args.steps
+
+    begin = time.perf_counter()
+    for _ in range(args.steps):
+        "\n".join([str(entry[0]) for entry in mem._message_queue])
+    uncached = (time.perf_counter() - begin) / args.steps
+
+    print(f"{'history':>8} {'cached ms/step':>15} {'uncached ms/step':>17}")
+    print(f"{len(mem._message_queue):>8} {cached * 1000:>15.3f} {uncached * 1000:>17.3f}")
+
+
+def bench_text_editor(args):
+    mem = TextEditorMemory(tokenize=lambda x: x.split(" "))
+    begin = time.perf_counter()
+    mem.insert("\n".join(f"note {i}: the checkout page lists the Pro plan at $20 per month" for i in range(args.lines)))
+    str(mem)
+    initial = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    for step in range(args.steps):
+        mem.insert(f"new finding {step}\nsecond line of finding {step}", pos=step * 97 % args.lines)
+        mem.replace(f"rewritten line {step}", (step, step + 1))
+        str(mem)
+    per_step = (time.perf_counter() - begin) / args.steps
+
+    print(f"{'lines':>8} {'first render ms':>16} {'edit+render ms/step':>20}")
+    print(f"{len(mem._lines):>8} {initial * 1000:>16.1f} {per_step * 1000:>20.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--lines", type=int, default=50_000)
+    parser.add_argument("--steps", type=int, default=200)
+    args = parser.parse_args()
+
+    bench_fifo(args)
+    bench_text_editor(args)
+
+
+if __name__ == "__main__":
+    main()
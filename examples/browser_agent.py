@@ -1,5 +1,5 @@
 from luka.tools.browser import TextualBrowserEnv
-from luka.memory import FIFOConversationMemory
+from luka.memory import FIFOConversationMemory, TokenCounter
 from luka.utils import Message
 
 import os
@@ -162,13 +162,20 @@ class _AgentReply(BaseModel):
 
 class BrowserAgent:
     def __init__(self, model="gpt-4o"):
-        self._env = TextualBrowserEnv(timeout_s=15)
         self._model = model
         self._openai_key = os.getenv("OPENAI_API_KEY")
         self._client = instructor.from_litellm(completion)
 
         def litellm_tokenize(x):
             return encode(model=self._model, text=x)
+
+        # The agent only reads text, so the screenshot is never taken
+        self._env = TextualBrowserEnv(
+            timeout_s=15, 
+            obs_fields=["url", "scroll_status", "page_text", "action_result"],
+            max_page_tokens=4096,
+            tokenize=litellm_tokenize
+        )
         
         def litellm_summarize(msg_list):
             prompt = """
@@ -194,11 +201,12 @@ class BrowserAgent:
             return summary
 
         self._fifo_mem = FIFOConversationMemory(
-            tokenize=litellm_tokenize, 
+            tokenize=TokenCounter(litellm_tokenize, model=self._model), 
             summarize=litellm_summarize, 
             max_size=1024, 
             trigger_threshold=0.8, 
-            target_threshold=0.5
+            target_threshold=0.5,
+            background=True
         )
 
         self._obs = None
@@ -23,5 +23,5 @@ while True:
 
     id = input(colored("> ", "green", attrs=["bold"]))
 
-    obs, info = env.step({"command": "click", "args": {"id": int(id)}})
+    obs, info = env.step({"command": "click", "parameters": {"id": int(id)}})
     
\ No newline at end of file
@@ -1,2 +1,6 @@
-from .recall_mem import TransientRecallMemory
-from .working_mem import FIFOConversationMemory, TextEditorMemory
\ No newline at end of file
+from .recall_mem import TransientRecallMemory, PersistentRecallMemory
+from .working_mem import FIFOConversationMemory, TextEditorMemory
+from .vector_index import HashingVectorizer, VectorIndex
+from .timeline import TimelineIndex
+from .token_counter import TokenCounter
+from .content_store import ContentStore
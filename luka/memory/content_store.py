@@ -0,0 +1,173 @@
+import hashlib
+import itertools
+import threading
+import zlib
+
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+
+class ContentStore:
+    """
+    Content-addressed, compressed store of message contents.
+
+    Identical contents are stored once under their blake2b digest and reference counted.
+    Payloads are compressed with zlib using a preset dictionary built from the most recent
+    distinct contents, so near-identical contents (the same page text, or "Action successful!"
+    with another url) shrink to a few bytes each. Every `train_every` new payloads, candidate
+    dictionaries of up to `dict_size` bytes are built from all but the newest contents, and the
+    best one is only adopted if the bytes it saves on those newest contents, extrapolated to
+    `train_every` payloads, outweigh its own size.
+
+    Dictionaries are counted by the payloads compressed with them and dropped with the last one.
+    At most `max_dicts` are kept; beyond that, the payloads of the oldest are recompressed with
+    the newest. Keys may be released while other threads read them, in which case `get`
+    returns None.
+    """
+    def __init__(self, level: int = 6, dict_size: int = 32768, train_every: int = 256, max_dicts: int = 4):
+        self._level = level
+        self._dict_size = dict_size
+        self._train_every = train_every
+        self._max_dicts = max_dicts
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # key -> (dictionary id, or -1 if stored uncompressed, payload)
+            self._payloads: Dict[str, Tuple[int, bytes]] = {}
+            self._refs: Dict[str, int] = {}
+            # Dictionary 0 is empty, i.e. plain zlib, and used until a trained one pays off
+            self._dicts: Dict[int, bytes] = {0: b""}
+            # dictionary id -> number of payloads compressed with it
+            self._dict_refs: Dict[int, int] = {0: 0}
+            self._current = 0
+            self._next_dict_id = 1
+            self._samples = deque()
+            self._sample_bytes = 0
+            self._untrained = 0
+
+    def __len__(self):
+        return len(self._payloads)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by payloads and dictionaries"""
+        return sum(len(payload) for _, payload in self._payloads.values()) + sum(len(d) for d in self._dicts.values())
+
+    def put(self, text: str) -> str:
+        """Store `text`, or take another reference to it, and return its key."""
+        data = text.encode("utf-8")
+        key = hashlib.blake2b(data, digest_size=16).hexdigest()
+        with self._lock:
+            if key in self._refs:
+                self._refs[key] += 1
+                return key
+            self._refs[key] = 1
+            self._payloads[key] = self._compress(data)
+            self._add_sample(data)
+        return key
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the content stored under `key`, or None once it has been released."""
+        with self._lock:
+            entry = self._payloads.get(key)
+            if entry is None:
+                return None
+            dict_id, payload = entry
+            zdict = self._dicts[dict_id] if dict_id >= 0 else None
+        # Decompress outside the lock; payloads and dictionaries are never modified in place
+        return self._decompress(zdict, payload).decode("utf-8")
+
+    def release(self, key: str):
+        """Drop one reference to `key`, and its payload with the last one."""
+        with self._lock:
+            refs = self._refs.get(key, 0) - 1
+            if refs > 0:
+                self._refs[key] = refs
+            elif refs == 0:
+                del self._refs[key]
+                dict_id, _ = self._payloads.pop(key)
+                self._release_dict(dict_id)
+
+    def _compress(self, data: bytes) -> Tuple[int, bytes]:
+        compressed = self._deflate(self._dicts[self._current], data)
+        if len(compressed) >= len(data):
+            return -1, data
+        self._dict_refs[self._current] += 1
+        return self._current, compressed
+
+    def _deflate(self, zdict: bytes, data: bytes) -> bytes:
+        compressor = zlib.compressobj(self._level, zdict=zdict) if zdict else zlib.compressobj(self._level)
+        return compressor.compress(data) + compressor.flush()
+
+    def _compressed_size(self, zdict: bytes, samples: List[bytes]) -> int:
+        # As stored by `_compress`, i.e. uncompressed if that is smaller
+        return sum(min(len(self._deflate(zdict, data)), len(data)) for data in samples)
+
+    @staticmethod
+    def _decompress(zdict: Optional[bytes], payload: bytes) -> bytes:
+        if zdict is None:
+            return payload
+        decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        return decompressor.decompress(payload)
+
+    def _release_dict(self, dict_id: int):
+        if dict_id < 0:
+            return
+        self._dict_refs[dict_id] -= 1
+        if self._dict_refs[dict_id] == 0 and dict_id not in (0, self._current):
+            del self._dicts[dict_id]
+            del self._dict_refs[dict_id]
+
+    def _add_sample(self, data: bytes):
+        self._samples.append(data)
+        self._sample_bytes += len(data)
+        while len(self._samples) > 1 and self._sample_bytes - len(self._samples[0]) >= self._dict_size:
+            self._sample_bytes -= len(self._samples.popleft())
+
+        self._untrained += 1
+        if self._untrained >= self._train_every:
+            self._untrained = 0
+            self._train()
+
+    def _train(self):
+        # The newest samples are held out to measure the candidate on contents it has not seen
+        held_out = min(self._train_every // 8, len(self._samples) // 4)
+        if held_out == 0:
+            return
+        newest = list(itertools.islice(reversed(self._samples), held_out))
+        seen = b"".join(itertools.islice(self._samples, len(self._samples) - held_out))
+        current_size = self._compressed_size(self._dicts[self._current], newest)
+        # Short contents often only need a short dictionary, so shorter tails compete as well.
+        # zlib finds matches near the end of the dictionary more cheaply, so newer samples go last.
+        best, best_net = None, 0.0
+        for size in (self._dict_size, self._dict_size // 8, self._dict_size // 64):
+            if size == 0:
+                continue
+            candidate = seen[-size:]
+            net = (current_size - self._compressed_size(candidate, newest)) * self._train_every / held_out - len(candidate)
+            if net > best_net:
+                best, best_net = candidate, net
+        if best is None:
+            return
+
+        previous, self._current = self._current, self._next_dict_id
+        self._next_dict_id += 1
+        self._dicts[self._current] = best
+        self._dict_refs[self._current] = 0
+        if self._dict_refs[previous] == 0 and previous != 0:
+            del self._dicts[previous]
+            del self._dict_refs[previous]
+
+        trained = [dict_id for dict_id in self._dicts if dict_id != 0]
+        for dict_id in trained[:max(0, len(trained) - self._max_dicts)]:
+            self._recompress(dict_id)
+
+    def _recompress(self, dict_id: int):
+        # Move the payloads of `dict_id` to the current dictionary, which drops `dict_id`
+        zdict = self._dicts[dict_id]
+        for key, (payload_dict_id, payload) in list(self._payloads.items()):
+            if payload_dict_id == dict_id:
+                self._payloads[key] = self._compress(self._decompress(zdict, payload))
+                self._release_dict(dict_id)
@@ -1,13 +1,31 @@
 from abc import ABC, abstractmethod
-from datetime import datetime
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from whoosh.fields import Schema, TEXT, DATETIME, KEYWORD
-from whoosh.filedb.filestore import RamStorage
-from whoosh.qparser import QueryParser
-from whoosh.query import DateRange
+import itertools
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from whoosh import columns
+from whoosh.fields import Schema, TEXT, DATETIME, KEYWORD, NUMERIC, STORED, COLUMN
+from whoosh.filedb.filestore import FileStorage, RamStorage
+from whoosh.index import exists_in, open_dir
+from whoosh.qparser import QueryParser, OrGroup
+from whoosh import sorting
+from whoosh.query import And, DateRange, Every, Or, Term
+from whoosh.reading import SegmentReader
 
 from luka.utils import Message
 
+from .content_store import ContentStore
+from .timeline import TimelineIndex
+from .vector_index import VectorIndex
+
 # Adapted from https://github.com/cpacker/MemGPT/blob/main/memgpt/memory.py
 class RecallMemory(ABC):
     @abstractmethod
@@ -18,6 +36,22 @@ class RecallMemory(ABC):
     def date_search(self, start_date, end_date, start=None, limit=None):  # pragma: no cover
         pass
 
+    @abstractmethod
+    def iter_text_search(self, query_string) -> Iterator[Message]:  # pragma: no cover
+        pass
+
+    @abstractmethod
+    def iter_date_search(self, start_date, end_date) -> Iterator[Message]:  # pragma: no cover
+        pass
+
+    @abstractmethod
+    def search(self, text=None, roles=None, start_date=None, end_date=None, sort="relevance", start=0, limit=5) -> List[Message]:  # pragma: no cover
+        """Messages matching all of the given filters; filters left as None match everything"""
+
+    @abstractmethod
+    def role_counts(self, text=None, start_date=None, end_date=None) -> Dict[str, int]:  # pragma: no cover
+        """Number of messages per role among those matching the given filters"""
+
     @abstractmethod
     def __repr__(self) -> str:  # pragma: no cover
         pass
@@ -26,38 +60,592 @@ class RecallMemory(ABC):
     def insert(self, message: Message):  # pragma: no cover
         pass
 
-class TransientRecallMemory(RecallMemory):
+    def insert_many(self, messages: Iterable[Message]):
+        for message in messages:
+            self.insert(message)
+
+class _WhooshRecallMemory(RecallMemory):
     """
-    A RecallMemory implementation that stores messages in RAM, powered by Whoosh.
+    Shared implementation of the Whoosh-backed recall memories. Subclasses decide where the
+    index lives (`_create_index`, `_open_index`) and where contents are kept
+    (`_create_content_store`). Date queries are served by a `TimelineIndex`, `embed` adds a
+    `VectorIndex` for `hybrid_search`, and `max_docs`, `max_age` and `role_ttls` set an opt-in
+    retention policy, see `expire`.
     """
-    def __init__(self):
-        self._schema = Schema(role=KEYWORD(stored=True), content=TEXT(stored=True), timestamp=DATETIME(stored=True))
-        self._index = RamStorage().create_index(self._schema)
-    
+    def __init__(
+            self,
+            buffered: bool = False,
+            flush_size: int = 256,
+            flush_interval_s: float = 1.0,
+            max_segments: int = 16,
+            max_cursors: int = 32,
+            query_cache_size: int = 256,
+            result_cache_size: int = 0,
+            embed: Optional[Callable[[str], np.ndarray]] = None,
+            max_docs: Optional[int] = None,
+            max_age: Optional[timedelta] = None,
+            role_ttls: Optional[Dict[str, timedelta]] = None,
+            retention_interval_s: float = 60.0,
+            retention_batch_size: int = 1024
+        ):
+        self._content = self._create_content_store()
+        # Ids, roles, timestamps and embeddings are also kept in per-segment columns, so the side
+        # indexes can be rebuilt on reopen without loading contents or embedding them again
+        fields = dict(
+            msg_id=NUMERIC(int, bits=64, stored=True, unique=True, sortable=True),
+            role=KEYWORD(stored=True, sortable=True),
+            content=TEXT(stored=self._content is None),
+            timestamp=DATETIME(stored=True, sortable=True)
+        )
+        if self._content is not None:
+            fields["content_key"] = STORED()
+        if embed is not None:
+            fields["embedding"] = COLUMN(columns.VarBytesColumn())
+        self._schema = Schema(**fields)
+        self._index = self._open_index()
+
+        # `_lock` serializes writes to the index, `_flush_cond` guards the insert queue
+        self._lock = threading.RLock()
+        self._flush_cond = threading.Condition()
+        self._pending: List[Message] = []
+        self._max_segments = max_segments
+
+        self._cursors = OrderedDict()
+        self._max_cursors = max_cursors
+
+        # `_generation` is bumped on every commit; the shared searcher is refreshed lazily
+        self._generation = 0
+        self._searcher = None
+        self._searcher_generation = -1
+        self._parse_query = lru_cache(maxsize=query_cache_size)(QueryParser("content", self._schema).parse)
+        self._parse_any_query = lru_cache(maxsize=query_cache_size)(QueryParser("content", self._schema, group=OrGroup).parse)
+        self._result_cache = OrderedDict()
+        self._result_cache_size = result_cache_size
+
+        # Messages get sequential ids, which key the side indexes kept next to Whoosh
+        self._next_id = 0
+        self._timeline = TimelineIndex()
+        self._embed = embed
+        self._vectors = VectorIndex(dim=len(embed(""))) if embed is not None else None
+        self._restore()
+
+        self._buffered = buffered
+        self._flush_size = flush_size
+        self._flush_interval_s = flush_interval_s
+        self._closed = False
+        self._flush_thread = None
+        if self._buffered:
+            self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flush_thread.start()
+
+        self._max_docs = max_docs
+        self._max_age = max_age
+        self._role_ttls = dict(role_ttls or {})
+        self._retention_interval_s = retention_interval_s
+        self._retention_batch_size = retention_batch_size
+        self._retention_stop = threading.Event()
+        self._retention_thread = None
+        if max_docs is not None or max_age is not None or len(self._role_ttls) > 0:
+            self._retention_thread = threading.Thread(target=self._retention_loop, daemon=True)
+            self._retention_thread.start()
+
+    @abstractmethod
+    def _create_index(self):  # pragma: no cover
+        """Create a new, empty index, replacing any existing one."""
+
+    def _open_index(self):
+        return self._create_index()
+
+    def _create_content_store(self) -> Optional[ContentStore]:
+        return None
+
     def reset(self):
-        self._index = RamStorage().create_index(self._schema)
+        with self._lock, self._flush_cond:
+            self._pending = []
+            self._index = self._create_index()
+            self._next_id = 0
+            self._timeline.reset()
+            if self._content is not None:
+                self._content.clear()
+            if self._vectors is not None:
+                self._vectors.reset()
+            self._close_cursors()
+            self._invalidate()
+            if self._searcher is not None:
+                self._searcher.close()
+                self._searcher = None
 
     def text_search(self, query_string:str, start:int = 0, limit:int = 5):
-        with self._index.searcher() as searcher:
-            query = QueryParser("content", self._index.schema).parse(query_string)
-            results = searcher.search(query, limit=limit*(start+1))
-            results = results[start*limit:]
-            return [Message(content=x["content"], role=x["role"], timestamp=x["timestamp"]) for x in [dict(result) for result in results]]
+        self.flush()
+        return self._cached_search(("text", query_string, start, limit), lambda searcher: (hit.fields() for hit in searcher.search(
+            self._parse_query(query_string), limit=limit*(start+1)
+        )[start*limit:]))
+
+    def date_search(self, start_date: datetime, end_date: datetime, start:int = 0, limit:int = 5, roles: Optional[Iterable[str]] = None):
+        """Messages between `start_date` and `end_date`, oldest first, read from the timeline in O(log n + k)."""
+        self.flush()
+        roles = tuple(roles) if roles is not None else None
+        return self._cached_search(("date", start_date, end_date, start, limit, roles), lambda searcher: (
+            searcher.document(msg_id=int(id))
+            for id in self._timeline.range(start_date or datetime.min, end_date or datetime.max, roles)[start*limit:(start+1)*limit]
+        ))
+
+    def recent(self, limit: int = 5, roles: Optional[Iterable[str]] = None) -> List[Message]:
+        """Return the `limit` newest messages, optionally only those of the given roles, oldest first."""
+        self.flush()
+        roles = tuple(roles) if roles is not None else None
+        return self._cached_search(("recent", limit, roles), lambda searcher: (
+            searcher.document(msg_id=int(id)) for id in self._timeline.last(limit, roles)
+        ))
+
+    def search(
+            self,
+            text: Optional[str] = None,
+            roles: Optional[Iterable[str]] = None,
+            start_date: Optional[datetime] = None,
+            end_date: Optional[datetime] = None,
+            sort: str = "relevance",
+            start: int = 0,
+            limit: int = 5
+        ) -> List[Message]:
+        """
+        Return messages that match `text` (if given), have one of `roles` (if given) and lie between
+        `start_date` and `end_date` (each bound optional, both inclusive). `sort` is "relevance",
+        "oldest" or "newest"; without `text`, "relevance" means "oldest".
+        """
+        if sort not in ("relevance", "oldest", "newest"):
+            raise ValueError(f"Unknown sort order `{sort}`.")
+        self.flush()
+        roles = tuple(roles) if roles is not None else None
+        key = ("search", text, roles, start_date, end_date, sort, start, limit)
+
+        if text is None:
+            def timeline_search(searcher):
+                ids = self._timeline.range(start_date or datetime.min, end_date or datetime.max, roles)
+                if sort == "newest":
+                    ids = ids[::-1]
+                return (searcher.document(msg_id=int(id)) for id in ids[start*limit:(start+1)*limit])
+            return self._cached_search(key, timeline_search)
 
-    def date_search(self, start_date: datetime, end_date: datetime, start:int = 0, limit:int = 5):
+        sortedby = {"relevance": None, "oldest": "timestamp", "newest": "timestamp"}[sort]
+        return self._cached_search(key, lambda searcher: (hit.fields() for hit in searcher.search(
+            self._parse_query(text), filter=self._filter_query(roles, start_date, end_date),
+            limit=limit*(start+1), sortedby=sortedby, reverse=sort == "newest"
+        )[start*limit:]))
+
+    def role_counts(self, text: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Dict[str, int]:
+        """Count the messages of every role that match `text` and the date bounds, see `search`."""
+        self.flush()
+        query = self._parse_query(text) if text is not None else Every()
+        with self._lock:
+            results = self._get_searcher().search(
+                query, filter=self._filter_query(None, start_date, end_date), limit=None,
+                groupedby=sorting.FieldFacet("role"), maptype=sorting.Count
+            )
+            return dict(results.groups("role"))
+
+    def iter_text_search(self, query_string: str) -> Iterator[Message]:
+        """Lazily yield every message matching `query_string`, most relevant first."""
+        self.flush()
         with self._index.searcher() as searcher:
-            query = DateRange("timestamp", start_date, end_date, startexcl=False, endexcl=False)
-            results = searcher.search(query, limit=limit*(start+1), sortedby="timestamp")
-            results = results[start*limit:]
-            return [Message(content=x["content"], role=x["role"], timestamp=x["timestamp"]) for x in [dict(result) for result in results]]
+            query = self._parse_query(query_string)
+            for hit in searcher.search(query, limit=None):
+                message = self._to_message(hit.fields())
+                # Contents of messages expired since the search started are gone
+                if message is not None:
+                    yield message
+
+    def iter_date_search(self, start_date: datetime, end_date: datetime, roles: Optional[Iterable[str]] = None) -> Iterator[Message]:
+        """Lazily yield every message between `start_date` and `end_date`, oldest first."""
+        self.flush()
+        with self._lock:
+            ids = self._timeline.range(start_date or datetime.min, end_date or datetime.max, roles)
+            searcher = self._index.searcher()
+        with searcher:
+            for id in ids:
+                message = self._to_message(searcher.document(msg_id=int(id)))
+                if message is not None:
+                    yield message
+
+    def text_search_page(self, query_string: str, limit: int = 5, cursor: Optional[str] = None) -> Tuple[List[Message], Optional[str]]:
+        """
+        Return the next `limit` messages matching `query_string` and a cursor for the page after
+        it, or None once results are exhausted. Pass `cursor=None` to start from the first page.
+        Cursors keep their search open, so a page costs O(limit) however deep it is; at most
+        `max_cursors` are kept, and the least recently used one expires first.
+        """
+        if cursor is None:
+            return self._read_page(self.iter_text_search(query_string), limit)
+        return self._read_page(self._pop_cursor(cursor), limit)
+
+    def date_search_page(self, start_date: datetime, end_date: datetime, limit: int = 5, cursor: Optional[str] = None, roles: Optional[Iterable[str]] = None) -> Tuple[List[Message], Optional[str]]:
+        """Cursor-based counterpart of `date_search`, see `text_search_page`."""
+        if cursor is None:
+            return self._read_page(self.iter_date_search(start_date, end_date, roles), limit)
+        return self._read_page(self._pop_cursor(cursor), limit)
+
+    def hybrid_search(self, query_string: str, start: int = 0, limit: int = 5, alpha: float = 0.5, candidates: int = 50):
+        """
+        Rank messages by `alpha * bm25 + (1 - alpha) * cosine`, where BM25 scores are divided by
+        the best lexical score and any query term may match. Both the lexical and the vector
+        side contribute their top `candidates` hits; requires an `embed` function.
+        """
+        if self._vectors is None:
+            raise ValueError("hybrid_search requires the memory to be created with an `embed` function.")
+        self.flush()
+        query_vector = self._embed(query_string)
+        depth = max(candidates, limit*(start+1))
+
+        with self._lock:
+            searcher = self._get_searcher()
+            hits = searcher.search(self._parse_any_query(query_string), limit=depth)
+            lexical: Dict[int, float] = {hit["msg_id"]: hit.score for hit in hits}
+            fields: Dict[int, dict] = {hit["msg_id"]: hit.fields() for hit in hits}
+            max_score = max(lexical.values(), default=0.0) or 1.0
+
+            ids, similarities = self._vectors.search(query_vector, depth)
+            semantic: Dict[int, float] = dict(zip(ids.tolist(), similarities.tolist()))
+            missing = [id for id in lexical if id not in semantic]
+            if len(missing) > 0:
+                semantic.update(zip(missing, self._vectors.score(missing, query_vector).tolist()))
+
+            fused = {
+                id: alpha * lexical.get(id, 0.0) / max_score + (1 - alpha) * max(semantic[id], 0.0)
+                for id in semantic
+            }
+            ranked = sorted(fused, key=lambda id: (-fused[id], id))[start*limit:(start+1)*limit]
+            return [self._to_message(fields[id] if id in fields else searcher.document(msg_id=id)) for id in ranked]
 
     def __repr__(self) -> str:
         pass
 
     def __len__(self):
-        with self._index.searcher() as searcher:
-            return searcher.doc_count()
+        self.flush()
+        with self._lock:
+            return self._get_searcher().doc_count()
 
     def insert(self, message: Message):
-        with self._index.writer() as writer:
-            writer.add_document(role=message.role, content=message.content, timestamp=message.timestamp)
\ No newline at end of file
+        """
+        Commit `message`, or with `buffered=True` queue it for a background thread that commits
+        the queue as one segment once `flush_size` messages are pending or every
+        `flush_interval_s`. Searches flush the queue first, so they always see their own writes.
+        """
+        if not self._buffered:
+            self._commit([message])
+            return
+        with self._flush_cond:
+            self._pending.append(message)
+            if len(self._pending) >= self._flush_size:
+                self._flush_cond.notify()
+
+    def insert_many(self, messages: Iterable[Message]):
+        if not self._buffered:
+            self._commit(list(messages))
+            return
+        with self._flush_cond:
+            self._pending.extend(messages)
+            if len(self._pending) >= self._flush_size:
+                self._flush_cond.notify()
+
+    def flush(self):
+        """Commit all queued messages to the index."""
+        with self._lock:
+            with self._flush_cond:
+                pending, self._pending = self._pending, []
+            self._commit(pending)
+
+    def close(self):
+        """Stop the background threads, commit whatever is still queued and release open readers."""
+        with self._flush_cond:
+            self._closed = True
+            self._flush_cond.notify()
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+            self._flush_thread = None
+        self._retention_stop.set()
+        if self._retention_thread is not None:
+            self._retention_thread.join()
+            self._retention_thread = None
+        self.flush()
+        with self._lock:
+            self._close_cursors()
+            if self._searcher is not None:
+                self._searcher.close()
+                self._searcher = None
+
+    def expire(self, now: Optional[datetime] = None) -> int:
+        """
+        Delete the messages the retention policy no longer keeps and return their number. A
+        background thread calls this every `retention_interval_s`; deletions are committed in
+        batches of `retention_batch_size`, so searches can interleave.
+        """
+        self.flush()
+        now = now or datetime.now()
+        with self._lock:
+            expired = []
+            if self._max_docs is not None:
+                expired.append(self._timeline.first(len(self._timeline) - self._max_docs))
+            if self._max_age is not None:
+                expired.append(self._timeline.range(datetime.min, now - self._max_age))
+            for role, ttl in self._role_ttls.items():
+                expired.append(self._timeline.range(datetime.min, now - ttl, roles=[role]))
+            ids = np.unique(np.concatenate(expired)) if len(expired) > 0 else np.zeros(0, dtype=np.int64)
+
+        for i in range(0, len(ids), self._retention_batch_size):
+            batch = ids[i:i + self._retention_batch_size]
+            # One disjunction per batch; deleting term by term runs a search per message
+            query = Or([Term("msg_id", int(id)) for id in batch])
+            with self._lock:
+                if self._content is not None:
+                    for fields in self._get_searcher().search(query, limit=None):
+                        self._content.release(fields["content_key"])
+                writer = self._index.writer()
+                writer.delete_by_query(query)
+                writer.commit(mergetype=self._merge_small_segments)
+                self._timeline.remove(batch)
+                if self._vectors is not None:
+                    self._vectors.remove(batch)
+                self._invalidate()
+        return len(ids)
+
+    def _flush_loop(self):
+        while not self._closed:
+            with self._flush_cond:
+                self._flush_cond.wait_for(lambda: self._closed or len(self._pending) >= self._flush_size, timeout=self._flush_interval_s)
+            self.flush()
+
+    def _retention_loop(self):
+        while not self._retention_stop.wait(timeout=self._retention_interval_s):
+            self.expire()
+
+    def _commit(self, messages: List[Message]):
+        if len(messages) == 0:
+            return
+        with self._lock:
+            ids = list(range(self._next_id, self._next_id + len(messages)))
+            vectors = None
+            if self._vectors is not None:
+                vectors = np.stack([self._embed(message.content) for message in messages]).astype(np.float32)
+            writer = self._index.writer()
+            for i, (id, message) in enumerate(zip(ids, messages)):
+                stored = {} if self._content is None else {"content_key": self._content.put(message.content)}
+                if vectors is not None:
+                    stored["embedding"] = vectors[i].tobytes()
+                writer.add_document(msg_id=id, role=message.role, content=message.content, timestamp=message.timestamp, **stored)
+            writer.commit(mergetype=self._merge_small_segments)
+            self._next_id += len(messages)
+            self._timeline.add(ids, [message.timestamp for message in messages], [message.role for message in messages])
+            if vectors is not None:
+                self._vectors.add(ids, vectors)
+            self._invalidate()
+
+    def _restore(self):
+        # Rebuild the in-memory state of an index that already holds messages from the columns of
+        # its segments, without loading contents. Documents without columns, i.e. written before
+        # they existed, or without an embedding while `embed` is given now, are read from their
+        # stored fields once and rewritten with columns, since merging them into a segment with
+        # columns would give them default values.
+        with self._index.searcher() as searcher:
+            if searcher.doc_count() == 0:
+                return
+            segments, stale = [], []
+            for reader, _ in searcher.reader().leaf_readers():
+                docs = np.fromiter(reader.all_doc_ids(), dtype=np.int64)
+                if not reader.has_column("msg_id"):
+                    stale.extend(reader.stored_fields(int(doc)) for doc in docs)
+                    continue
+                ids, timestamps, roles, embeddings = self._read_columns(reader, docs)
+                complete = np.ones(len(docs), dtype=bool)
+                if self._vectors is not None:
+                    complete = np.array([len(embedding) > 0 for embedding in embeddings], dtype=bool)
+                    stale.extend(reader.stored_fields(int(doc)) for doc in docs[~complete])
+                    embeddings = [embedding for embedding, ok in zip(embeddings, complete) if ok]
+                segments.append((ids[complete], timestamps[complete], roles[complete], embeddings))
+        for ids, timestamps, roles, embeddings in segments:
+            if len(ids) == 0:
+                continue
+            self._next_id = max(self._next_id, int(ids.max()) + 1)
+            self._timeline.add(ids, timestamps, roles)
+            if self._vectors is not None:
+                self._vectors.add(ids, np.frombuffer(b"".join(embeddings), dtype=np.float32).reshape(len(ids), self._vectors.dim))
+        if len(stale) > 0:
+            self._rewrite(stale)
+
+    def _read_columns(self, reader, docs: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Optional[List[bytes]]]:
+        """Read the ids, timestamps, roles and raw embeddings of the documents `docs` of a segment."""
+        # Columns are read whole, deleted documents included, and then masked. Raw values: ids are
+        # offset into the unsigned range, timestamps count microseconds since `datetime.min`.
+        n = reader.doc_count_all()
+        live = np.zeros(n, dtype=bool)
+        live[docs] = True
+        ids = np.fromiter(reader.column_reader("msg_id", translate=False), dtype=np.uint64, count=n)[live]
+        ids = (ids - np.uint64(1 << 63)).astype(np.int64)
+        micros = np.fromiter(reader.column_reader("timestamp", translate=False), dtype=np.int64, count=n)[live]
+        timestamps = np.datetime64(datetime.min, "us") + micros.astype("timedelta64[us]")
+        roles = np.array([role for role, alive in zip(reader.column_reader("role"), live) if alive], dtype=object)
+        embeddings = None
+        if self._vectors is not None:
+            embeddings = [b""] * len(docs)
+            if reader.has_column("embedding"):
+                embeddings = [embedding for embedding, alive in zip(reader.column_reader("embedding"), live) if alive]
+        return ids, timestamps, roles, embeddings
+
+    def _rewrite(self, stored: List[dict]):
+        # Replace documents by copies with all columns, keeping their ids
+        messages = [self._to_message(fields) for fields in stored]
+        ids = [fields["msg_id"] for fields in stored]
+        vectors = None
+        if self._vectors is not None:
+            vectors = np.stack([self._embed(message.content) for message in messages]).astype(np.float32)
+        writer = self._index.writer()
+        for i, (fields, message) in enumerate(zip(stored, messages)):
+            extra = {} if self._content is None else {"content_key": fields["content_key"]}
+            if vectors is not None:
+                extra["embedding"] = vectors[i].tobytes()
+            writer.update_document(msg_id=ids[i], role=message.role, content=message.content, timestamp=message.timestamp, **extra)
+        writer.commit(mergetype=self._merge_small_segments)
+        self._next_id = max(self._next_id, max(ids) + 1)
+        self._timeline.add(ids, [message.timestamp for message in messages], [message.role for message in messages])
+        if vectors is not None:
+            self._vectors.add(ids, vectors)
+
+    def _merge_small_segments(self, writer, segments):
+        # Size-tiered merge policy: leave the index alone until more than `max_segments`
+        # segments exist, then fold the run of comparably small segments into the segment
+        # being committed. Every document is thus merged O(log n) times over its lifetime.
+        # Segments that lost a quarter of their documents are always rewritten, which drops
+        # the deleted documents for good.
+        merged = [s for s in segments if s.has_deletions() and 4 * s.deleted_count() >= s.doc_count_all()]
+        segments = [s for s in segments if s not in merged]
+
+        if len(segments) > self._max_segments:
+            segments = sorted(segments, key=lambda s: s.doc_count_all())
+            merged_docs = segments[0].doc_count_all()
+            cut = 1
+            while cut < len(segments) and segments[cut].doc_count_all() <= 2 * merged_docs:
+                merged_docs += segments[cut].doc_count_all()
+                cut += 1
+            cut = max(cut, 2)
+            merged.extend(segments[:cut])
+            segments = segments[cut:]
+
+        for segment in merged:
+            reader = SegmentReader(writer.storage, writer.schema, segment)
+            writer.add_reader(reader)
+            reader.close()
+        return segments
+
+    def _get_searcher(self):
+        # Callers must hold `_lock`: refreshing closes the previous searcher
+        if self._searcher is None:
+            self._searcher = self._index.searcher()
+        elif self._searcher_generation != self._generation:
+            self._searcher = self._searcher.refresh()
+        self._searcher_generation = self._generation
+        return self._searcher
+
+    def _cached_search(self, key, search):
+        with self._lock:
+            if key in self._result_cache:
+                self._result_cache.move_to_end(key)
+                return list(self._result_cache[key])
+
+            messages = [self._to_message(fields) for fields in search(self._get_searcher())]
+            if self._result_cache_size > 0:
+                self._result_cache[key] = messages
+                if len(self._result_cache) > self._result_cache_size:
+                    self._result_cache.popitem(last=False)
+            return list(messages)
+
+    def _filter_query(self, roles: Optional[Iterable[str]], start_date: Optional[datetime], end_date: Optional[datetime]):
+        filters = []
+        if roles is not None:
+            filters.append(Or([Term("role", role) for role in roles]))
+        if start_date is not None or end_date is not None:
+            filters.append(DateRange("timestamp", start_date, end_date, startexcl=False, endexcl=False))
+        if len(filters) == 0:
+            return None
+        return filters[0] if len(filters) == 1 else And(filters)
+
+    def _invalidate(self):
+        self._generation += 1
+        self._result_cache.clear()
+
+    def _read_page(self, results: Iterator[Message], limit: int) -> Tuple[List[Message], Optional[str]]:
+        # Read one message past the page to find out whether another page exists
+        page = list(itertools.islice(results, limit + 1))
+        if len(page) <= limit:
+            results.close()
+            return page, None
+
+        cursor = uuid.uuid4().hex
+        with self._lock:
+            self._cursors[cursor] = (page[-1], results)
+            while len(self._cursors) > self._max_cursors:
+                _, (_, expired) = self._cursors.popitem(last=False)
+                expired.close()
+        return page[:-1], cursor
+
+    def _pop_cursor(self, cursor: str) -> Iterator[Message]:
+        with self._lock:
+            if cursor not in self._cursors:
+                raise ValueError(f"Unknown or expired cursor `{cursor}`.")
+            first, results = self._cursors.pop(cursor)
+
+        def resume():
+            try:
+                yield first
+                yield from results
+            finally:
+                results.close()
+        return resume()
+
+    def _close_cursors(self):
+        for _, results in self._cursors.values():
+            results.close()
+        self._cursors.clear()
+
+    def _to_message(self, fields: dict) -> Optional[Message]:
+        # None if the content was released by an expiry that ran outside `_lock` of the caller
+        content = fields["content"] if self._content is None else self._content.get(fields["content_key"])
+        if content is None:
+            return None
+        return Message(content=content, role=fields["role"], timestamp=fields["timestamp"])
+
+
+class TransientRecallMemory(_WhooshRecallMemory):
+    """
+    A RecallMemory implementation that stores messages in RAM, powered by Whoosh. With
+    `dedup=True`, message contents are kept once per distinct content in a compressed
+    `ContentStore` rather than as stored fields, which pays for hashing and compression on
+    every insert and decompression on every hit.
+    """
+    def __init__(self, dedup: bool = False, **kwargs):
+        self._dedup = dedup
+        super().__init__(**kwargs)
+
+    def _create_index(self):
+        return RamStorage().create_index(self._schema)
+
+    def _create_content_store(self):
+        return ContentStore() if self._dedup else None
+
+
+class PersistentRecallMemory(_WhooshRecallMemory):
+    """
+    A RecallMemory implementation that stores messages in an on-disk Whoosh index under `path`.
+    An existing index at `path` is reopened, so messages survive restarts; postings are read
+    through mmap and never loaded into RAM as a whole.
+    """
+    def __init__(self, path: str, **kwargs):
+        self._path = path
+        super().__init__(**kwargs)
+
+    def _create_index(self):
+        os.makedirs(self._path, exist_ok=True)
+        return FileStorage(self._path).create_index(self._schema)
+
+    def _open_index(self):
+        if exists_in(self._path):
+            return open_dir(self._path, schema=self._schema)
+        return self._create_index()
@@ -0,0 +1,111 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+
+def _to_datetime64(timestamp: datetime) -> np.datetime64:
+    # Aware timestamps are compared in UTC, naive ones are taken as they are
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(timestamp, "us")
+
+
+class TimelineIndex:
+    """
+    Columnar, time-ordered side index of `(timestamp, id, role)` triples, kept in parallel
+    NumPy arrays that grow geometrically.
+
+    Messages arrive in (roughly) timestamp order, so appends are O(1) and the arrays stay sorted.
+    An out-of-order append only marks the index unsorted; it is re-sorted, stably so that ties
+    keep their insertion order, by the next query. Range queries are two `searchsorted` calls
+    and a slice, i.e. O(log n + k), and roles are stored as small integer codes so that role
+    filters are a vectorized mask over the selected slice.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._times = np.zeros(1024, dtype="datetime64[us]")
+        self._ids = np.zeros(1024, dtype=np.int64)
+        self._roles = np.zeros(1024, dtype=np.int32)
+        self._role_codes: Dict[str, int] = {}
+        self._size = 0
+        self._sorted = True
+
+    def __len__(self):
+        return self._size
+
+    def add(self, ids: Sequence[int], timestamps: Sequence[datetime], roles: Sequence[str]):
+        n = len(ids)
+        if self._size + n > len(self._times):
+            capacity = max(2 * len(self._times), self._size + n)
+            self._times = np.resize(self._times, capacity)
+            self._ids = np.resize(self._ids, capacity)
+            self._roles = np.resize(self._roles, capacity)
+
+        if isinstance(timestamps, np.ndarray):
+            times = timestamps.astype("datetime64[us]")
+        else:
+            times = np.array([_to_datetime64(t) for t in timestamps], dtype="datetime64[us]")
+        end = self._size + n
+        self._times[self._size:end] = times
+        self._ids[self._size:end] = ids
+        self._roles[self._size:end] = [self._role_codes.setdefault(role, len(self._role_codes)) for role in roles]
+
+        if n > 0 and self._sorted:
+            previous = self._times[self._size - 1:self._size]
+            self._sorted = bool(np.all(times[1:] >= times[:-1])) and (len(previous) == 0 or times[0] >= previous[0])
+        self._size = end
+
+    def range(self, start_date: datetime, end_date: datetime, roles: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Ids of the entries with `start_date <= timestamp <= end_date`, oldest first."""
+        self._sort()
+        times = self._times[:self._size]
+        lo = np.searchsorted(times, _to_datetime64(start_date), side="left")
+        hi = np.searchsorted(times, _to_datetime64(end_date), side="right")
+        return self._filter(lo, hi, roles)
+
+    def first(self, n: int) -> np.ndarray:
+        """Ids of the `n` oldest entries, oldest first."""
+        self._sort()
+        return self._ids[:min(max(n, 0), self._size)].copy()
+
+    def last(self, n: int, roles: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Ids of the `n` newest entries, oldest first."""
+        self._sort()
+        if roles is None:
+            return self._ids[max(self._size - n, 0):self._size].copy()
+
+        # Scan backwards in doubling windows until enough entries of the given roles are found
+        window = max(n, 64)
+        while True:
+            lo = max(self._size - window, 0)
+            ids = self._filter(lo, self._size, roles)
+            if len(ids) >= n or lo == 0:
+                return ids[max(len(ids) - n, 0):]
+            window *= 2
+
+    def remove(self, ids: Sequence[int]):
+        keep = ~np.isin(self._ids[:self._size], np.asarray(ids, dtype=np.int64))
+        size = int(np.count_nonzero(keep))
+        self._times[:size] = self._times[:self._size][keep]
+        self._ids[:size] = self._ids[:self._size][keep]
+        self._roles[:size] = self._roles[:self._size][keep]
+        self._size = size
+
+    def _filter(self, lo: int, hi: int, roles: Optional[Iterable[str]]) -> np.ndarray:
+        ids = self._ids[lo:hi]
+        if roles is None:
+            return ids.copy()
+        codes = [self._role_codes[role] for role in roles if role in self._role_codes]
+        return ids[np.isin(self._roles[lo:hi], codes)]
+
+    def _sort(self):
+        if self._sorted:
+            return
+        order = np.argsort(self._times[:self._size], kind="stable")
+        self._times[:self._size] = self._times[order]
+        self._ids[:self._size] = self._ids[order]
+        self._roles[:self._size] = self._roles[order]
+        self._sorted = True
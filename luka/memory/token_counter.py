@@ -0,0 +1,51 @@
+from collections import OrderedDict
+from typing import Callable, List, Optional, Union
+
+import hashlib
+import threading
+
+
+class TokenCounter:
+    """
+    Memoizing token counter that working memories share instead of calling `tokenize` on every
+    record. Counts are keyed by `model` and a hash of the text and kept in a bounded LRU of
+    `max_entries`, so neither the text nor its tokens are retained.
+    """
+    def __init__(self, tokenize: Callable[[str], List], model: Optional[str] = None, max_entries: int = 65536):
+        self._tokenize = tokenize
+        self._model = model
+        self._max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, text: str) -> int:
+        key = (self._model, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return self._counts[key]
+            self.misses += 1
+
+        count = len(self._tokenize(text))
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self._max_entries:
+                self._counts.popitem(last=False)
+        return count
+
+    def __len__(self):
+        return len(self._counts)
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def as_token_counter(tokenize: Union[TokenCounter, Callable[[str], List]]) -> TokenCounter:
+    """Wrap a plain `tokenize` callable into a TokenCounter, passing TokenCounters through."""
+    return tokenize if isinstance(tokenize, TokenCounter) else TokenCounter(tokenize)
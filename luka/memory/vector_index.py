@@ -0,0 +1,170 @@
+import re
+import zlib
+
+from typing import Sequence, Tuple
+
+import numpy as np
+
+
+class HashingVectorizer:
+    """
+    Embeds text without a model or network access, using the hashing trick over lowercase
+    words and their character n-grams. Sub-word n-grams let paraphrases such as "pricing" and
+    "price" land close to each other. Any callable mapping a string to a 1-d float array can
+    be used in its place.
+    """
+    _WORD = re.compile(r"\w+")
+
+    def __init__(self, dim: int = 256, ngram_range: Tuple[int, int] = (3, 4)):
+        self.dim = dim
+        self._ngram_range = ngram_range
+
+    def _features(self, text: str):
+        for word in self._WORD.findall(text.lower()):
+            yield word
+            padded = f" {word} "
+            for n in range(self._ngram_range[0], self._ngram_range[1] + 1):
+                for i in range(len(padded) - n + 1):
+                    yield padded[i:i + n]
+
+    def __call__(self, text: str) -> np.ndarray:
+        counts = {}
+        for feature in self._features(text):
+            # crc32 instead of hash() so that embeddings are stable across processes
+            h = zlib.crc32(feature.encode("utf-8"))
+            bucket = h % self.dim
+            counts[bucket] = counts.get(bucket, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if len(counts) > 0:
+            buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            vector[buckets] = np.sign(values) * np.log1p(np.abs(values))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+class VectorIndex:
+    """
+    Cosine-similarity index over L2-normalized float32 vectors, stored in one contiguous,
+    geometrically grown matrix.
+
+    Below `ivf_threshold` vectors, queries are a single matrix-vector product. Above it, an
+    IVF coarse quantizer (spherical k-means with ~sqrt(n) lists) is trained, the matrix is
+    reordered so that every list is a contiguous block, and queries only score the `nprobe`
+    closest blocks. Vectors added after training are kept in an exhaustively scored tail, and
+    the quantizer is retrained once the tail outgrows the trained part. Training happens on
+    the next search, so bulk loads such as reopening a store do not pay for it.
+
+    Removed vectors leave a tombstone (id -1) that queries skip; the matrix is rebuilt once
+    tombstones outnumber live vectors.
+    """
+    def __init__(self, dim: int, ivf_threshold: int = 20000, nprobe: int = 8, seed: int = 0):
+        self.dim = dim
+        self._ivf_threshold = ivf_threshold
+        self._nprobe = nprobe
+        self._rng = np.random.default_rng(seed)
+        self.reset()
+
+    def reset(self):
+        self._vectors = np.zeros((1024, self.dim), dtype=np.float32)
+        self._ids = np.zeros(1024, dtype=np.int64)
+        self._rows = {}
+        self._size = 0
+        self._removed = 0
+
+        # IVF state: rows [0, _trained) are grouped by list, rows [_trained, _size) are the tail
+        self._centroids = None
+        self._offsets = None
+        self._trained = 0
+
+    def __len__(self):
+        return self._size - self._removed
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        n = len(vectors)
+        if self._size + n > len(self._vectors):
+            capacity = max(2 * len(self._vectors), self._size + n)
+            self._vectors = np.resize(self._vectors, (capacity, self.dim))
+            self._ids = np.resize(self._ids, capacity)
+        self._vectors[self._size:self._size + n] = vectors
+        self._ids[self._size:self._size + n] = ids
+        for row, id in enumerate(ids, start=self._size):
+            self._rows[int(id)] = row
+        self._size += n
+
+    def remove(self, ids: Sequence[int]):
+        rows = [self._rows.pop(int(id)) for id in ids if int(id) in self._rows]
+        self._ids[rows] = -1
+        self._vectors[rows] = 0
+        self._removed += len(rows)
+
+        if self._removed > len(self):
+            live = self._ids[:self._size] >= 0
+            ids, vectors = self._ids[:self._size][live], self._vectors[:self._size][live]
+            self.reset()
+            self.add(ids, vectors)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the ids and cosine similarities of the (approximate) `k` nearest vectors."""
+        if self._size == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if self._size >= self._ivf_threshold and self._size - self._trained > self._trained:
+            self._train()
+        query = np.asarray(query, dtype=np.float32)
+
+        if self._centroids is None:
+            rows = None
+            scores = self._vectors[:self._size] @ query
+        else:
+            probe = np.argpartition(self._centroids @ query, -self._nprobe)[-self._nprobe:]
+            blocks = [(self._offsets[c], self._offsets[c + 1]) for c in probe] + [(self._trained, self._size)]
+            rows = np.concatenate([np.arange(start, end) for start, end in blocks])
+            scores = np.concatenate([self._vectors[start:end] @ query for start, end in blocks])
+
+        if self._removed > 0:
+            scores[(self._ids[:self._size] if rows is None else self._ids[rows]) < 0] = -np.inf
+
+        k = min(k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top = top[np.isfinite(scores[top])]
+        rows = top if rows is None else rows[top]
+        return self._ids[rows], scores[top]
+
+    def score(self, ids: Sequence[int], query: np.ndarray) -> np.ndarray:
+        """Exact cosine similarity between `query` and the vectors stored under `ids`."""
+        rows = np.fromiter((self._rows[int(id)] for id in ids), dtype=np.int64, count=len(ids))
+        return self._vectors[rows] @ np.asarray(query, dtype=np.float32)
+
+    def _train(self, iterations: int = 10, sample_size: int = 50000):
+        vectors = self._vectors[:self._size]
+        nlist = max(1, int(np.sqrt(self._size)))
+        self._nprobe = min(self._nprobe, nlist)
+
+        sample = vectors[self._rng.choice(self._size, size=min(sample_size, self._size), replace=False)]
+        centroids = sample[self._rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            # Sum each list's vectors as one contiguous run of the sorted sample
+            order = np.argsort(assignment, kind="stable")
+            lists, starts = np.unique(assignment[order], return_index=True)
+            sums = np.zeros_like(centroids)
+            sums[lists] = np.add.reduceat(sample[order], starts, axis=0)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Keep the previous centroid for lists that ended up empty
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+
+        assignment = np.empty(self._size, dtype=np.int64)
+        for start in range(0, self._size, 8192):
+            assignment[start:start + 8192] = np.argmax(vectors[start:start + 8192] @ centroids.T, axis=1)
+
+        order = np.argsort(assignment, kind="stable")
+        self._vectors[:self._size] = vectors[order]
+        self._ids[:self._size] = self._ids[order]
+        self._rows = {int(id): row for row, id in enumerate(self._ids[:self._size]) if id >= 0}
+
+        self._centroids = centroids
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+        self._trained = self._size
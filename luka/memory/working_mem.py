@@ -1,9 +1,18 @@
 from abc import ABC, abstractmethod
-from typing import Any, Tuple
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Optional, Tuple
 
 from luka.utils import Message
 
+from .recall_mem import RecallMemory
+from .token_counter import as_token_counter
+
 import textwrap
+import threading
+import uuid
 
 class WorkingMemory(ABC):
     @abstractmethod
@@ -23,74 +32,259 @@ class WorkingMemory(ABC):
         pass
 
 class FIFOConversationMemory(WorkingMemory):
-    def __init__(self, tokenize, summarize, max_size=2048, trigger_threshold=0.8, target_threshold=0.5):
-        self._message_queue = []
+    """
+    Keeps the most recent messages within `max_size` tokens. Once the history reaches
+    `trigger_threshold * max_size`, the oldest messages are evicted down to
+    `target_threshold * max_size` and summarized into a "system" summary at the head of the queue.
+
+    Summaries form a tree: every eviction is summarized on its own into a level-0 node, and
+    whenever `fanout` nodes of the same level are the newest ones, they are rolled up into one
+    node of the next level. The head of the queue shows the roots of the tree, i.e. O(log n)
+    nodes covering the whole history, and every summary is computed exactly once, so the tokens
+    sent to `summarize` grow linearly with the length of the conversation.
+
+    With `background=True`, `summarize` runs on a worker thread instead of blocking `insert`.
+    Until it returns, the evicted span is represented by a placeholder message, and evictions
+    that happen while a summary is in flight are coalesced into the next summarization call.
+
+    Entries of `_message_queue` are `(message, size, rendered)` triples in a deque, so every
+    message is wrapped by `Message.__str__` once, and the rendered history is cached and only
+    extended on append. `str(memory)` is therefore amortized O(1) per agent step.
+
+    `tokenize` may be a plain callable returning tokens or a shared `TokenCounter`.
+    """
+    def __init__(self, tokenize, summarize, max_size=2048, trigger_threshold=0.8, target_threshold=0.5, background=False, fanout=4):
+        self._message_queue = deque()
         self._current_size = 0
+        self._rendered = ""
 
-        self._tokenize = tokenize
+        self._count_tokens = as_token_counter(tokenize)
         self._summarize = summarize
 
         self._max_size = max_size
         self._trigger_threshold = trigger_threshold
         self._target_threshold = target_threshold
         assert self._trigger_threshold > self._target_threshold > 0, "Trigger threshold must be greater than target threshold, and both must be greater than 0."
+        assert fanout >= 2, "Fanout must be at least 2."
+        self._fanout = fanout
+
+        # `_summaries` holds the `(level, summary)` roots of the summary tree, oldest first, and
+        # `_evicted` the messages not summarized yet. While either is non-empty, the head of
+        # `_message_queue` shows the roots, plus a placeholder for pending messages.
+        self._summaries = []
+        self._evicted = []
+        self._has_summary_slot = False
+
+        self._lock = threading.RLock()
+        self._background = background
+        self._executor = ThreadPoolExecutor(max_workers=1) if background else None
+        self._summary_future = None
+        self._epoch = 0
     
     def reset(self):
-        self._message_queue = []
-        self._current_size = 0
+        with self._lock:
+            self._message_queue = deque()
+            self._current_size = 0
+            self._rendered = ""
+            self._summaries = []
+            self._evicted = []
+            self._has_summary_slot = False
+            self._summary_future = None
+            # Summaries still in flight belong to the old epoch and are dropped when they return
+            self._epoch += 1
     
     def insert(self, record: Message, pos=None):
-        self._message_queue.append((record, len(self._tokenize(str(record)))))
-        self._current_size += self._message_queue[-1][1]
+        with self._lock:
+            entry = self._make_entry(record)
+            self._message_queue.append(entry)
+            self._current_size += entry[1]
+            if self._rendered is not None:
+                self._rendered = entry[2] if len(self._message_queue) == 1 else self._rendered + "\n" + entry[2]
 
-        if self._current_size < self._max_size * self._trigger_threshold:
-            return
-        
-        popped_messages = []
-        while self._current_size > self._max_size * self._target_threshold:
-            msg, msg_size = self._message_queue.pop(0)
-            popped_messages.append(msg)
-            self._current_size -= msg_size
-        
-        if len(popped_messages) == 0:
-            return
-        
-        summary = self._summarize(popped_messages)
-        summary_msg = Message(content=summary, role="system", timestamp=popped_messages[-1].timestamp)
-        self._message_queue.insert(0, (summary_msg, len(self._tokenize(str(summary_msg)))))
+            if self._current_size < self._max_size * self._trigger_threshold:
+                return
+
+            first = 1 if self._has_summary_slot else 0
+            popped_messages = []
+            while self._current_size > self._max_size * self._target_threshold and len(self._message_queue) > first:
+                msg, msg_size, _ = self._pop_oldest()
+                popped_messages.append(msg)
+                self._current_size -= msg_size
+
+            if len(popped_messages) == 0:
+                return
+            self._evicted.extend(popped_messages)
+
+            if not self._background:
+                self._summarize_evicted(self._epoch)
+                return
+
+            self._set_summary_slot(self._placeholder())
+            if self._summary_future is None:
+                self._summary_future = self._executor.submit(self._summarize_evicted, self._epoch)
+
+    def flush(self, timeout=None):
+        """Block until no summarization is in flight."""
+        with self._lock:
+            future = self._summary_future
+        if future is not None:
+            future.result(timeout=timeout)
     
     def replace(self, record: Message, pos: int):
-        # check if pos is valid
-        if pos <= 0 or pos >= len(self._message_queue):
-            raise ValueError(f"Invalid position {pos} for replacement.")
-        self._current_size -= self._message_queue[pos][1]
-        self._message_queue[pos] = (record, len(self._tokenize(str(record))))
-        self._current_size += self._message_queue[pos][1]
+        with self._lock:
+            # check if pos is valid
+            if pos <= 0 or pos >= len(self._message_queue):
+                raise ValueError(f"Invalid position {pos} for replacement.")
+            self._current_size -= self._message_queue[pos][1]
+            self._message_queue[pos] = self._make_entry(record)
+            self._current_size += self._message_queue[pos][1]
+            self._rendered = None
 
     def __repr__(self) -> str:
-        return "\n".join([str(msg) for msg, _ in self._message_queue])
+        with self._lock:
+            if self._rendered is None:
+                self._rendered = "\n".join([rendered for _, _, rendered in self._message_queue])
+            return self._rendered
+
+    def _make_entry(self, msg: Message):
+        rendered = str(msg)
+        return (msg, self._count_tokens(rendered), rendered)
+
+    def _pop_oldest(self):
+        # The summary slot, if any, stays at the head of the queue
+        self._rendered = None
+        if not self._has_summary_slot:
+            return self._message_queue.popleft()
+        slot = self._message_queue.popleft()
+        entry = self._message_queue.popleft()
+        self._message_queue.appendleft(slot)
+        return entry
+
+    def _summarize_evicted(self, epoch):
+        finished = False
+        try:
+            while True:
+                with self._lock:
+                    if epoch != self._epoch:
+                        return
+                    level, batch = self._next_summary_job()
+                    if len(batch) == 0:
+                        # Cleared under the same lock that found nothing left, so any later
+                        # eviction submits a new job instead of relying on this one
+                        self._summary_future = None
+                        finished = True
+                        return
+
+                summary = self._summarize(batch)
+
+                # Only this loop touches `_summaries`, and `_evicted` is only appended to meanwhile
+                with self._lock:
+                    if epoch != self._epoch:
+                        return
+                    if level == 0:
+                        del self._evicted[:len(batch)]
+                    else:
+                        del self._summaries[-len(batch):]
+                    self._summaries.append((level, Message(content=summary, role="system", timestamp=batch[-1].timestamp)))
+                    self._set_summary_slot(self._summary_view() if len(self._evicted) == 0 else self._placeholder())
+        finally:
+            # Only reached with the future of this epoch still set if `summarize` raised
+            if not finished:
+                with self._lock:
+                    if epoch == self._epoch:
+                        self._summary_future = None
+
+    def _next_summary_job(self) -> Tuple[int, list]:
+        """Return the level of the next summary to compute and the messages it summarizes."""
+        tail = self._summaries[-self._fanout:]
+        if len(tail) == self._fanout and all(level == tail[0][0] for level, _ in tail):
+            return tail[0][0] + 1, [summary for _, summary in tail]
+        return 0, list(self._evicted)
+
+    def _summary_view(self) -> Message:
+        return Message(content="\n".join(summary.content for _, summary in self._summaries),
+                       role="system", timestamp=self._summaries[-1][1].timestamp)
+
+    def _placeholder(self) -> Message:
+        content = f"[{len(self._evicted)} earlier messages are being summarized]"
+        if len(self._summaries) > 0:
+            content = self._summary_view().content + "\n" + content
+        return Message(content=content, role="system", timestamp=self._evicted[-1].timestamp)
+
+    def _set_summary_slot(self, msg: Message):
+        entry = self._make_entry(msg)
+        if self._has_summary_slot:
+            self._current_size -= self._message_queue[0][1]
+            self._message_queue[0] = entry
+        else:
+            self._message_queue.appendleft(entry)
+            self._has_summary_slot = True
+        self._current_size += entry[1]
+        self._rendered = None
     
 
 class TextEditorMemory(WorkingMemory):
-    def __init__(self, tokenize, max_size=2048):
-        self._lines = []
-        self._current_size = 0
+    """
+    A line-numbered text file the agent can insert into and edit.
+
+    Lines live in a flat list with a parallel `array` of token counts, so a multi-line edit is
+    a single slice splice rather than one `list.insert` per line. Every line's wrapped
+    rendering is cached until the line is edited or the width of the line numbers changes,
+    and the whole rendering is cached until the next edit.
+
+    If a `recall` memory is given, `max_size` is enforced: whenever an edit pushes the file over
+    budget, the least recently edited runs of lines are paged out into recall memory and
+    replaced by a one-line stub naming the page, until the file fits again. Paged-out lines are
+    only kept in recall memory, under a header line with a key unique to the page, and
+    `page_in` reads them back from there in place of their stub.
+    """
+    _wrapper = textwrap.TextWrapper(subsequent_indent='\t', width=80)
+
+    # Stubs do not name line numbers, which would go stale with every edit above them
+    _STUB = "[{count} lines paged out to recall memory as page {page_id}]"
 
-        self._tokenize = tokenize
+    _PAGE_HEADER = "[text editor page {key}]"
+
+    def __init__(self, tokenize, max_size=2048, recall: Optional[RecallMemory] = None):
+        self._count_tokens = as_token_counter(tokenize)
         self._max_size = max_size
+        self._recall = recall
+        self.reset()
     
     def reset(self):
         self._lines = []
+        self._line_sizes = array("l")
         self._current_size = 0
+
+        # `_line_ticks[i]` is the edit counter value when line i was last written, or -1 for stubs
+        self._line_ticks = array("q")
+        self._tick = 0
+        self._next_page_id = 0
+        # Page keys are unique across resets and editors sharing one recall memory
+        self._page_namespace = uuid.uuid4().hex
+
+        # `_wrapped[i]` is line i rendered without its line number, valid for `_wrapped_width`
+        self._wrapped = []
+        self._wrapped_width = 0
+        self._line_numbers = []
+        self._rendered = None
     
     def insert(self, record: str, pos: int = -1):
-        new_lines = [(l.strip(), len(self._tokenize(l))) for l in record.split("\n")]
-        if pos == -1:
-            pos = len(self._lines)
-        for line in new_lines:
-            self._lines.insert(pos, line)
-            self._current_size += line[1]
-            pos += 1
+        """Insert `record` before line `pos`, counting from 0, or at the end with -1"""
+        if pos < -1:
+            raise ValueError(f"Invalid position {pos} for insertion.")
+        raw_lines = record.split("\n")
+        sizes = array("l", [self._count_tokens(l) for l in raw_lines])
+        pos = len(self._lines) if pos == -1 else min(pos, len(self._lines))
+
+        self._lines[pos:pos] = [l.strip() for l in raw_lines]
+        self._line_sizes[pos:pos] = sizes
+        self._wrapped[pos:pos] = [None] * len(raw_lines)
+        self._current_size += sum(sizes)
+        self._tick += 1
+        self._line_ticks[pos:pos] = array("q", [self._tick]) * len(raw_lines)
+        self._rendered = None
+        self._enforce_budget()
     
     def replace(self, record: str, pos: Tuple[int, int]):
         if pos[0] > pos[1] or pos[0] * pos[1] < 0:
@@ -98,24 +292,110 @@ class TextEditorMemory(WorkingMemory):
         if pos[0] < 0 and pos[1] <= 0:
             pos = (pos[0] + len(self._lines), pos[1] + len(self._lines))
         
-        for line in self._lines[pos[0]:pos[1]]:
-            self._current_size -= line[1]
+        self._current_size -= sum(self._line_sizes[pos[0]:pos[1]])
         del self._lines[pos[0]:pos[1]]
+        del self._line_sizes[pos[0]:pos[1]]
+        del self._wrapped[pos[0]:pos[1]]
+        del self._line_ticks[pos[0]:pos[1]]
 
         self.insert(record, pos[0])
 
+    def page_in(self, page_id: int):
+        """Replace the stub of a paged-out region with its original lines, read from recall memory"""
+        stub = next((i for i, tick in enumerate(self._line_ticks)
+                     if tick < 0 and self._lines[i].endswith(f" as page {page_id}]")), None)
+        if stub is None:
+            raise ValueError(f"Page {page_id} is not paged out of the file.")
+        header = self._PAGE_HEADER.format(key=self._page_key(page_id))
+        page = next((msg for msg in self._recall.search(text=self._page_key(page_id), roles=["txt"], limit=5)
+                     if msg.content.startswith(header + "\n")), None)
+        if page is None:
+            raise ValueError(f"Page {page_id} is no longer in recall memory.")
+        self.replace(page.content[len(header) + 1:], (stub, stub + 1))
+
+    def _page_key(self, page_id: int) -> str:
+        # A single alphanumeric word, so that it is one term for the recall memory's text search
+        return f"{self._page_namespace}p{page_id}"
+
+    def _enforce_budget(self):
+        if self._recall is None:
+            return
+        while self._current_size > self._max_size:
+            region = self._coldest_region()
+            if region is None:
+                break
+            self._page_out(*region)
+
+    def _coldest_region(self) -> Optional[Tuple[int, int]]:
+        """
+        Find the run of lines with the oldest edit tick, grown until paging it out actually
+        saves tokens. Runs that save nothing even when grown, e.g. a short line between stubs,
+        are passed over for the next-oldest ones. Stubs and the lines written by the latest
+        edit are never paged out.
+        """
+        ticks = self._line_ticks
+        # Starts of runs of lines written by the same edit, oldest edit first
+        starts = sorted((ticks[i], i) for i in range(len(ticks))
+                        if 0 <= ticks[i] < self._tick and (i == 0 or ticks[i - 1] != ticks[i]))
+        for tick, start in starts:
+            end = start
+            saved = 0
+            while end < len(ticks) and 0 <= ticks[end] < self._tick:
+                if ticks[end] != tick and saved > self._stub_size(start, end):
+                    break
+                saved += self._line_sizes[end]
+                end += 1
+            if saved > self._stub_size(start, end):
+                return start, end
+        return None
+
+    def _stub_size(self, start: int, end: int) -> int:
+        return self._count_tokens(self._STUB.format(count=end - start, page_id=self._next_page_id))
+
+    def _page_out(self, start: int, end: int):
+        page_id = self._next_page_id
+        self._next_page_id += 1
+        header = self._PAGE_HEADER.format(key=self._page_key(page_id))
+        self._recall.insert(Message(role="txt", content="\n".join([header] + self._lines[start:end]), timestamp=datetime.now()))
+
+        stub = self._STUB.format(count=end - start, page_id=page_id)
+        self._current_size -= sum(self._line_sizes[start:end])
+        self._lines[start:end] = [stub]
+        self._line_sizes[start:end] = array("l", [self._count_tokens(stub)])
+        self._wrapped[start:end] = [None]
+        self._line_ticks[start:end] = array("q", [-1])
+        self._current_size += self._line_sizes[start]
+        self._rendered = None
 
     def __repr__(self) -> str:
+        if self._rendered is not None:
+            return self._rendered
+
         num_width = len(str(len(self._lines)))  # Calculate the width needed for line numbers
-        result = ""
+        if num_width != self._wrapped_width:
+            self._wrapped = [None] * len(self._lines)
+            self._wrapped_width = num_width
+            self._line_numbers = []
+        # Right-aligned line numbers only depend on the width, so they are kept across edits
+        for i in range(len(self._line_numbers), len(self._lines)):
+            self._line_numbers.append(str(i + 1).rjust(num_width))
 
-        wrapper = textwrap.TextWrapper(subsequent_indent='\t', width=80)
-        for i, line in enumerate(self._lines, start=1):
-            line_num = str(i).rjust(num_width)  # Right-align line numbers
-            result += wrapper.fill(f"{line_num}| {line[0]}") + "\n"
-        
-        return result
-        
-        
-        
-        
\ No newline at end of file
+        # Only wrap lines that were edited since the last render
+        i = 0
+        try:
+            while True:
+                i = self._wrapped.index(None, i)
+                self._wrapped[i] = self._wrap(self._lines[i], num_width)
+        except ValueError:
+            pass
+
+        parts = [None] * (2 * len(self._lines))
+        parts[::2] = self._line_numbers[:len(self._lines)]
+        parts[1::2] = self._wrapped
+        self._rendered = "".join(parts)
+        return self._rendered
+
+    def _wrap(self, line: str, num_width: int) -> str:
+        # Every line number has the same width, so wrapping with a placeholder number and
+        # cutting it off again gives the same result as wrapping with the real one.
+        return self._wrapper.fill(f"{'0' * num_width}| {line}")[num_width:] + "\n"
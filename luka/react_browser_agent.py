@@ -8,7 +8,7 @@ from termcolor import colored
 from datetime import datetime
 
 from luka.tools import SeleniumSandbox
-from luka.memory import FIFOConversationMemory, TextEditorMemory
+from luka.memory import FIFOConversationMemory, TextEditorMemory, TokenCounter, TransientRecallMemory
 from luka.utils import Message
 
 
@@ -59,6 +59,7 @@ You can issue these commands:
     Txt file edit commands:
     TINSERT <LINE_NO> <TEXT> - insert text at the specified line number
     TREPLACE <FROM_LINE_NO> <TO_LINE_NO> <TEXT> - replace existing text from the range with new text
+    TPAGEIN <PAGE_ID> - restore lines that were paged out of the txt file, replacing their stub line
 
     User interaction commands:
     YIELD <TEXT> - yield control to user with a message in <TEXT>;
@@ -154,19 +155,26 @@ class ReActBrowserAgent:
             summary = response["choices"][0]["message"]["content"]
             return summary
         
+        # Shared by both memories, so a record is only ever tokenized once
+        token_counter = TokenCounter(litellm_tokenize, model=self._model)
+
         self._fifo_mem = FIFOConversationMemory(
-            tokenize=litellm_tokenize, 
+            tokenize=token_counter, 
             summarize=litellm_summarize, 
             max_size=1024, 
             trigger_threshold=0.8, 
-            target_threshold=0.5
+            target_threshold=0.5,
+            background=True
         )
-        self._txt_mem = TextEditorMemory(tokenize=litellm_tokenize, max_size=1024)
+        # Cold parts of the txt file are paged out here once it outgrows its budget
+        self._txt_pages = TransientRecallMemory()
+        self._txt_mem = TextEditorMemory(tokenize=token_counter, max_size=1024, recall=self._txt_pages)
     
     def reset(self):
         self._sandbox.reset()
         self._fifo_mem.reset()
         self._txt_mem.reset()
+        self._txt_pages.reset()
 
     def _get_feedback(self, msg:str) -> str:
         print(colored("agent: ", "light_green", attrs=["bold"]), colored(msg, "light_green"))
@@ -203,6 +211,13 @@ class ReActBrowserAgent:
             except Exception as e:
                 exception_msg = str(e)
                 return False, [Message(role="txt", content=f"Action unsuccessful, an exception occured: {exception_msg}", timestamp=datetime.now())]
+        elif command == "TPAGEIN":
+            try:
+                self._txt_mem.page_in(int(args[0]))
+                return False, [Message(role="txt", content=f"Page {args[0]} restored", timestamp=datetime.now())]
+            except Exception as e:
+                exception_msg = str(e)
+                return False, [Message(role="txt", content=f"Action unsuccessful, an exception occured: {exception_msg}", timestamp=datetime.now())]
 
         # Browser-related commands
         if command == "VISIT":
@@ -1,4 +1,5 @@
 from .envs import TextualBrowserEnv
+from .vector import GymnasiumStepWrapper, make_vector_env
 
 from gymnasium.envs.registration import register
 
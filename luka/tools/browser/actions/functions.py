@@ -1,6 +1,7 @@
+import functools
 import validators
 
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Optional
 from selenium import webdriver
 from selenium.common import exceptions as E
 from selenium.webdriver.remote.webelement import WebElement
@@ -12,6 +13,8 @@ from .common import ActionResult, TAGS_CLICKABLE, TAGS_FILLABLE
 
 
 def handle_timeout(func):
+    # Wrapped actions keep their name, so the action table can be pickled by reference
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
@@ -21,12 +24,43 @@ def handle_timeout(func):
             return ActionResult(True, f"Action timed out. Stopped loading page.")
     return wrapper
 
-def _scroll_into_view_if_needed(driver: webdriver.Chrome, element: WebElement):
-    # NOTE: This method is not supported in all browsers, e.g., Firefox
-    #       Check https://developer.mozilla.org/en-US/docs/Web/API/Element/scrollIntoViewIfNeeded
-    driver.execute_script(
-        "arguments[0].scrollIntoViewIfNeeded(true);", 
-        element)
+# Resolves an element handle from the observation and prepares the element for interaction,
+# all in one script call. Returns null if the element is no longer attached to the DOM.
+# NOTE: scrollIntoViewIfNeeded is not supported in all browsers, e.g., Firefox
+#       Check https://developer.mozilla.org/en-US/docs/Web/API/Element/scrollIntoViewIfNeeded
+js_resolve_element = """
+    const extractor = window.__textualBrowserEnv;
+    var element = null;
+    if (arguments[0] !== null) {
+        element = extractor === undefined ? null : extractor.resolve(arguments[0]);
+    } else if (window.__textualBrowserEnvTarget !== undefined) {
+        // Left here by `js_stash_target`
+        element = window.__textualBrowserEnvTarget.isConnected ? window.__textualBrowserEnvTarget : null;
+        delete window.__textualBrowserEnvTarget;
+    }
+    if (element !== null) {
+        if (arguments[1]) {
+            // Override target attribute in order to open in the same tab
+            element.removeAttribute('target');
+        }
+        element.scrollIntoViewIfNeeded(true);
+    }
+    return element;
+"""
+
+# Called on a node resolved through the DevTools protocol, which WebDriver cannot refer to
+js_stash_target = "function() { window.__textualBrowserEnvTarget = this; }"
+
+def _resolve_element(driver: webdriver.Chrome, element: Dict, same_tab: bool=False) -> Optional[WebElement]:
+    handle = element.get("handle")
+    if handle is None:
+        # Extracted from a DOMSnapshot, so the element is known by its backend node id only
+        try:
+            node = driver.execute_cdp_cmd("DOM.resolveNode", {"backendNodeId": element["backend_node_id"]})
+            driver.execute_cdp_cmd("Runtime.callFunctionOn", {"objectId": node["object"]["objectId"], "functionDeclaration": js_stash_target})
+        except E.WebDriverException:
+            return None
+    return driver.execute_script(js_resolve_element, handle, same_tab)
 
 
 @handle_timeout
@@ -61,17 +95,12 @@ def click(
     if element["tag"] not in TAGS_CLICKABLE:
         return ActionResult(False, f"Element with id={id} is not clickable.")
     
-    # Override target attribute in order to open in the same tab
-    remove_target_attr_script = """
-        var element = arguments[0];
-        element.removeAttribute('target');
-    """
-    driver.execute_script(remove_target_attr_script, element["element"])
-    
-    _scroll_into_view_if_needed(driver, element["element"])
+    web_element = _resolve_element(driver, element, same_tab=True)
+    if web_element is None:
+        return ActionResult(False, f"Element with id={id} is no longer attached to the DOM.")
 
     try:
-        element["element"].click()
+        web_element.click()
     except E.ElementClickInterceptedException:
         return ActionResult(False, f"Element with id={id} is obscured by another element.")
     except E.ElementNotInteractableException:
@@ -105,10 +134,15 @@ def scroll(
         driver: webdriver.Chrome, 
         element_idx: Dict,
         scroll_down: bool=True, 
-        duration_ms: int=1000
+        duration_ms: int=0
     ) -> ActionResult:
         scroll_direction = "+" if scroll_down else "-"
 
+        # Lazily loaded content is waited for by the environment after the action
+        if duration_ms <= 0:
+            driver.execute_script(f"window.scrollTo({{top: window.pageYOffset {scroll_direction} window.innerHeight, behavior: 'instant'}});")
+            return ActionResult(True)
+
         completion_signal = "scroll_complete"
         
         ease_out_scroll_script = f"""
@@ -169,14 +203,16 @@ def fill(
     if element["tag"] not in TAGS_FILLABLE:
         return ActionResult(False, f"Element with id={id} is not fillable.")
     
-    _scroll_into_view_if_needed(driver, element["element"])
+    web_element = _resolve_element(driver, element)
+    if web_element is None:
+        return ActionResult(False, f"Element with id={id} is no longer attached to the DOM.")
     
     try:
         if clear:
-            element["element"].clear()
-        element["element"].send_keys(value)
+            web_element.clear()
+        web_element.send_keys(value)
         if submit:
-            element["element"].send_keys(Keys.RETURN)
+            web_element.send_keys(Keys.RETURN)
     except E.ElementNotInteractableException:
         return ActionResult(False, f"Element with id={id} is not interactable.")
     except E.ElementNotVisibleException:
@@ -0,0 +1,310 @@
+import math
+import re
+
+from typing import Dict, List
+from selenium import webdriver
+
+from .observations import PageSnapshot, assign_ids, _to_scroll_status
+
+# Same categories as retrieve_elements.js
+TAGS_CONTENT = {"h1", "h2", "h3", "h4", "h5", "h6", "p", "br", "hr"}
+TAGS_FORMAT_INLINE = {"abbr", "b", "bdi", "bdo", "cite", "del", "dfn", "em", "i", "ins", "kbd", "mark", "meter", "progress", "q", "rp", "rt", "ruby", "s", "small", "strong", "sub", "sup", "time", "u", "var", "wbr"}
+TAGS_FORMAT_BLOCK = {"address", "blockquote", "code", "pre", "samp", "template"}
+TAGS_FRAMES = {"iframe"}
+TAGS_IMAGES = {"img", "map", "area", "canvas", "figcaption", "figure", "picture", "svg"}
+TAGS_AV = {"audio", "video", "source", "track"}
+TAGS_LINKS = {"a", "link", "nav"}
+TAGS_LISTS = {"menu", "ol", "ul", "li", "dir", "dl", "dt", "dd"}
+TAGS_SEMANTICS = {"style", "div", "span", "header", "hgroup", "footer", "main", "section", "search", "article", "aside", "details", "dialog", "summary", "data"}
+TAGS_META = {"head", "meta", "base", "basefont"}
+TAGS_PROGRAMMING = {"script", "noscript", "applet", "embed", "object", "param"}
+TAGS_SKIPPED = TAGS_META | TAGS_PROGRAMMING | TAGS_FRAMES | {"style"}
+
+# [key in the representation, attribute name]
+ATTRIBUTES = [
+    ("name", "name"), ("type", "type"), ("placeholder", "placeholder"), ("aria_label", "aria-label"),
+    ("title", "title"), ("alt", "alt"), ("checked", "checked"), ("value", "value"),
+    ("required", "required"), ("min", "min"), ("max", "max"),
+]
+
+COMPUTED_STYLES = ["visibility", "opacity", "content-visibility"]
+
+ELEMENT_NODE = 1
+TEXT_NODE = 3
+
+# Characters removed by String.prototype.trim
+_JS_WHITESPACE = "\t\n\v\f\r \u00a0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000\ufeff"
+
+
+def get_dom_snapshot(driver: webdriver.Chrome) -> PageSnapshot:
+    """
+    Extract the same elements as `get_snapshot`, from a DevTools `DOMSnapshot.captureSnapshot`
+    instead of a script that walks the DOM. Elements refer to the page by `backend_node_id`
+    rather than by handle, and the snapshot has no version, so every call extracts anew.
+    """
+    metrics = driver.execute_cdp_cmd("Page.getLayoutMetrics", {})
+    snapshot = driver.execute_cdp_cmd("DOMSnapshot.captureSnapshot", {"computedStyles": COMPUTED_STYLES})
+    viewport = metrics["cssLayoutViewport"]
+    width, height = viewport["clientWidth"], viewport["clientHeight"]
+
+    document = snapshot["documents"][0]
+    elements, idx_map = assign_ids(DOMSnapshotTree(snapshot).retrieve_elements_from_viewport(width, height))
+    scroll_status = _to_scroll_status(
+        document["scrollOffsetY"], document["contentHeight"] - height,
+        document["scrollOffsetX"], document["contentWidth"] - width
+    )
+    return PageSnapshot(elements, idx_map, scroll_status, snapshot["strings"][document["documentURL"]], None)
+
+
+class DOMSnapshotTree:
+    """
+    The main document of a `DOMSnapshot.captureSnapshot` result, with the element extraction of
+    retrieve_elements.js ported to its flat node arrays. Shadow roots, pseudo elements and
+    frame documents are left out, as they are not reachable through `childNodes` either.
+    """
+    def __init__(self, snapshot: Dict):
+        strings = snapshot["strings"]
+        document = snapshot["documents"][0]
+        nodes, layout = document["nodes"], document["layout"]
+        n = len(nodes["parentIndex"])
+
+        # Layout bounds are relative to the document, the extraction is relative to the viewport
+        self._scroll_x, self._scroll_y = document["scrollOffsetX"], document["scrollOffsetY"]
+
+        self._strings = strings
+        self._parents = nodes["parentIndex"]
+        self._types = nodes["nodeType"]
+        self._backend_ids = nodes["backendNodeId"]
+        self._values = nodes["nodeValue"]
+        # Attributes are only parsed for the elements that are extracted
+        self._raw_attributes = nodes.get("attributes", [[]] * n)
+        self._attributes = {}
+        names = {name: strings[name].lower() for name in set(nodes["nodeName"])}
+        self._tags = [names[name] for name in nodes["nodeName"]]
+        pseudo = set(nodes.get("pseudoType", {}).get("index", []))
+
+        # Layout is only recorded for nodes that have a box
+        self._bounds = {}
+        styles = {}
+        for li, i in enumerate(layout["nodeIndex"]):
+            self._bounds[i] = layout["bounds"][li]
+            styles[i] = [strings[s] if s >= 0 else "" for s in layout["styles"][li]]
+
+        # Nodes are in document order, so parents come before their children
+        self._children = [[] for _ in range(n)]
+        self._in_tree = [False] * n
+        self._visible = [False] * n
+        self._subtree_end = list(range(1, n + 1))
+        transparent = [False] * n
+        skipped = [False] * n
+        for i in range(n):
+            p = self._parents[i]
+            if p < 0:
+                self._in_tree[i] = True
+            elif self._in_tree[p] and self._types[i] in (ELEMENT_NODE, TEXT_NODE) and i not in pseudo:
+                self._in_tree[i] = True
+                self._children[p].append(i)
+                transparent[i] = transparent[p]
+                skipped[i] = skipped[p] or (p in styles and styles[p][2] == "hidden")
+            if i in styles:
+                visibility, opacity, _ = styles[i]
+                transparent[i] = transparent[i] or opacity == "0"
+                # Like Element.checkVisibility with opacityProperty and visibilityProperty
+                self._visible[i] = visibility not in ("hidden", "collapse") and not transparent[i] and not skipped[i]
+        for i in reversed(range(n)):
+            p = self._parents[i]
+            if p >= 0:
+                self._subtree_end[p] = max(self._subtree_end[p], self._subtree_end[i])
+
+    def retrieve_elements_from_viewport(self, width: float, height: float) -> List[Dict]:
+        """
+        Elements within every element whose box is centered in the viewport, unless it lies
+        within an earlier one, with the `viewport_offset` of their root.
+        """
+        result_list = []
+        root_end = -1
+        for i in range(len(self._types)):
+            if not self._in_tree[i] or self._types[i] != ELEMENT_NODE or i < root_end or i not in self._bounds:
+                continue
+            x, y, w, h = self._bounds[i]
+            x, y = x - self._scroll_x, y - self._scroll_y
+            center_x, center_y = x + w / 2, y + h / 2
+            if not (0 <= center_x <= width and 0 <= center_y <= height and 0 < w < width and 0 < h < height):
+                continue
+            root_end = self._subtree_end[i]
+            # Rounded like Math.round
+            offset = math.floor(center_y - height / 2 + 0.5)
+            for e in self._retrieve_elements(i):
+                e["viewport_offset"] = offset
+                _append_element(result_list, e)
+        return result_list
+
+    def _attributes_of(self, i: int) -> Dict[str, str]:
+        if i not in self._attributes:
+            attrs, strings = self._raw_attributes[i], self._strings
+            self._attributes[i] = {strings[attrs[k]]: strings[attrs[k + 1]] for k in range(0, len(attrs), 2)}
+        return self._attributes[i]
+
+    def _representation(self, i: int, tag: str, content) -> Dict:
+        obj = {"tag": tag}
+        if tag != "text":
+            obj["backend_node_id"] = self._backend_ids[i]
+            attributes = self._attributes_of(i)
+            for key, name in ATTRIBUTES:
+                if name in attributes:
+                    obj[key] = attributes[name]
+        if isinstance(content, str):
+            obj["text"] = content
+        elif isinstance(content, list):
+            obj["children"] = content
+        return obj
+
+    def _matches(self, i: int, tag: str, types=(), roles=()) -> bool:
+        if self._tags[i] != tag:
+            return False
+        attributes = self._attributes_of(i)
+        if tag == "input":
+            return attributes.get("type", "").lower() in types
+        return attributes.get("role") in roles
+
+    def _retrieve_elements(self, i: int) -> List[Dict]:
+        tag = self._tags[i]
+
+        def text(content: str) -> Dict:
+            return self._representation(i, "text", content)
+
+        # Skip meta, programming, and frames tags
+        if tag in TAGS_SKIPPED:
+            return []
+
+        # Skip invisible elements
+        if not self._visible[i] and tag != "option":
+            return []
+
+        # Get representations of children, including text and element nodes.
+        el_list = []
+        for child in self._children[i]:
+            if self._types[child] == TEXT_NODE:
+                value = self._strings[self._values[child]] if self._values[child] >= 0 else ""
+                postfix = "\n" if value.endswith("\n") else ""
+                _append_element(el_list, text(value.strip(_JS_WHITESPACE) + postfix))
+            else:
+                for e in self._retrieve_elements(child):
+                    _append_element(el_list, e)
+
+        # Forms
+        if tag == "textarea" or self._matches(i, "input", types=("text", "password", "email", "search", "number", "tel", "url")):
+            return [self._representation(i, "textinput", el_list)]
+        if self._matches(i, "input", types=("date", "datetime-local", "month", "week", "time")):
+            return [self._representation(i, "datepicker", el_list)]
+        if self._matches(i, "input", types=("button", "submit", "reset")) or self._matches(i, "div", roles=("button",)) or self._matches(i, "span", roles=("button",)):
+            return [self._representation(i, "button", el_list)]
+        if tag == "select" or self._matches(i, "div", roles=("combobox", "listbox")):
+            return [self._representation(i, "select", el_list)]
+        if tag == "optgroup":
+            return [self._representation(i, "optgroup", el_list)]
+        if tag == "option" or self._matches(i, "div", roles=("option",)) or self._matches(i, "span", roles=("option",)):
+            _prepend_element(el_list, text("\n* "))
+            return el_list
+        if self._matches(i, "input", types=("checkbox",)) or self._matches(i, "div", roles=("checkbox",)) or self._matches(i, "span", roles=("checkbox",)):
+            return [self._representation(i, "checkbox", el_list)]
+        if self._matches(i, "input", types=("radio",)):
+            return [self._representation(i, "radio", el_list)]
+
+        # Links
+        if tag in TAGS_LINKS:
+            if tag in ("a", "link"):
+                el_list = [self._representation(i, "link", el_list)]
+            return el_list
+
+        # Images and AV
+        if tag in TAGS_IMAGES or tag in TAGS_AV:
+            return [self._representation(i, tag, el_list)]
+
+        # Lists
+        if tag in TAGS_LISTS:
+            if tag == "li":
+                _prepend_element(el_list, text("\n* "))
+            if tag in ("menu", "ol", "ul", "dl"):
+                _prepend_element(el_list, text("\n"))
+                _append_element(el_list, text("\n"))
+            if tag == "dt":
+                _append_element(el_list, text("\n"))
+            if tag == "dd":
+                _prepend_element(el_list, text("\n\t"))
+            return el_list
+
+        # Content Tags
+        _trim_list(el_list)
+
+        if tag == "hr":
+            _prepend_element(el_list, text("\n------"))
+            _append_element(el_list, text("\n"))
+            return el_list
+        if tag == "br":
+            if len(el_list) > 0:
+                _prepend_element(el_list, text("\n"))
+                return el_list
+            _append_element(el_list, text("\n"))
+            return el_list
+        if tag == "p":
+            _prepend_element(el_list, text("\n"))
+            _append_element(el_list, text("\n"))
+            return el_list
+        if re.fullmatch(r"h[1-6]", tag):
+            _prepend_element(el_list, text("\n" + "#" * int(tag[1]) + " "))
+            _append_element(el_list, text("\n"))
+            return el_list
+
+        # Format Tags
+        if tag in TAGS_FORMAT_INLINE:
+            l = r = ""
+            if tag in ("b", "strong", "em", "ins", "mark"):
+                l = r = "**"
+            elif tag in ("i", "sub", "dfn", "var"):
+                l = r = "_"
+            elif tag == "u":
+                l, r = "<u>", "</u>"
+            elif tag in ("s", "del"):
+                l = r = "~~"
+            _prepend_element(el_list, text(" " + l))
+            _append_element(el_list, text(r + " "))
+            return el_list
+        if tag in TAGS_FORMAT_BLOCK:
+            _prepend_element(el_list, text("\n```\n"))
+            _append_element(el_list, text("\n```\n"))
+            return el_list
+
+        # Semantics Tags
+        if tag in TAGS_SEMANTICS:
+            if tag == "span":
+                return el_list
+            if len(el_list) > 0:
+                _prepend_element(el_list, text("\n"))
+                _append_element(el_list, text("\n"))
+            return el_list
+
+        # Default
+        if len(el_list) == 0:
+            return el_list
+        _append_element(el_list, text("\n"))
+        return el_list
+
+
+def _trim_list(el_list: List[Dict]):
+    if len(el_list) > 0 and el_list[0]["tag"] == "text":
+        el_list[0]["text"] = el_list[0]["text"].lstrip(_JS_WHITESPACE)
+    if len(el_list) > 0 and el_list[-1]["tag"] == "text":
+        el_list[-1]["text"] = el_list[-1]["text"].rstrip(_JS_WHITESPACE)
+
+def _append_element(el_list: List[Dict], el: Dict):
+    if len(el_list) > 0 and el_list[-1]["tag"] == el["tag"] and el["tag"] == "text":
+        el_list[-1]["text"] += el["text"]
+    else:
+        el_list.append(el)
+
+def _prepend_element(el_list: List[Dict], el: Dict):
+    if len(el_list) > 0 and el_list[0]["tag"] == el["tag"] and el["tag"] == "text":
+        el_list[0]["text"] = el["text"] + el_list[0]["text"]
+    else:
+        el_list.insert(0, el)
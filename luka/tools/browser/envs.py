@@ -1,16 +1,30 @@
+import re
+import time
+
 import gymnasium as gym
 import validators
 
-from typing import Tuple, List, Dict
+from typing import Callable, Tuple, List, Dict, Iterable, Optional
 from selenium import webdriver
 
+from luka.memory.token_counter import as_token_counter
+
 from .spaces import Unicode, AnyDict
 from .observations import *
+from .dom_snapshot import get_dom_snapshot
+from .settle import install_activity_monitor, wait_for_settle
 from .actions import ActionResult, DEFAULT_ACTIONS
 
 
 TEXT_MAX_LENGTH = 2**32-1
 
+OBS_FIELDS = ("url", "scroll_status", "screenshot_base64", "page_text", "action_result")
+
+EXTRACTION_BACKENDS = ("js", "cdp")
+
+# Words and punctuation marks, which is about what subword tokenizers produce for English text
+_approximate_tokenize = re.compile(r"\w+|[^\w\s]").findall
+
 class TextualBrowserEnv(gym.Env):
     metadata = {"render_modes": None}
 
@@ -19,10 +33,31 @@ class TextualBrowserEnv(gym.Env):
             viewport: Tuple[int, int] = (1024, 768), 
             headless: bool = False,
             timeout_s: int = 20,
-            actions: Dict = DEFAULT_ACTIONS
+            actions: Dict = DEFAULT_ACTIONS,
+            obs_fields: Optional[Iterable[str]] = None,
+            max_page_tokens: Optional[int] = None,
+            tokenize: Optional[Callable[[str], List]] = None,
+            extraction_backend: str = "js",
+            settle_timeout_s: float = 3.0,
+            settle_quiet_ms: int = 150,
+            start_url: str = "about:blank"
         ):
+        """
+        `obs_fields` picks which of `OBS_FIELDS` observations contain, all by default, and
+        `max_page_tokens` caps "page_text" as counted by `tokenize`. `extraction_backend` is one
+        of `EXTRACTION_BACKENDS`, and `settle_timeout_s` (0 disables it) bounds the wait after
+        each action, see `step`.
+        """
         super().__init__()
 
+        self._obs_fields = OBS_FIELDS if obs_fields is None else tuple(obs_fields)
+        unknown = [field for field in self._obs_fields if field not in OBS_FIELDS]
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown observation fields {unknown}, supported fields are {list(OBS_FIELDS)}.")
+        if extraction_backend not in EXTRACTION_BACKENDS:
+            raise ValueError(f"Unknown extraction backend `{extraction_backend}`, supported backends are {list(EXTRACTION_BACKENDS)}.")
+        self._extraction_backend = extraction_backend
+
         options = webdriver.ChromeOptions()
         if headless:
             options.add_argument("--headless")
@@ -30,6 +65,7 @@ class TextualBrowserEnv(gym.Env):
         options.add_argument(f"--window-size={viewport[0]},{viewport[1]}")
         self._driver = webdriver.Chrome(options=options)
         self._driver.set_page_load_timeout(timeout_s)
+        install_activity_monitor(self._driver)
 
         # All printable elements on the page with their useful attributes
         self._elements: List[Dict] = []
@@ -37,55 +73,119 @@ class TextualBrowserEnv(gym.Env):
         # Interactable elements on the page, indexed by id
         self._element_index: Dict[int, Dict] = {}
 
+        # Latest page snapshot, whose elements are reused while the page is unchanged
+        self._snapshot: Optional[PageSnapshot] = None
+
+        # Latest observation, returned again by steps that find the page unchanged
+        self._obs: Optional[Dict] = None
+        self._obs_cached = False
+
+        self._start_url = start_url
+
         # Supported actions
         self._actions = actions
 
+        self._max_page_tokens = max_page_tokens
+        self._count_tokens = as_token_counter(_approximate_tokenize if tokenize is None else tokenize)
+
         # Result of the last action
         self._action_result: ActionResult = ActionResult(True)
 
-        self.observation_space = gym.spaces.Dict({
+        # How long the page took to settle after the last action
+        self._settle_timeout_s = settle_timeout_s
+        self._settle_quiet_ms = settle_quiet_ms
+        self._settle_time_s = 0.0
+        self._settle_timed_out = False
+
+        obs_spaces = {
             "url": Unicode(min_length=0, max_length=TEXT_MAX_LENGTH),
             "scroll_status": AnyDict(),
             "screenshot_base64": Unicode(min_length=0, max_length=TEXT_MAX_LENGTH),
             "page_text": Unicode(min_length=0,max_length=TEXT_MAX_LENGTH),
             "action_result": AnyDict(),
-        })
+        }
+        self.observation_space = gym.spaces.Dict({field: obs_spaces[field] for field in self._obs_fields})
 
         self.action_space = gym.spaces.Dict({
             "command": Unicode(min_length=0, max_length=TEXT_MAX_LENGTH),
-            "args": AnyDict(),
+            "parameters": AnyDict(),
         })
 
-    def _get_obs(self):
-        self._elements, self._element_index = retrieve_elements_from_viewport(self._driver)
-
-        return {
-            "url": self._driver.current_url,
-            "scroll_status": get_scroll_status(self._driver),
-            "screenshot_base64": self._driver.get_screenshot_as_base64(),
-            "page_text": get_text_representation(self._elements),
-            "action_result": {
+    def _get_obs(self, reuse: bool = False):
+        """
+        Fields left out of `obs_fields` are never computed, e.g. dropping "screenshot_base64"
+        skips the screenshot. The "js" backend scans the page with a resident script, "cdp"
+        rebuilds the same elements from a DOMSnapshot, see `get_dom_snapshot`.
+
+        With `reuse`, the previous observation is returned if the page has not changed since,
+        i.e. its url, mutation count, scroll offset and viewport size are the same. Only the
+        action result is updated. Without it, e.g. after an executed action, the viewport is
+        always scanned again, see `get_snapshot`.
+        """
+        self._obs_cached = reuse and self._obs is not None and is_unchanged(self._driver, self._snapshot)
+        if self._obs_cached:
+            obs = dict(self._obs)
+            if "action_result" in self._obs_fields:
+                obs["action_result"] = {
+                    "success": self._action_result.success,
+                    "message": self._action_result.message,
+                }
+            return obs
+
+        # The element index is needed by the actions, so the snapshot is always taken
+        if self._extraction_backend == "cdp":
+            self._snapshot = get_dom_snapshot(self._driver)
+        else:
+            self._snapshot = get_snapshot(self._driver, self._snapshot, fresh=not reuse)
+        self._elements, self._element_index = self._snapshot.elements, self._snapshot.element_index
+        scroll_status, url = self._snapshot.scroll_status, self._snapshot.url
+
+        obs = {}
+        if "url" in self._obs_fields:
+            obs["url"] = url
+        if "scroll_status" in self._obs_fields:
+            obs["scroll_status"] = scroll_status
+        if "screenshot_base64" in self._obs_fields:
+            obs["screenshot_base64"] = self._driver.get_screenshot_as_base64()
+        if "page_text" in self._obs_fields:
+            if self._max_page_tokens is None:
+                obs["page_text"] = get_text_representation(self._elements)
+            else:
+                obs["page_text"] = get_budgeted_text_representation(self._elements, self._max_page_tokens, self._count_tokens)
+        if "action_result" in self._obs_fields:
+            obs["action_result"] = {
                 "success": self._action_result.success,
                 "message": self._action_result.message,
-            },
-        }
+            }
+        self._obs = obs
+        return obs
 
     def _get_info(self):        
         return {
-            "actions": self._actions
+            "actions": self._actions,
+            "obs_cached": self._obs_cached,
+            "settle_time_s": self._settle_time_s,
+            "settle_timed_out": self._settle_timed_out
         }
 
     def step(self, action):
+        """
+        After a successful action the page gets up to `settle_timeout_s` to load and go quiet
+        for `settle_quiet_ms`, see `wait_for_settle`; the info reports "settle_time_s" and
+        "settle_timed_out".
+        """
         command = action["command"].lower()
         parameters = action["parameters"]
+        self._settle_time_s, self._settle_timed_out = 0.0, False
 
+        # Steps that do not execute an action leave the page as it is, unless it changes by itself
         if command == "pass":
             self._action_result = ActionResult(True)
-            return self._get_obs(), self._get_info()
+            return self._get_obs(reuse=True), self._get_info()
 
         if command not in self._actions:
             self._action_result = ActionResult(False, f"Command `{command}` not supported.")
-            return self._get_obs(), self._get_info()
+            return self._get_obs(reuse=True), self._get_info()
         
         # Filter out unsupported arguments
         parameters = {k:v for k,v in parameters.items() if k in [param["name"] for param in self._actions[command]["params"]]}
@@ -94,19 +194,27 @@ class TextualBrowserEnv(gym.Env):
         for param in self._actions[command]["params"]:
             if param["required"] and param["name"] not in parameters:
                 self._action_result = ActionResult(False, f"Missing required argument `{param['name']}`.")
-                return self._get_obs(), self._get_info()
+                return self._get_obs(reuse=True), self._get_info()
             if param["name"] in parameters and type(parameters[param["name"]]) != param["type"]:
                 self._action_result = ActionResult(False, f"Argument `{param['name']}` must be of type `{param['type']}`, but a `{type(parameters[param["name"]])}` is provided instead.")
-                return self._get_obs(), self._get_info()
+                return self._get_obs(reuse=True), self._get_info()
             if param["name"] not in parameters:
                 parameters[param["name"]] = None
 
         # Execute the action
+        start = time.monotonic()
         self._action_result = self._actions[command]["function"](self._driver, self._element_index, **parameters)
-        
+
+        # Failed actions leave the page as it was
+        if self._action_result.success:
+            self._settle_time_s, self._settle_timed_out = wait_for_settle(
+                self._driver, self._settle_timeout_s, self._settle_quiet_ms, since_s=time.monotonic() - start
+            )
+
         return self._get_obs(), self._get_info()
 
     def reset(self, seed=None, options=None):
+        """Visit the "url" of `options`, or `start_url` without one."""
         super().reset(seed=seed)
 
         for handle in self._driver.window_handles[1:]:
@@ -114,7 +222,7 @@ class TextualBrowserEnv(gym.Env):
             self._driver.close()
         self._driver.switch_to.window(self._driver.window_handles[0])
 
-        url = options.get("url", "about:blank")
+        url = (options or {}).get("url", self._start_url)
         url = url if url.startswith("http") else "http://" + url
         if not validators.url(url):
             url = "about:blank"
@@ -0,0 +1,63 @@
+// Page activity monitor for settle-waits. Installed on every new document before its own scripts
+// run, it counts fetch and XMLHttpRequest requests in flight and records the time of the latest
+// network or DOM activity, i.e. a request starting or ending, a resource finishing to load
+// according to the Performance API, or a node being added, removed or changing its text.
+if (window.__textualBrowserEnvActivity === undefined) {
+window.__textualBrowserEnvActivity = (() => {
+
+var inflight = 0;
+var lastActivity = performance.now();
+
+const touch = () => {
+    lastActivity = performance.now();
+}
+
+const done = () => {
+    inflight = Math.max(0, inflight - 1);
+    touch();
+}
+
+const fetch = window.fetch;
+if (fetch !== undefined) {
+    window.fetch = function(...args) {
+        inflight++;
+        touch();
+        try {
+            return fetch.apply(this, args).finally(done);
+        } catch (error) {
+            done();
+            throw error;
+        }
+    };
+}
+
+const send = XMLHttpRequest.prototype.send;
+XMLHttpRequest.prototype.send = function(...args) {
+    inflight++;
+    touch();
+    this.addEventListener("loadend", done, {once: true});
+    try {
+        return send.apply(this, args);
+    } catch (error) {
+        this.removeEventListener("loadend", done);
+        done();
+        throw error;
+    }
+};
+
+// Images, scripts, stylesheets etc. are only visible to the page once they have loaded
+if (typeof PerformanceObserver !== "undefined") {
+    new PerformanceObserver(touch).observe({type: "resource"});
+}
+
+// Attribute changes are left out, since CSS animations and carousels change them continuously
+// without changing the page text
+new MutationObserver(touch).observe(document, {childList: true, characterData: true, subtree: true});
+
+return {
+    inflight: () => inflight,
+    lastActivity: () => lastActivity,
+};
+
+})();
+}
@@ -1,3 +1,11 @@
+// Resident element extractor. The first run in a document installs it on `window`; it keeps
+// the representation of every processed subtree and a MutationObserver that invalidates them,
+// so later runs only re-process subtrees that changed. It returns `{version, elements}`, where
+// `version` changes whenever the document, its stylesheets, the scroll offset or the viewport
+// size changes.
+if (window.__textualBrowserEnv === undefined) {
+window.__textualBrowserEnv = (() => {
+
 // HTML tag categories from https://www.w3schools.com/tags/ref_byfunc.asp
 const TAGS_BASIC = "html, head, title, body" 
 const TAGS_CONTENT = "h1, h2, h3, h4, h5, h6, p, br, hr"
@@ -28,9 +36,7 @@ const trimList = (el_list) => {
 
 const appendElement = (el_list, el) => {
     if (el_list.length != 0 && el_list[el_list.length - 1].tag == el.tag && el.tag == "text") {
-        console.log("append text with text")
         el_list[el_list.length - 1].text += el.text;
-        el_list[el_list.length - 1].element = el.element;
     } else {
         el_list.push(el);
     }
@@ -38,63 +44,90 @@ const appendElement = (el_list, el) => {
 
 const prependElement = (el_list, el) => {
     if (el_list.length != 0  && el_list[0].tag == el.tag && el.tag == "text") {
-        console.log("prepend text with text")
         el_list[0].text = el.text + el_list[0].text;
-        el_list[0].element = el.element;
     } else {
         el_list.unshift(el);
     }
 }
 
+// Elements are sent to Python as integer handles rather than as WebElements. A handle stays
+// the same for the lifetime of its element, and `resolve` turns it back into the element.
+var nextHandle = 0;
+const handles = new WeakMap();
+const nodes = new Map();
+
+const getHandle = (element) => {
+    var handle = handles.get(element);
+    if (handle === undefined) {
+        handle = nextHandle++;
+        handles.set(element, handle);
+        nodes.set(handle, new WeakRef(element));
+    }
+    return handle;
+}
+
+const resolve = (handle) => {
+    const ref = nodes.get(handle);
+    const element = ref === undefined ? undefined : ref.deref();
+    return element !== undefined && element.isConnected ? element : null;
+}
+
+// [key in the representation, attribute name]
+const ATTRIBUTES = [
+    ["name", "name"], ["type", "type"], ["placeholder", "placeholder"], ["aria_label", "aria-label"],
+    ["title", "title"], ["alt", "alt"], ["checked", "checked"], ["value", "value"],
+    ["required", "required"], ["min", "min"], ["max", "max"],
+]
+
+// Text runs only carry their text. Attributes that are not set, `text` of elements with
+// children and `children` of elements with text are left out of the representation.
 const getRepresentationOfElement = (element, tag, content) => {
-    var obj = {
-        element: element,
-        tag: tag,
-        name: element.getAttribute('name'),
-        type: element.getAttribute('type'),
-        placeholder: element.getAttribute('placeholder'),
-        aria_label: element.getAttribute('aria-label'),
-        title: element.getAttribute('title'),
-        alt: element.getAttribute('alt'),
-        checked: element.getAttribute('checked'),
-        value: element.getAttribute('value'),
-        required: element.getAttribute('required'),
-        min: element.getAttribute('min'),
-        max: element.getAttribute('max'),
+    var obj = {tag: tag};
+    if (tag != "text") {
+        obj.handle = getHandle(element);
+        for (const [key, name] of ATTRIBUTES) {
+            const value = element.getAttribute(name);
+            if (value !== null) {
+                obj[key] = value;
+            }
+        }
     }
     if (typeof content === "string") {
         obj.text = content;
-        obj.children = null;
     } else if (Array.isArray(content)) {
-        obj.text = null;
         obj.children = content;
     } 
     return obj;
 }
 
+// Representations of unchanged subtrees are kept across calls, see `retrieveCachedElements`
+var cache = new WeakMap();
+
+const cloneList = (el_list) => el_list.map(el => Object.assign({}, el));
+
+// Parents merge text into the first and last representations of their children's lists, so
+// the cache only ever hands out copies of those
+const retrieveCachedElements = (element) => {
+    const cached = cache.get(element);
+    if (cached !== undefined) {
+        return cloneList(cached);
+    }
+    const el_list = retrieveElements(element);
+    cache.set(element, cloneList(el_list));
+    return el_list;
+}
+
 const retrieveElements = (element) => {
     // content: TAGS_CONTENT
     // structure: TAGS_FORMAT, TAGS_BASIC
 
-    if (element.hasAttribute("textual-browser-env-skip")) {
-        return [];
-    }
-    element.setAttribute("textual-browser-env-skip", "true");
-
     // Skip meta, programming, and frames tags
     if (element.matches([TAGS_META, TAGS_PROGRAMMING, TAGS_FRAMES, "style"].join(", "))) {
-        Array.from(element.querySelectorAll("*")).forEach(el => {
-            el.setAttribute("textual-browser-env-skip", "true");
-        });
         return [];
     }
 
     // Skip invisible elements
     if (!element.checkVisibility({contentVisibilityAuto: true, opacityProperty: true, visibilityProperty:true}) && !element.matches("option"))  {
-
-        Array.from(element.querySelectorAll("*")).forEach(el => {
-            el.setAttribute("textual-browser-env-skip", "true");
-        });
         return [];
     }
 
@@ -109,7 +142,7 @@ const retrieveElements = (element) => {
             /\n$/.test(child.nodeValue) ? postfix = "\n" : postfix = "";
             appendElement(el_list, getRepresentationOfElement(element, "text", child.nodeValue.trim() + postfix));
         } else if (child.nodeType === Node.ELEMENT_NODE) {
-            retrieveElements(child).forEach(el => {
+            retrieveCachedElements(child).forEach(el => {
                 appendElement(el_list, el);
             });
         }
@@ -278,21 +311,145 @@ const retrieveElements = (element) => {
     return el_list;
 }
 
-var result_list = [];
-Array.from(document.querySelectorAll('*')).filter(el => {
-    const rect = el.getBoundingClientRect();
-    const centerX = rect.left + rect.width / 2;
-    const centerY = rect.top + rect.height / 2;
-    return centerX >= 0 && centerX <= window.innerWidth && centerY >= 0 && centerY <= window.innerHeight && rect.width > 0 && rect.height > 0 && rect.width < window.innerWidth && rect.height < window.innerHeight;
-}).forEach(el => {
-    retrieveElements(el).forEach(e => {
-        appendElement(result_list, e);
+// ========================
+// Change tracking
+// Any mutation drops the cached representations of its target and the target's ancestors.
+// Attribute changes (e.g. `class` or `style`) can hide or show descendants, so they drop the
+// whole subtree as well. Stylesheets and form state (`:checked`, `:focus`, `:invalid` ...) can
+// change the visibility of any element, so changes to them drop everything.
+var mutations = 0;
+
+const invalidate = (node, subtree) => {
+    if (subtree && node.nodeType === Node.ELEMENT_NODE) {
+        node.querySelectorAll("*").forEach(el => cache.delete(el));
+    }
+    for (var n = node; n !== null; n = n.parentNode) {
+        cache.delete(n);
+    }
+}
+
+const invalidateAll = () => {
+    mutations++;
+    cache = new WeakMap();
+}
+
+const STYLESHEETS = "style, link[rel~=stylesheet]";
+
+const touchesStylesheet = (record) => {
+    const target = record.target.nodeType === Node.ELEMENT_NODE ? record.target : record.target.parentElement;
+    if (target !== null && target.closest(STYLESHEETS) !== null) {
+        return true;
+    }
+    return [...record.addedNodes, ...record.removedNodes].some(node => node.nodeType === Node.ELEMENT_NODE && node.matches(STYLESHEETS));
+}
+
+const onMutations = (records) => {
+    records.forEach(record => {
+        if (touchesStylesheet(record)) {
+            invalidateAll();
+            return;
+        }
+        mutations++;
+        invalidate(record.target, record.type === "attributes");
+    });
+}
+
+const observer = new MutationObserver(onMutations);
+observer.observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+
+// Rules inserted through the CSSOM do not mutate the document
+for (const name of ["insertRule", "deleteRule", "replace", "replaceSync"]) {
+    const method = CSSStyleSheet.prototype[name];
+    if (method !== undefined) {
+        CSSStyleSheet.prototype[name] = function(...args) {
+            invalidateAll();
+            return method.apply(this, args);
+        };
+    }
+}
+
+// Typing, toggling and focusing change form state without mutating the document either.
+// Listeners run in the capture phase, since `focus` and `blur` do not bubble.
+const FORM_EVENTS = ["input", "change", "focus", "blur"];
+FORM_EVENTS.forEach(type => document.addEventListener(type, invalidateAll, true));
+
+// ========================
+// Extraction
+// Every element whose bounding box is centered in the viewport is a root, unless it lies
+// within an earlier root. `querySelectorAll` returns elements in document order, so the
+// descendants of a root directly follow it. No attribute is written, so layout stays clean
+// and `getBoundingClientRect` never forces a style recalculation. Top-level representations
+// carry `viewport_offset`, the vertical distance in pixels from the viewport centre to the
+// centre of their root, by which the page text budget ranks them. Only the representations
+// are cached: the root scan still measures every element, so it remains O(DOM) per extraction.
+const documentId = Math.random().toString(36).slice(2);
+var lastVersion = null;
+var lastResult = null;
+var lastViewport = null;
+
+const currentVersion = () => {
+    // Deliver pending mutations before deciding whether anything changed
+    onMutations(observer.takeRecords());
+    return [documentId, mutations, window.scrollX, window.scrollY, window.innerWidth, window.innerHeight].join(":");
+}
+
+// Layout can also change without any of the above, e.g. through `:hover` after a click, so
+// `fresh` scans for roots again regardless of the version. Cached subtrees are still reused.
+const extract = (knownVersion, fresh) => {
+    const version = currentVersion();
+    if (version === lastVersion && !fresh) {
+        return {version: version, elements: version === knownVersion ? null : lastResult};
+    }
+
+    // Visibility can depend on media queries, so a resized viewport starts from scratch
+    const viewport = window.innerWidth + "x" + window.innerHeight;
+    if (viewport !== lastViewport) {
+        cache = new WeakMap();
+        lastViewport = viewport;
+    }
+
+    // Handles of collected elements can never be resolved again
+    nodes.forEach((ref, handle) => {
+        if (ref.deref() === undefined) {
+            nodes.delete(handle);
+        }
     });
-});
 
-// clear all llm-dom-visited attributes
-Array.from(document.querySelectorAll("*")).forEach(el => {
-    el.removeAttribute("textual-browser-env-skip");
-});
+    var result_list = [];
+    var root = null;
+    Array.from(document.querySelectorAll('*')).filter(el => {
+        const rect = el.getBoundingClientRect();
+        const centerX = rect.left + rect.width / 2;
+        const centerY = rect.top + rect.height / 2;
+        return centerX >= 0 && centerX <= window.innerWidth && centerY >= 0 && centerY <= window.innerHeight && rect.width > 0 && rect.height > 0 && rect.width < window.innerWidth && rect.height < window.innerHeight;
+    }).forEach(el => {
+        if (root !== null && root.contains(el)) {
+            return;
+        }
+        root = el;
+        const rect = el.getBoundingClientRect();
+        const offset = Math.round(rect.top + rect.height / 2 - window.innerHeight / 2);
+        // Top-level representations are copies, so the offset never reaches the cache
+        retrieveCachedElements(el).forEach(e => {
+            e.viewport_offset = offset;
+            appendElement(result_list, e);
+        });
+    });
+
+    lastVersion = version;
+    lastResult = result_list;
+    return {version: version, elements: result_list};
+}
+
+const disconnect = () => {
+    observer.disconnect();
+    FORM_EVENTS.forEach(type => document.removeEventListener(type, invalidateAll, true));
+}
+
+return {extract: extract, version: currentVersion, resolve: resolve, disconnect: disconnect};
+})();
+}
 
-return result_list;
+// `arguments[0]` is the version of the elements the caller already has, if any; they are not
+// sent again while the page is unchanged, unless `arguments[1]` asks for a fresh extraction
+return window.__textualBrowserEnv.extract(arguments[0], arguments[1] === true);
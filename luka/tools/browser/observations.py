@@ -1,14 +1,70 @@
+import functools
 import pkgutil
 
-from typing import Tuple, List, Dict
+from dataclasses import dataclass
+from typing import Callable, Tuple, List, Dict, Iterator, Optional, Set
 from selenium import webdriver
 
 js_retrieve_elements = pkgutil.get_data(__name__, "javascript/retrieve_elements.js").decode("utf-8")
 
+js_scroll_status = """
+    return [
+        window.scrollY, document.body.scrollHeight - window.innerHeight,
+        window.scrollX, document.body.scrollWidth - window.innerWidth
+    ];
+"""
+
+# Elements, scroll offsets and url in a single WebDriver round trip
+js_snapshot = f"""
+    const elements = (() => {{
+{js_retrieve_elements}
+    }})();
+    const scroll = (() => {{
+{js_scroll_status}
+    }})();
+    return {{extracted: elements, scroll: scroll, url: window.location.href}};
+"""
+
+# Version and url of the page, or null if the extractor has not run in this document yet
+js_page_version = """
+    const extractor = window.__textualBrowserEnv;
+    return extractor === undefined ? null : [extractor.version(), window.location.href];
+"""
+
+@dataclass
+class PageSnapshot:
+    elements: List[Dict]
+    element_index: Dict[int, Dict]
+    scroll_status: Dict
+    url: str
+    # Changes whenever the document, the scroll offset or the viewport size changes, or None
+    # if the snapshot was not taken by the resident extractor
+    version: Optional[str]
+
+def get_snapshot(driver: webdriver.Chrome, previous: Optional[PageSnapshot] = None, fresh: bool = False) -> PageSnapshot:
+    """
+    Read the elements in the viewport, the scroll status and the url of the current page with
+    one script execution. If the page is still at the version of `previous`, its elements are
+    not sent again and `previous.elements` are reused. With `fresh`, the viewport is scanned
+    for elements again even at the same version, since styles such as `:hover` can move
+    elements without changing it; unchanged subtrees still come from the extractor's cache.
+    """
+    snapshot = driver.execute_script(js_snapshot, previous.version if previous is not None else None, fresh)
+    extracted = snapshot["extracted"]
+    if extracted["elements"] is None:
+        elements, idx_map = previous.elements, previous.element_index
+    else:
+        elements, idx_map = assign_ids(extracted["elements"])
+    return PageSnapshot(elements, idx_map, _to_scroll_status(*snapshot["scroll"]), snapshot["url"], extracted["version"])
+
+def is_unchanged(driver: webdriver.Chrome, snapshot: PageSnapshot) -> bool:
+    """Whether the page is still the one in `snapshot`, checked without extracting anything."""
+    return snapshot.version is not None and driver.execute_script(js_page_version) == [snapshot.version, snapshot.url]
+
 def retrieve_elements_from_viewport(driver: webdriver.Chrome):
-    driver.execute_script(js_retrieve_elements)
-    elements = driver.execute_script(js_retrieve_elements)
+    return assign_ids(driver.execute_script(js_retrieve_elements)["elements"])
 
+def assign_ids(elements: List[Dict]) -> Tuple[List[Dict], Dict[int, Dict]]:
     idx = 0
     idx_map = {}
     def assign_idx(elements) -> Tuple[List[Dict], Dict[int, Dict]]:
@@ -16,7 +72,7 @@ def retrieve_elements_from_viewport(driver: webdriver.Chrome):
         for e in elements:
             e["id"] = idx
             idx += 1
-            if e["children"] != None:
+            if e.get("children") is not None:
                 assign_idx(e["children"])
             if e["tag"] != "text":
                 idx_map[e["id"]] = e
@@ -25,64 +81,352 @@ def retrieve_elements_from_viewport(driver: webdriver.Chrome):
     return elements, idx_map
 
 
-def get_text_representation(elements: List[Dict]) -> str:
-    text_repr = ""
-    for e in elements:
-        if e["tag"] in ["textinput", "select", "datepicker"]:
-            text_attrs = ["text", "placeholder"]
-            meta_attrs = ["type", "alt", "title", "aria_label", "value", "required", "checked", "min", "max"]
-        elif e["tag"] == "text":
-            text_attrs = ["text"]
-            meta_attrs = []
+_FORM_TAGS = ("textinput", "select", "datepicker")
+_MEDIA_TAGS = ("img", "map", "area", "canvas", "figcaption", "figure", "picture", "svg")
+
+def _text_attrs(tag: str) -> Tuple[str, ...]:
+    if tag in _FORM_TAGS:
+        return ("text", "placeholder")
+    if tag == "text":
+        return ("text",)
+    return ("text", "aria_label", "alt")
+
+def _meta_attrs(tag: str) -> Tuple[str, ...]:
+    if tag in _FORM_TAGS:
+        return ("type", "alt", "title", "aria_label", "value", "required", "checked", "min", "max")
+    if tag == "text":
+        return ()
+    return ("type", "value")
+
+def _own_text(e: Dict) -> str:
+    for attr in _text_attrs(e["tag"]):
+        text = e.get(attr)
+        if text is not None and len(text) > 0:
+            return text if text == e.get("text") else "(" + text + ")"
+    return ""
+
+def _meta_string(e: Dict) -> str:
+    meta = [attr + "=\"" + e[attr] + "\"" for attr in _meta_attrs(e["tag"]) if e.get(attr) is not None]
+    return " " + " ".join(meta) if len(meta) > 0 else ""
+
+def _multiline(e: Dict, text: str, memo: Dict[int, bool]) -> bool:
+    """
+    Whether the inner text of `e`, i.e. the rendering of its children followed by its own `text`,
+    spans several lines. Only text and media children have to be looked into, since every other
+    tag renders a trailing newline; `memo` keeps each subtree from being looked into twice.
+    """
+    key = id(e)
+    if key not in memo:
+        memo[key] = "\n" in text or any(
+            (c["tag"] != "text" and c["tag"] not in _MEDIA_TAGS) or _multiline(c, _own_text(c), memo)
+            for c in e.get("children") or ()
+        )
+    return memo[key]
+
+class _Verbatim:
+    @staticmethod
+    def write(chunk: str) -> str:
+        return chunk
+
+class _Stripped:
+    """Streams the `strip()` of everything written to it, holding back only trailing whitespace."""
+    def __init__(self):
+        self._leading = True
+        self._trailing = ""
+
+    def write(self, chunk: str) -> str:
+        if len(chunk) == 0:
+            return ""
+        if not self._leading and len(self._trailing) == 0 and not chunk[-1].isspace():
+            return chunk
+        if self._leading:
+            chunk = chunk.lstrip()
+            if len(chunk) == 0:
+                return ""
+            self._leading = False
+        if not chunk[-1].isspace():
+            body = chunk
         else:
-            text_attrs = ["text", "aria_label", "alt"]
-            meta_attrs = ["type", "value"]
+            body = chunk.rstrip()
+        if len(body) == 0:
+            self._trailing += chunk
+            return ""
+        out = self._trailing + body if len(self._trailing) > 0 else body
+        self._trailing = chunk[len(body):]
+        return out
 
-        text = [x for x in filter(lambda x: x is not None and len(x) > 0, [e[attr] for attr in text_attrs])]
-        text = text[0] if len(text) > 0 else None
-        if text != None and text != e["text"]:
-            text = "(" + text + ")"
-        
-        if e["children"] != None:
-            text = "" if text == None else text
-            text = get_text_representation(e["children"]) + text
-        
-        if text == None:
-            text = ""
-        
-        meta_str = " ".join([attr + "=\"" + e[attr] + "\"" for attr in meta_attrs if e[attr] is not None])
-        if len(meta_str) > 0:
-            meta_str = " " + meta_str
+def iter_text_representation(elements: List[Dict]) -> Iterator[str]:
+    """
+    Yield the text representation of `elements` in chunks, in document order, so that
+    callers can stop once they have enough of it. The chunks join to
+    `get_text_representation(elements)`.
+    """
+    memo = {}
+    # Multi-line elements strip their inner text; each one writes it through its own _Stripped
+    writers = [_Verbatim()]
+    # (element, iterator over its remaining children, its own text, whether it is multi-line)
+    stack = [(None, iter(elements), "", False)]
+    while len(stack) > 0:
+        children = stack[-1][1]
+        write = writers[-1].write
+        for e in children:
+            tag = e["tag"]
+            grandchildren = e.get("children")
+            if tag == "text" and not grandchildren:
+                chunk = write(e.get("text") or "")
+                if len(chunk) > 0:
+                    yield chunk
+                continue
+
+            text = _own_text(e)
+            if not grandchildren and tag != "text":
+                # Leaves are rendered whole, without a stack frame of their own
+                if tag in _MEDIA_TAGS:
+                    chunk = write(f"![{tag}]({text})")
+                elif "\n" in text:
+                    opening = f"<{tag} id=\"{e['id']}\"{_meta_string(e)}>"
+                    chunk = write(opening) + "\n" + text.strip() + write(f"\n</{tag}>\n")
+                else:
+                    chunk = write(f"<{tag} id=\"{e['id']}\"{_meta_string(e)}>{text}</{tag}>\n")
+                if len(chunk) > 0:
+                    yield chunk
+                continue
+
+            multiline = False
+            if tag == "text":
+                chunk = ""
+            elif tag in _MEDIA_TAGS:
+                chunk = write(f"![{tag}](")
+            else:
+                chunk = write(f"<{tag} id=\"{e['id']}\"{_meta_string(e)}>")
+                multiline = _multiline(e, text, memo)
+                if multiline:
+                    # Not held back: the closing tag always follows it
+                    chunk += "\n"
+                    writers.append(_Stripped())
+            if len(chunk) > 0:
+                yield chunk
+            stack.append((e, iter(grandchildren or ()), text, multiline))
+            break
+        else:
+            parent, _, text, multiline = stack.pop()
+            if parent is None:
+                continue
+            tag = parent["tag"]
+            if tag == "text":
+                chunk = write(text)
+            elif tag in _MEDIA_TAGS:
+                chunk = write(text + ")")
+            elif multiline:
+                chunk = write(text)
+                writers.pop()
+                chunk += writers[-1].write(f"\n</{tag}>\n")
+            else:
+                chunk = write(f"{text}</{tag}>\n")
+            if len(chunk) > 0:
+                yield chunk
+
+def get_text_representation(elements: List[Dict]) -> str:
+    return "".join(iter_text_representation(elements))
+
+ELISION_MARKER = "[... {tokens} tokens elided{elements} ...]"
+
+def _markup(e: Dict, text: str) -> str:
+    if e["tag"] in _MEDIA_TAGS:
+        return f"![{e['tag']}]({text})"
+    return f"<{e['tag']} id=\"{e['id']}\"{_meta_string(e)}>{text}</{e['tag']}>"
 
+def _budget_units(elements: List[Dict], count_tokens: Callable[[str], int]) -> Tuple[List[Tuple], Dict, Dict]:
+    """
+    Split the page into the units that `get_budgeted_text_representation` keeps or elides: the
+    markup of every element, and every non-blank line of every text run. Each unit is a tuple
+    `(tier, distance, rank tokens, order, key, key of the enclosing element, tokens)`, and they
+    are returned in allocation order. Tiers are 0 for element markup, 1 for text within
+    interactive elements, 2 for headings and 3 for body text; distance is from the viewport
+    centre to the root the unit was extracted from. Also returns the tokens of every unit
+    and of every element's subtree, by key.
+    """
+    units = []
+    tokens = {}
+    stack = [(e, abs(e.get("viewport_offset") or 0), None, False) for e in reversed(elements)]
+    while len(stack) > 0:
+        e, distance, parent, interactive = stack.pop()
         if e["tag"] == "text":
-            text_repr += text
-            continue
-        if e["tag"] in ["img", "map", "area", "canvas", "figcaption", "figure", "picture", "svg"]:
-            text_repr += f"![{e['tag']}]({text})"
+            for i, line in enumerate((e.get("text") or "").split("\n")):
+                if len(line.strip()) == 0:
+                    continue
+                tier = 1 if interactive else 2 if line.lstrip().startswith("#") else 3
+                key = (id(e), i)
+                tokens[key] = count_tokens(line)
+                units.append((tier, distance, tokens[key], len(units), key, parent, tokens[key]))
+        else:
+            # Ranked in document order within their tier, so that ancestors come before descendants
+            key = id(e)
+            tokens[key] = count_tokens(_markup(e, _own_text(e)))
+            units.append((0, distance, 0, len(units), key, parent, tokens[key]))
+            parent = key
+            interactive = interactive or e["tag"] not in _MEDIA_TAGS
+        stack.extend((child, distance, parent, interactive) for child in reversed(e.get("children") or ()))
+
+    # Units are in document order, so descendants are summed up before their ancestors
+    subtree_tokens = {}
+    for _, _, _, _, key, parent, n in reversed(units):
+        total = subtree_tokens.get(key, 0) + n
+        if not isinstance(key, tuple):
+            subtree_tokens[key] = total
+        if parent is not None:
+            subtree_tokens[parent] = subtree_tokens.get(parent, 0) + total
+    units.sort()
+    return units, tokens, subtree_tokens
+
+def _allocate(units: List[Tuple], budget: int) -> Tuple[Set, int]:
+    kept = set()
+    used = 0
+    for _, _, _, _, key, parent, tokens in units:
+        # Nothing within an elided element is kept
+        if parent is not None and parent not in kept:
             continue
-        
-        if text is None: 
-            text_repr += f"<{e["tag"]} id=\"{e["id"]}\"{meta_str}/>\n"
-        elif len(text.split("\n")) > 1:
-            text = text.strip()
-            text_repr += f"<{e["tag"]} id=\"{e["id"]}\"{meta_str}>\n{text}\n</{e["tag"]}>\n"
+        if used + tokens <= budget:
+            kept.add(key)
+            used += tokens
+    return kept, used
+
+def _elided_elements(ids: List[int]) -> str:
+    # A run of elided elements is named by its first and last id, so markers stay short however
+    # much they stand for; the ids in between belong to the run or to its elements' subtrees
+    if len(ids) == 0:
+        return ""
+    if len(ids) == 1:
+        return f", including element {ids[0]}"
+    return f", including elements {ids[0]}-{ids[-1]}"
+
+class _Elider:
+    """Copies elements without the units that were not kept, collapsing each run of elided units into one marker."""
+    def __init__(self, kept: Set, tokens: Dict, subtree_tokens: Dict, count_tokens: Callable[[str], int]):
+        self._kept = kept
+        self._tokens = tokens
+        self._subtree_tokens = subtree_tokens
+        self._count_tokens = count_tokens
+        self._elided_tokens = 0
+        self._elided_elements = []
+        self._newline = False
+        # Tokens of the markers written by this elider and the ones of the elements within
+        self.marker_tokens = 0
+
+    def elide(self, elements: List[Dict]) -> List[Dict]:
+        out = []
+        for e in elements:
+            self._add(out, e)
+        self._flush(out)
+        return out
+
+    def _add(self, out: List[Dict], e: Dict):
+        if e["tag"] != "text":
+            if id(e) in self._kept:
+                self._flush(out)
+                copy = dict(e)
+                if e.get("children") is not None:
+                    children = _Elider(self._kept, self._tokens, self._subtree_tokens, self._count_tokens)
+                    copy["children"] = children.elide(e["children"])
+                    self.marker_tokens += children.marker_tokens
+                out.append(copy)
+            else:
+                self._elided_tokens += self._subtree_tokens[id(e)]
+                self._elided_elements.append(e["id"])
+            return
+
+        for child in e.get("children") or ():
+            self._add(out, child)
+        for i, line in enumerate((e.get("text") or "").split("\n")):
+            pending = self._elided_tokens > 0 or len(self._elided_elements) > 0
+            if i > 0:
+                if pending:
+                    self._newline = True
+                else:
+                    self._write(out, "\n")
+            if len(line.strip()) == 0:
+                if not pending:
+                    self._write(out, line)
+            elif (id(e), i) in self._kept:
+                self._flush(out)
+                self._write(out, line)
+            else:
+                self._elided_tokens += self._tokens[(id(e), i)]
+
+    def _flush(self, out: List[Dict]):
+        if self._elided_tokens == 0 and len(self._elided_elements) == 0:
+            return
+        marker = ELISION_MARKER.format(tokens=self._elided_tokens, elements=_elided_elements(self._elided_elements))
+        self._write(out, marker + ("\n" if self._newline else ""))
+        self.marker_tokens += self._count_tokens(marker)
+        self._elided_tokens = 0
+        self._elided_elements = []
+        self._newline = False
+
+    @staticmethod
+    def _write(out: List[Dict], text: str):
+        if len(out) > 0 and out[-1]["tag"] == "text" and out[-1].get("children") is None:
+            out[-1]["text"] += text
         else:
-            text_repr += f"<{e["tag"]} id=\"{e["id"]}\"{meta_str}>{text}</{e["tag"]}>\n"
-    
-    return text_repr
+            out.append({"tag": "text", "text": text})
+
+def get_budgeted_text_representation(elements: List[Dict], max_tokens: int, count_tokens: Callable[[str], int]) -> str:
+    """
+    Text representation of `elements` in at most about `max_tokens` tokens.
+
+    The markup of interactive elements is kept first, then the text within them, then
+    headings, then body text ranked by distance from the viewport centre and by length.
+    Whatever does not fit is replaced by `ELISION_MARKER`, naming the range of ids of the
+    elements it stands for, one marker per run of elided text and elements. The result only
+    depends on the elements, so it is stable for a fixed DOM. Markers count towards the
+    budget; it is only exceeded when `max_tokens` is smaller than a single marker.
+    """
+    units, tokens, subtree_tokens = _budget_units(elements, count_tokens)
+    if sum(tokens.values()) <= max_tokens:
+        text = get_text_representation(elements)
+        if count_tokens(text) <= max_tokens:
+            return text
+
+    # Markers and separators are not units, so the largest unit budget whose result fits is
+    # searched for by bisection. Results are first estimated from the unit tokens counted above
+    # and the tokens of their markers, then the estimated best is counted in full. Only if that
+    # does not fit, e.g. because of separators, are smaller budgets counted in full as well.
+    # Most markers recur from one budget to the next, so their counts are cached.
+    count_marker_tokens = functools.lru_cache(maxsize=None)(count_tokens)
+
+    def elide(budget: int) -> Tuple[List[Dict], int]:
+        kept, used = _allocate(units, budget)
+        elider = _Elider(kept, tokens, subtree_tokens, count_marker_tokens)
+        elided = elider.elide(elements)
+        return elided, used + elider.marker_tokens
+
+    def bisect(lo: int, hi: int, fits: Callable[[int], bool]) -> int:
+        best = lo - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if fits(mid):
+                best, lo = mid, mid + 1
+            else:
+                hi = mid - 1
+        return best
+
+    budget = max(bisect(0, max_tokens, lambda budget: elide(budget)[1] <= max_tokens), 0)
+    text = get_text_representation(elide(budget)[0])
+    if count_tokens(text) <= max_tokens:
+        return text
+    budget = bisect(0, budget - 1, lambda budget: count_tokens(get_text_representation(elide(budget)[0])) <= max_tokens)
+    return get_text_representation(elide(max(budget, 0))[0])
 
 def get_scroll_status(driver: webdriver.Chrome) -> Dict:
-    
-    scroll_y = driver.execute_script("return window.scrollY;")
-    scroll_height = driver.execute_script("return document.body.scrollHeight - window.innerHeight;")
+    return _to_scroll_status(*driver.execute_script(js_scroll_status))
+
+def _to_scroll_status(scroll_y, scroll_height, scroll_x, scroll_width) -> Dict:
     if scroll_height <= 0:
         scroll_height = 0
         percentage_y = 1.0
     else:
         percentage_y = scroll_y / scroll_height
 
-    scroll_x = driver.execute_script("return window.scrollX;")
-    scroll_width = driver.execute_script("return document.body.scrollWidth - window.innerWidth;")
     if scroll_width <= 0:
         scroll_width = 0
         percentage_x = 1.0
@@ -0,0 +1,65 @@
+import pkgutil
+import time
+
+from typing import Tuple
+from selenium import webdriver
+from selenium.common import exceptions as E
+
+js_activity_monitor = pkgutil.get_data(__name__, "javascript/activity_monitor.js").decode("utf-8")
+
+# Resolves to true once the document has loaded, no requests are in flight and nothing has
+# happened for `quiet_ms`, counting the action itself, or to false at `timeout_ms`.
+js_wait_for_settle = f"""
+const [quietMs, timeoutMs, sinceMs] = arguments;
+const callback = arguments[arguments.length - 1];
+
+// Pages loaded before the monitor was installed only have it from now on
+{js_activity_monitor}
+const monitor = window.__textualBrowserEnvActivity;
+
+const start = performance.now();
+const actionStart = start - sinceMs;
+const poll = () => {{
+    const now = performance.now();
+    const idle = now - Math.max(monitor.lastActivity(), actionStart);
+    const settled = document.readyState === "complete" && monitor.inflight() === 0 && idle >= quietMs;
+    if (settled || now - start >= timeoutMs) {{
+        callback(settled);
+    }} else {{
+        setTimeout(poll, Math.max(10, Math.min(50, quietMs - idle)));
+    }}
+}};
+poll();
+"""
+
+def install_activity_monitor(driver: webdriver.Chrome):
+    """Install the activity monitor in every document the driver loads from now on."""
+    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": js_activity_monitor})
+
+def wait_for_settle(driver: webdriver.Chrome, timeout_s: float, quiet_ms: int, since_s: float = 0.0) -> Tuple[float, bool]:
+    """
+    Wait until the page is quiet, i.e. loaded, without fetch or XMLHttpRequest requests in flight,
+    and without network or DOM activity for `quiet_ms`, but at most `timeout_s`. `since_s` is the
+    time since the action that is waited for started, which counts as activity as well.
+
+    Returns the time waited in seconds, and whether the wait timed out. Navigations that replace
+    the document during the wait restart it on the new document.
+    """
+    start = time.monotonic()
+    deadline = start + timeout_s
+    settled = timeout_s <= 0
+    while not settled:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        elapsed = time.monotonic() - start + since_s
+        try:
+            settled = driver.execute_async_script(js_wait_for_settle, quiet_ms, remaining * 1000, elapsed * 1000)
+        except E.JavascriptException:
+            # The document was unloaded while waiting
+            continue
+        except E.TimeoutException:
+            break
+        if not settled:
+            break
+    return time.monotonic() - start, not settled
@@ -0,0 +1,72 @@
+import functools
+
+import gymnasium as gym
+
+from typing import List, Optional, Sequence, Union
+
+from .envs import TextualBrowserEnv
+
+# Vector environments reset finished workers on the step after the one that ended their episode
+# since gymnasium 1.0, and within that same step before
+NEXT_STEP_AUTORESET = int(gym.__version__.split(".")[0]) >= 1
+
+
+class GymnasiumStepWrapper(gym.Wrapper):
+    """
+    Adapts `TextualBrowserEnv.step`, which returns `(obs, info)`, to the gymnasium step API of
+    `(obs, reward, terminated, truncated, info)`, as vector environments expect. The reward is
+    always 0 and episodes never terminate by themselves, so they end by truncation only, e.g.
+    through a `TimeLimit`.
+    """
+    def step(self, action):
+        obs, info = self.env.step(action)
+        return obs, 0.0, False, False, info
+
+
+def _make_env(max_episode_steps: Optional[int], **kwargs) -> gym.Env:
+    # Called in the worker process, so every worker drives its own Chrome
+    env = GymnasiumStepWrapper(TextualBrowserEnv(**kwargs))
+    if max_episode_steps is not None:
+        env = gym.wrappers.TimeLimit(env, max_episode_steps=max_episode_steps)
+    return env
+
+
+def make_vector_env(
+        num_envs: int,
+        start_urls: Union[str, Sequence[str]] = "about:blank",
+        max_episode_steps: Optional[int] = 1000,
+        asynchronous: bool = True,
+        context: Optional[str] = None,
+        **kwargs
+    ) -> gym.vector.VectorEnv:
+    """
+    `num_envs` copies of `TextualBrowserEnv`, each in a subprocess of a `gym.vector.AsyncVectorEnv`,
+    or all in this process with `asynchronous=False`. Workers are headless unless `headless` is
+    given, and take the other `TextualBrowserEnv` arguments from `kwargs`.
+
+    `start_urls` is one url for all workers or one per worker. Workers visit it on reset, and
+    automatically once their episode is truncated after `max_episode_steps` steps, unless the
+    `options` of an explicit `reset` give another "url". With gymnasium 1.x, the automatic reset
+    happens on the step after the truncation, whose action is ignored. With gymnasium 0.29, it
+    happens within the truncating step, whose observation is then the one after the reset, and
+    `info["final_observation"]` holds the last one of the episode, see `NEXT_STEP_AUTORESET`.
+    Seeds are passed to `reset` as usual, i.e. one per worker or one that is incremented per
+    worker.
+
+    Observations are the `TextualBrowserEnv` observations batched per field, e.g.
+    `obs["page_text"]` is a tuple of `num_envs` strings, and actions are batched the same way.
+    """
+    if isinstance(start_urls, str):
+        start_urls = [start_urls] * num_envs
+    if len(start_urls) != num_envs:
+        raise ValueError(f"Expected {num_envs} start urls, but {len(start_urls)} are provided.")
+    kwargs.setdefault("headless", True)
+
+    env_fns: List = [
+        functools.partial(_make_env, max_episode_steps, start_url=start_url, **kwargs)
+        for start_url in start_urls
+    ]
+    if not asynchronous:
+        return gym.vector.SyncVectorEnv(env_fns)
+    # Text and dict spaces cannot be put in shared memory, so observations are pickled through pipes
+    return gym.vector.AsyncVectorEnv(env_fns, shared_memory=False, context=context)
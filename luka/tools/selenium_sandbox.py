@@ -6,11 +6,18 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
 import atexit
+import time
 import validators
 
+from .browser.settle import install_activity_monitor, wait_for_settle
+
 class SeleniumSandbox(object):
-    def __init__(self, window_size=(1024, 768)):
-        self._driver = webdriver.Chrome()
+    def __init__(self, window_size=(1024, 768), settle_timeout_s: float = 3.0, settle_quiet_ms: int = 150):
+        # Every action waits for the page to settle, as in TextualBrowserEnv, e.g. for content
+        # loaded lazily after a scroll
+        self._settle_timeout_s = settle_timeout_s
+        self._settle_quiet_ms = settle_quiet_ms
+        self._driver = self._create_driver()
 
         self._window_size = window_size
         self._driver.set_window_size(window_size[0], window_size[1])
@@ -37,7 +44,15 @@ class SeleniumSandbox(object):
 
     def reset(self):
         self._driver.quit()
-        self._driver = webdriver.Chrome()
+        self._driver = self._create_driver()
+
+    def _create_driver(self) -> webdriver.Chrome:
+        driver = webdriver.Chrome()
+        install_activity_monitor(driver)
+        return driver
+
+    def _settle(self, start: float):
+        wait_for_settle(self._driver, self._settle_timeout_s, self._settle_quiet_ms, since_s=time.monotonic() - start)
     
     def cleanup(self):
         self._driver.quit()
@@ -85,16 +100,19 @@ class SeleniumSandbox(object):
         """
         self._driver.execute_script(remove_target_attr_script, self._elements[index]["element"])
 
+        start = time.monotonic()
         try:
             self._elements[index]["element"].click()
         except Exception as e:
             raise e
+        self._settle(start)
 
     def type(self, index: int, text: str, enter: bool=False, clear: bool=True):
         if index >= len(self._elements):
             raise ValueError("error: index out of range")
         if self._elements[index]["tag"] != "input":
             raise ValueError("error: element is not textable")
+        start = time.monotonic()
         if clear:
             self._elements[index]["element"].clear()
         
@@ -102,19 +120,26 @@ class SeleniumSandbox(object):
         
         if enter:
             self._elements[index]["element"].send_keys(Keys.RETURN)
+        self._settle(start)
 
     def visit(self, url: str):
         url = url if url.startswith("http") else "http://" + url
         if not validators.url(url):
             raise ValueError("error: visiting invalid URL")
 
+        start = time.monotonic()
         self._driver.get(url)
+        self._settle(start)
     
     def go_back(self):
+        start = time.monotonic()
         self._driver.execute_script("window.history.go(-1)")
+        self._settle(start)
     
     def go_forward(self):
+        start = time.monotonic()
         self._driver.execute_script("window.history.go(1)")
+        self._settle(start)
 
     def scroll_up(self):
         self.scroll(scroll_down=False)
@@ -122,12 +147,18 @@ class SeleniumSandbox(object):
     def scroll_down(self):
         self.scroll(scroll_down=True)
 
-    def scroll(self, scroll_down: bool=True, duration: int=1000):
+    def scroll(self, scroll_down: bool=True, duration: int=0):
         if scroll_down:
             scroll_direction = "+"
         else:
             scroll_direction = "-"
 
+        start = time.monotonic()
+        if duration <= 0:
+            self._driver.execute_script(f"window.scrollTo({{top: window.pageYOffset {scroll_direction} window.innerHeight, behavior: 'instant'}});")
+            self._settle(start)
+            return
+
         completion_signal = "scroll_complete"
         
         ease_out_scroll_script = f"""
@@ -170,6 +201,7 @@ class SeleniumSandbox(object):
         WebDriverWait(self._driver, duration / 1000 + 2).until(
             check_scroll_complete
         )
+        self._settle(start)
 
     def _apply_overlays_by_elements(self, elements, ids, rgba_color=(255, 255, 0, 0.5)):
         rgba_color_str = f"rgba({int(rgba_color[0])}, {int(rgba_color[1])}, {int(rgba_color[2])}, {float(rgba_color[3])})"
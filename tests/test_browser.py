@@ -0,0 +1,280 @@
+import pickle
+import re
+
+import gymnasium as gym
+import pytest
+
+from selenium.common import exceptions as E
+
+from luka.tools.browser.dom_snapshot import DOMSnapshotTree
+from luka.tools.browser import vector
+from luka.tools.browser.settle import wait_for_settle
+from luka.tools.browser.spaces import AnyDict, Unicode
+from luka.tools.browser.observations import (
+    assign_ids, get_budgeted_text_representation, get_text_representation, iter_text_representation
+)
+
+@pytest.fixture
+def page():
+    # Compact payload as sent by retrieve_elements.js: unset attributes are left out
+    return [
+        {"tag": "text", "text": "\n# Search\n"},
+        {"tag": "textinput", "handle": 3, "type": "text", "placeholder": "Search...", "children": []},
+        {"tag": "link", "handle": 4, "children": [{"tag": "text", "text": "About us"}]},
+        {"tag": "button", "handle": 5, "aria_label": "Submit", "children": []},
+        {"tag": "img", "handle": 6, "alt": "Logo", "children": []},
+    ]
+
+@pytest.fixture
+def nested_page():
+    return [
+        {"tag": "text", "text": "  Welcome  "},
+        {"tag": "section", "handle": 1, "children": [
+            {"tag": "text", "text": " \n  Plans\n"},
+            {"tag": "div", "handle": 2, "aria_label": "Pricing", "children": [
+                {"tag": "text", "text": "Pro "},
+                {"tag": "link", "handle": 3, "title": "ignored", "children": [{"tag": "text", "text": "$20"}]},
+                {"tag": "text", "text": "  \n "},
+            ]},
+            {"tag": "figure", "handle": 4, "children": [
+                {"tag": "img", "handle": 5, "alt": "Chart", "children": []},
+                {"tag": "button", "handle": 6, "type": "button", "value": "Zoom", "children": [{"tag": "text", "text": "Zoom"}]},
+            ]},
+            {"tag": "text", "text": "\t\n"},
+        ]},
+        {"tag": "div", "handle": 7, "children": [{"tag": "text", "text": "\n \n"}]},
+        {"tag": "select", "handle": 8, "required": "true", "value": "b", "children": [{"tag": "text", "text": "Option\nB"}]},
+        {"tag": "span", "handle": 9, "children": []},
+    ]
+
+def test_text_representation(page):
+    elements, index = assign_ids(page)
+    assert sorted(index) == [1, 2, 4, 5], "assign_ids: only non-text elements should be indexed"
+    assert get_text_representation(elements) == (
+        "\n# Search\n"
+        "<textinput id=\"1\" type=\"text\">(Search...)</textinput>\n"
+        "<link id=\"2\">About us</link>\n"
+        "<button id=\"4\">(Submit)</button>\n"
+        "![img]((Logo))"
+    )
+
+def test_elements_are_picklable(page):
+    elements, index = assign_ids(page)
+    assert pickle.loads(pickle.dumps(index))[2]["handle"] == 4, "Elements should be plain data referring to the page by handle"
+
+def test_nested_text_representation(nested_page):
+    elements, _ = assign_ids(nested_page)
+    # Multi-line elements strip their inner text, nested ones included; media wrap their children
+    assert get_text_representation(elements) == (
+        "  Welcome  <section id=\"1\">\nPlans\n"
+        "<div id=\"3\">\nPro <link id=\"5\">$20</link>\n  \n (Pricing)\n</div>\n"
+        "![figure](![img]((Chart))<button id=\"10\" type=\"button\" value=\"Zoom\">Zoom</button>\n)\n"
+        "</section>\n"
+        "<div id=\"13\">\n\n</div>\n"
+        "<select id=\"15\" value=\"b\" required=\"true\">\nOption\nB\n</select>\n"
+        "<span id=\"17\"></span>\n"
+    )
+
+def test_iter_text_representation(nested_page):
+    elements, _ = assign_ids(nested_page)
+    chunks = iter_text_representation(elements)
+    prefix = next(chunks) + next(chunks)
+    assert get_text_representation(elements).startswith(prefix), "Chunks should be produced in document order"
+    assert "".join(chunks) == get_text_representation(elements)[len(prefix):]
+
+def test_deep_text_representation():
+    # Every level carries text, as in nested comment threads
+    page = [{"tag": "text", "text": "end"}]
+    for _ in range(500):
+        page = [{"tag": "div", "handle": 0, "children": [{"tag": "text", "text": " x "}] + page}]
+    elements, _ = assign_ids(page)
+    text = get_text_representation(elements)
+    assert text.startswith("<div id=\"0\">\nx <div id=\"2\">\nx ")
+    assert text.endswith("<div id=\"998\"> x end</div>\n" + "</div>\n" * 499)
+
+@pytest.fixture
+def long_page():
+    return [
+        {"tag": "text", "text": "\n# Pricing\nOur plans are simple and transparent for teams of every size.\n", "viewport_offset": -300},
+        {"tag": "link", "handle": 1, "children": [{"tag": "text", "text": "Pro plan details"}], "viewport_offset": -300},
+        {"tag": "text", "text": "\nThe Pro plan costs $20 per month and includes unlimited projects.\nCancel anytime.\n", "viewport_offset": 0},
+        {"tag": "button", "handle": 2, "aria_label": "Subscribe", "children": [], "viewport_offset": 0},
+        {"tag": "text", "text": "\nFooter text with legal notices, cookie policy and a very long list of other things nobody reads.\n", "viewport_offset": 350},
+    ]
+
+def count_tokens(text):
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+def test_budgeted_text_representation(long_page):
+    elements, _ = assign_ids(long_page)
+    full = get_text_representation(elements)
+    assert get_budgeted_text_representation(elements, 100, count_tokens) == full, "Pages within the budget should not change"
+
+    text = get_budgeted_text_representation(elements, 75, count_tokens)
+    assert count_tokens(text) <= 75
+    assert "<link id=\"1\">Pro plan details</link>" in text and "<button id=\"4\">(Subscribe)</button>" in text
+    assert "# Pricing" in text and "Cancel anytime." in text
+    assert "Footer" not in text and text.endswith("[... 19 tokens elided ...]\n"), "The text furthest from the viewport centre should be elided"
+    assert get_budgeted_text_representation(elements, 75, count_tokens) == text, "Output should be stable for a fixed page"
+
+    text = get_budgeted_text_representation(elements, 20, count_tokens)
+    assert count_tokens(text) <= 20
+    assert "including elements 1-4" in text, "Markers should name the elements they stand for"
+
+def test_budgeted_text_representation_large_page():
+    page = []
+    for i in range(300):
+        page.append({"tag": "text", "text": f"\n# Section {i}\nThe quick brown fox jumps over the lazy dog, section {i}.\n", "viewport_offset": 10 * i})
+        page.append({"tag": "link", "handle": i, "children": [{"tag": "text", "text": f"Item {i}"}], "viewport_offset": 10 * i})
+    elements, _ = assign_ids(page)
+    full = count_tokens(get_text_representation(elements))
+
+    counted = []
+    def counting_tokens(text):
+        counted.append(len(text))
+        return count_tokens(text)
+
+    for max_tokens in (200, 1000, full // 2):
+        counted.clear()
+        text = get_budgeted_text_representation(elements, max_tokens, counting_tokens)
+        assert count_tokens(text) <= max_tokens, "Markers should count towards the budget"
+        assert all(len(marker) < 80 for marker in re.findall(r"\[\.\.\. .*? \.\.\.\]", text)), "Markers should not list every elided element"
+        assert sum(counted) < 3 * len(get_text_representation(elements)), "The page should not be tokenized again for every budget tried"
+
+def make_snapshot(root, scroll=(0, 0)):
+    """A DOMSnapshot.captureSnapshot result for a tree of `(tag, attributes, bounds, styles, children)` and strings."""
+    strings = []
+    def string(value):
+        strings.append(value)
+        return len(strings) - 1
+
+    nodes = {"parentIndex": [], "nodeType": [], "nodeName": [], "nodeValue": [], "backendNodeId": [], "attributes": []}
+    layout = {"nodeIndex": [], "bounds": [], "styles": []}
+    stack = [(root, -1)]
+    while len(stack) > 0:
+        node, parent = stack.pop()
+        i = len(nodes["parentIndex"])
+        nodes["parentIndex"].append(parent)
+        nodes["backendNodeId"].append(100 + i)
+        if isinstance(node, str):
+            nodes["nodeType"].append(3)
+            nodes["nodeName"].append(string("#text"))
+            nodes["nodeValue"].append(string(node))
+            nodes["attributes"].append([])
+            continue
+        tag, attributes, bounds, styles, children = node
+        nodes["nodeType"].append(1)
+        nodes["nodeName"].append(string(tag.upper()))
+        nodes["nodeValue"].append(-1)
+        nodes["attributes"].append([string(x) for pair in attributes.items() for x in pair])
+        if bounds is not None:
+            layout["nodeIndex"].append(i)
+            layout["bounds"].append(bounds)
+            layout["styles"].append([string(styles.get(name, default)) for name, default in [("visibility", "visible"), ("opacity", "1"), ("content-visibility", "visible")]])
+        stack.extend((child, i) for child in reversed(children))
+
+    document = {"documentURL": string("https://example.com/"), "nodes": nodes, "layout": layout, "scrollOffsetX": scroll[0], "scrollOffsetY": scroll[1]}
+    return {"documents": [document], "strings": strings}
+
+def test_dom_snapshot_tree():
+    box = [0, 0, 10, 10]
+    main = ("main", {}, [0, 100, 800, 600], {}, [
+        ("h1", {}, box, {}, ["Pricing"]),
+        ("p", {}, box, {}, ["  Plans are  simple.\n"]),
+        ("a", {"href": "/pro", "title": "Pro"}, box, {}, ["Pro plan"]),
+        ("div", {"style": "display: none"}, None, {}, ["Hidden"]),
+        ("div", {}, box, {"visibility": "hidden"}, ["Invisible"]),
+        ("div", {}, box, {"opacity": "0"}, [("span", {}, box, {}, ["Transparent"])]),
+        ("input", {"type": "Text", "placeholder": "Search"}, box, {}, []),
+        ("ul", {}, box, {}, [("li", {}, box, {}, ["One"]), ("li", {}, box, {}, ["Two"])]),
+    ])
+    footer = ("footer", {}, [0, 1500, 800, 100], {}, ["Footer"])
+    html = ("html", {}, [0, 0, 1024, 2000], {}, [
+        ("head", {}, None, {}, [("title", {}, None, {}, ["Title"])]),
+        ("body", {}, [0, 0, 1024, 2000], {}, [main, footer]),
+    ])
+
+    # Only <main> is centered in the 1024x768 viewport once it is scrolled down by 50px
+    elements = DOMSnapshotTree(make_snapshot(html, scroll=(0, 50))).retrieve_elements_from_viewport(1024, 768)
+    assert [e["tag"] for e in elements] == ["text", "link", "textinput", "text"]
+    assert all(e["viewport_offset"] == -34 for e in elements)
+    assert elements[1] == {"tag": "link", "backend_node_id": 110, "title": "Pro", "children": [{"tag": "text", "text": "Pro plan"}], "viewport_offset": -34}
+
+    elements, index = assign_ids(elements)
+    assert get_text_representation(elements) == (
+        "\n# Pricing\n\nPlans are  simple.\n"
+        "<link id=\"1\">Pro plan</link>\n"
+        "<textinput id=\"3\" type=\"Text\">(Search)</textinput>\n"
+        "\n\n* One\n* Two\n"
+    )
+
+class ScriptedDriver:
+    """Answers `execute_async_script` calls with the given results, raising exceptions."""
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+
+    def execute_async_script(self, script, *args):
+        self.calls.append(args)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+def test_wait_for_settle():
+    # A navigation unloads the document during the first wait, which restarts on the next one
+    driver = ScriptedDriver(E.JavascriptException("document unloaded while waiting for result"), True)
+    waited, timed_out = wait_for_settle(driver, timeout_s=5, quiet_ms=100, since_s=0.5)
+    assert not timed_out and 0 <= waited < 5
+    assert len(driver.calls) == 2
+    quiet_ms, timeout_ms, since_ms = driver.calls[0]
+    assert quiet_ms == 100 and 0 < timeout_ms <= 5000 and since_ms >= 500
+
+    assert wait_for_settle(ScriptedDriver(False), timeout_s=5, quiet_ms=100)[1]
+
+    # Disabled
+    driver = ScriptedDriver()
+    assert not wait_for_settle(driver, timeout_s=0, quiet_ms=100)[1]
+    assert len(driver.calls) == 0
+
+class VisitingEnv(gym.Env):
+    """Stands in for TextualBrowserEnv, whose observation is the url and the last command."""
+    def __init__(self, start_url="about:blank", headless=False):
+        self.observation_space = gym.spaces.Dict({"url": Unicode(min_length=0, max_length=1024), "action_result": AnyDict()})
+        self.action_space = gym.spaces.Dict({"command": Unicode(min_length=0, max_length=1024), "parameters": AnyDict()})
+        self._start_url = start_url
+
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed)
+        self.url = (options or {}).get("url", self._start_url)
+        return self.step({"command": "visit", "parameters": {}})
+
+    def step(self, action):
+        return {"url": self.url, "action_result": {"command": action["command"]}}, {"seed_draw": int(self.np_random.integers(1 << 30))}
+
+def test_vector_env(monkeypatch):
+    monkeypatch.setattr(vector, "TextualBrowserEnv", VisitingEnv)
+    with pytest.raises(ValueError):
+        vector.make_vector_env(2, start_urls=["https://a.com"])
+
+    env = vector.make_vector_env(2, start_urls=["https://a.com", "https://b.com"], max_episode_steps=2, asynchronous=False)
+    obs, info = env.reset(seed=[1, 1], options={"url": "https://c.com"})
+    assert obs["url"] == ("https://c.com", "https://c.com")
+    assert info["seed_draw"][0] == info["seed_draw"][1]
+
+    obs, rewards, terminated, truncated, _ = env.step({"command": ("pass", "scroll"), "parameters": ({}, {})})
+    assert [r["command"] for r in obs["action_result"]] == ["pass", "scroll"]
+    assert list(rewards) == [0, 0] and not any(terminated) and not any(truncated)
+    obs, _, _, truncated, info = env.step({"command": ("pass", "pass"), "parameters": ({}, {})})
+    assert all(truncated)
+
+    # Truncated workers reset to their own start url, on the next step since gymnasium 1.0 and
+    # within the same step before, which keeps the last observation in the info
+    if vector.NEXT_STEP_AUTORESET:
+        obs, _, _, _, _ = env.step({"command": ("pass", "pass"), "parameters": ({}, {})})
+    else:
+        assert [final["url"] for final in info["final_observation"]] == ["https://c.com", "https://c.com"]
+    assert obs["url"] == ("https://a.com", "https://b.com")
+    assert [r["command"] for r in obs["action_result"]] == ["visit", "visit"]
+    assert pickle.loads(pickle.dumps(obs)) == obs
+    env.close()
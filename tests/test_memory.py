@@ -1,15 +1,25 @@
+import re
+
+import numpy as np
 import pytest
 
-from luka.memory.recall_mem import TransientRecallMemory
+from luka.memory.recall_mem import TransientRecallMemory, PersistentRecallMemory
 from luka.memory.working_mem import FIFOConversationMemory
 from luka.memory.working_mem import TextEditorMemory
+from luka.memory.vector_index import HashingVectorizer, VectorIndex
+from luka.memory.token_counter import TokenCounter
+from luka.memory.content_store import ContentStore
+from whoosh.reading import SegmentReader
 from luka.utils import Message
-from datetime import datetime
+from datetime import datetime, timedelta
+import threading
 
 _SUMMARY = "THIS IS A SUMMARY"
 
-@pytest.fixture(scope="module")
-def transient_mem():
+@pytest.fixture(scope="module", params=["transient", "persistent"])
+def transient_mem(request, tmp_path_factory):
+    if request.param == "persistent":
+        return PersistentRecallMemory(str(tmp_path_factory.mktemp("recall")))
     return TransientRecallMemory()
 
 @pytest.fixture(scope="module")
@@ -79,6 +89,176 @@ def test_transient_recall_memory_date_search(transient_mem):
     transient_mem.reset()
     assert len(transient_mem) == 0, "TransientRecallMemory should have 0 messages"
 
+def test_transient_recall_memory_timeline(transient_mem):
+    transient_mem.insert_many([
+        Message(role="user" if i % 3 == 0 else "browser", content=f"Step {i}", timestamp=datetime(2024, 5, 1, 15, 30, i))
+        for i in range(10)
+    ])
+    # Late arrival with an older timestamp
+    transient_mem.insert(Message(role="user", content="Late", timestamp=datetime(2024, 5, 1, 15, 29, 0)))
+
+    messages = transient_mem.date_search(datetime(2024, 5, 1, 15, 29), datetime(2024, 5, 1, 15, 30, 59), limit=20, roles=["user"])
+    assert [m.content for m in messages] == ["Late", "Step 0", "Step 3", "Step 6", "Step 9"], "TransientRecallMemory: role-filtered date_search should be sorted by timestamp"
+    assert [m.content for m in transient_mem.recent(2)] == ["Step 8", "Step 9"], "TransientRecallMemory: recent should return the newest messages, oldest first"
+    assert [m.content for m in transient_mem.recent(3, roles=["user"])] == ["Step 3", "Step 6", "Step 9"]
+    assert len(transient_mem.recent(5, roles=["nobody"])) == 0
+    transient_mem.reset()
+    assert len(transient_mem.recent(5)) == 0, "TransientRecallMemory: reset should clear the timeline"
+
+def test_transient_recall_memory_structured_search(transient_mem):
+    transient_mem.insert_many([
+        Message(role="browser", content="Action successful!", timestamp=datetime(2024, 5, 1, 15, 0)),
+        Message(role="browser", content="An error occured: timeout", timestamp=datetime(2024, 5, 1, 15, 5)),
+        Message(role="agent", content="I will retry after the error", timestamp=datetime(2024, 5, 1, 15, 6)),
+        Message(role="browser", content="An error occured: element not found", timestamp=datetime(2024, 5, 1, 15, 12)),
+        Message(role="browser", content="Action successful!", timestamp=datetime(2024, 5, 1, 15, 14)),
+    ])
+
+    messages = transient_mem.search(text="error", roles=["browser"], start_date=datetime(2024, 5, 1, 15, 4), sort="newest")
+    assert [m.content for m in messages] == ["An error occured: element not found", "An error occured: timeout"], "TransientRecallMemory: search should apply all filters"
+    messages = transient_mem.search(roles=["browser"], end_date=datetime(2024, 5, 1, 15, 12), sort="newest", limit=2)
+    assert [m.timestamp.minute for m in messages] == [12, 5], "TransientRecallMemory: search without text should filter by role and date"
+    assert transient_mem.search(text="error", roles=["user"]) == []
+
+    assert transient_mem.role_counts(text="error") == {"browser": 2, "agent": 1}, "TransientRecallMemory: role_counts should count matches per role"
+    assert transient_mem.role_counts(start_date=datetime(2024, 5, 1, 15, 10)) == {"browser": 2}
+    with pytest.raises(ValueError):
+        transient_mem.search(sort="random")
+    transient_mem.reset()
+
+def test_transient_recall_memory_retention():
+    mem = TransientRecallMemory(max_docs=9, max_age=timedelta(days=1), role_ttls={"browser": timedelta(hours=1)}, embed=HashingVectorizer(dim=64))
+    now = datetime(2024, 5, 2, 12, 0)
+    mem.insert(Message(role="user", content="Ancient history", timestamp=now - timedelta(days=2)))
+    mem.insert_many([
+        Message(role="browser" if i % 2 else "user", content=f"Step {i}", timestamp=now - timedelta(minutes=100 - 10 * i))
+        for i in range(10)
+    ])
+
+    assert mem.expire(now=now) == 4, "TransientRecallMemory: expire should apply max_docs, max_age and role TTLs"
+    assert len(mem) == 7, "TransientRecallMemory: len should only count live messages"
+    assert [m.content for m in mem.recent(10)] == ["Step 2", "Step 4", "Step 5", "Step 6", "Step 7", "Step 8", "Step 9"]
+    assert mem.text_search("ancient") == [] and len(mem._vectors) == 7
+    assert all(m.content != "Step 1" for m in mem.hybrid_search("Step 1", limit=10)), "TransientRecallMemory: expired messages should not be found by vector search"
+    assert sum(s.doc_count_all() for s in mem._index._segments()) == 7, "TransientRecallMemory: deleted messages should be compacted away"
+    assert mem.expire(now=now) == 0
+    mem.close()
+
+def test_content_store():
+    store = ContentStore(dict_size=512, train_every=8, max_dicts=2)
+    contents = [f"Action successful!\nCurrent url: https://example.com/page/{i}" for i in range(40)]
+    keys = [store.put(content) for content in contents]
+    assert store.put(contents[0]) == keys[0] and len(store) == 40, "ContentStore: identical contents should be stored once"
+    assert [store.get(key) for key in keys] == contents, "ContentStore: contents should round-trip"
+    assert len(store._payloads[keys[-1]][1]) < len(contents[-1]) // 2, "ContentStore: near-identical contents should compress well against the trained dictionary"
+    assert len(store._dicts) <= 3, "ContentStore: at most `max_dicts` trained dictionaries should be kept"
+
+    store.release(keys[0])
+    assert store.get(keys[0]) == contents[0], "ContentStore: payloads should live while referenced"
+    store.release(keys[0])
+    assert len(store) == 39
+    assert store.get(keys[0]) is None, "ContentStore: released keys should read as None"
+
+    for key in keys[1:]:
+        store.release(key)
+    assert list(store._dicts) in ([0], [0, store._current]), "ContentStore: unused dictionaries should be dropped"
+
+    # A dictionary that costs more than it saves is never trained
+    random = np.random.default_rng(0)
+    store = ContentStore(train_every=8)
+    for _ in range(40):
+        store.put(random.bytes(32).hex())
+    assert list(store._dicts) == [0], "ContentStore: dictionaries that do not pay off should not be kept"
+
+def test_transient_recall_memory_open_date_bounds():
+    mem = TransientRecallMemory()
+    mem.insert_many([Message(role="user", content=f"cats {i}", timestamp=datetime(2024, 5, 1, 15, 30, i)) for i in range(3)])
+    assert [m.content for m in mem.date_search(None, None)] == ["cats 0", "cats 1", "cats 2"], "TransientRecallMemory: missing date bounds should be open"
+    assert [m.content for m in mem.date_search(datetime(2024, 5, 1, 15, 30, 1), None)] == ["cats 1", "cats 2"]
+    assert [m.content for m in mem.iter_date_search(None, datetime(2024, 5, 1, 15, 30, 1))] == ["cats 0", "cats 1"]
+    page, cursor = mem.date_search_page(None, None, limit=2)
+    assert [m.content for m in page] == ["cats 0", "cats 1"] and cursor is not None
+    mem.close()
+
+def test_transient_recall_memory_expire_while_iterating():
+    mem = TransientRecallMemory(max_docs=1, dedup=True)
+    mem.insert_many([Message(role="user", content=f"cats {i}", timestamp=datetime(2024, 5, 1, 15, 30, i)) for i in range(3)])
+    for results in (mem.iter_text_search("cats"), mem.iter_date_search(datetime.min, datetime.max)):
+        first = next(results)
+        mem.expire()
+        # Messages expired since the search started are skipped instead of failing
+        assert [first] + list(results) in ([first], [first, Message(role="user", content="cats 2", timestamp=datetime(2024, 5, 1, 15, 30, 2))])
+        mem.insert(Message(role="user", content="cats 0", timestamp=datetime(2024, 5, 1, 15, 30, 0)))
+        mem.insert(Message(role="user", content="cats 1", timestamp=datetime(2024, 5, 1, 15, 30, 1)))
+    mem.close()
+
+def test_transient_recall_memory_dedup():
+    mem = TransientRecallMemory(max_docs=3, dedup=True)
+    mem.insert_many([Message(role="browser", content="Action successful!", timestamp=datetime(2024, 5, 1, 15, 30, i)) for i in range(5)])
+    assert len(mem._content) == 1, "TransientRecallMemory: identical contents should be stored once"
+    assert [m.content for m in mem.text_search("successful", limit=10)] == ["Action successful!"] * 5
+    mem.expire()
+    assert mem._content._refs[mem._content.put("Action successful!")] == 4, "TransientRecallMemory: expired messages should release their contents"
+    mem.close()
+    assert TransientRecallMemory()._content is None, "TransientRecallMemory: contents should be stored fields unless deduplication is asked for"
+
+def test_persistent_recall_memory_reopen(tmp_path):
+    mem = PersistentRecallMemory(str(tmp_path))
+    mem.insert(Message(role="user", content="Hello", timestamp=datetime(2024, 5, 1, 15, 30, 0)))
+    mem.insert(Message(role="agent", content="World", timestamp=datetime(2024, 5, 1, 15, 35, 0)))
+    mem.close()
+
+    reopened = PersistentRecallMemory(str(tmp_path))
+    assert len(reopened) == 2, "PersistentRecallMemory: messages should survive reopening the index"
+    assert [m.content for m in reopened.recent(2)] == ["Hello", "World"], "PersistentRecallMemory: the timeline should be rebuilt on reopen"
+    messages = reopened.text_search("world")
+    assert len(messages) == 1 and messages[0].role == "agent", "PersistentRecallMemory: reopened index should be searchable"
+    _, cursor = reopened.date_search_page(None, None, limit=1)
+    assert cursor is not None
+    reopened.close()
+    assert reopened._searcher is None and len(reopened._cursors) == 0, "PersistentRecallMemory: close should release the readers holding segment files open"
+
+    reopened.reset()
+    assert len(PersistentRecallMemory(str(tmp_path))) == 0, "PersistentRecallMemory: reset should clear the index on disk"
+
+def test_persistent_recall_memory_reopen_from_columns(tmp_path, monkeypatch):
+    embedded = []
+    def embed(text):
+        embedded.append(text)
+        return HashingVectorizer(dim=64)(text)
+
+    mem = PersistentRecallMemory(str(tmp_path), embed=embed, max_docs=3, retention_interval_s=3600)
+    for i in range(5):
+        mem.insert(Message(role=["user", "agent"][i % 2], content=f"note {i} about cats", timestamp=datetime(2024, 5, 1, 15, 30, i)))
+    assert mem.expire() == 2
+    mem.close()
+
+    # Reopening reads ids, timestamps, roles and embeddings from columns, never stored contents
+    embedded.clear()
+    monkeypatch.setattr(SegmentReader, "stored_fields", lambda *args: pytest.fail("contents should not be loaded on reopen"))
+    reopened = PersistentRecallMemory(str(tmp_path), embed=embed, max_docs=3, retention_interval_s=3600)
+    assert embedded == [""], "PersistentRecallMemory: messages should not be embedded again on reopen"
+    assert reopened._next_id == 5
+    assert list(reopened._timeline.range(datetime.min, datetime.max)) == [2, 3, 4]
+    assert list(reopened._timeline.range(datetime.min, datetime.max, roles=["agent"])) == [3]
+    monkeypatch.undo()
+    assert [m.content for m in reopened.recent(5)] == ["note 2 about cats", "note 3 about cats", "note 4 about cats"]
+    assert reopened.hybrid_search("note 3", limit=1)[0].content == "note 3 about cats"
+    reopened.close()
+
+    # Messages stored without embeddings are embedded and rewritten once
+    plain = PersistentRecallMemory(str(tmp_path / "plain"))
+    plain.insert(Message(role="user", content="dogs only", timestamp=datetime(2024, 5, 1, 15, 30, 0)))
+    plain.close()
+    embedded.clear()
+    for _ in range(2):
+        PersistentRecallMemory(str(tmp_path / "plain"), embed=embed).close()
+    assert embedded == ["", "dogs only", ""], "PersistentRecallMemory: messages without embeddings should be embedded once"
+    reopened = PersistentRecallMemory(str(tmp_path / "plain"), embed=embed)
+    assert [m.content for m in reopened.recent(5)] == ["dogs only"]
+    assert reopened.hybrid_search("dogs", limit=1)[0].content == "dogs only"
+    reopened.close()
+
 def test_fifo_conversation_memory(fifo_mem):
     fifo_mem.insert(Message(role="user", content="Lorem ipsum dolor sit amet, consectetur adipiscing elit.", timestamp=datetime(2024, 5, 1, 15, 30, 0)))
     messages = fifo_mem._message_queue
@@ -115,4 +295,259 @@ def test_text_editor_memory(text_mem):
 
     text_mem.replace("Ut enim ad minim veniam\nLorem ipsum dolor sit amet, consectetur adipiscing elit.\n    aliquip ex ea commodo consequat.", (-2,0))
     printed = text_mem.__repr__()
-    assert printed == "1: Ut enim ad minim veniam\n2: Lorem ipsum dolor sit amet, consectetur adipiscing elit.\n3: aliquip ex ea commodo consequat.\n", "TextEditorMemory: replaced string should have 3 lines"
\ No newline at end of file
+    assert printed == "1: Ut enim ad minim veniam\n2: Lorem ipsum dolor sit amet, consectetur adipiscing elit.\n3: aliquip ex ea commodo consequat.\n", "TextEditorMemory: replaced string should have 3 lines"
+
+def test_transient_recall_memory_insert_many(transient_mem):
+    transient_mem.insert_many([
+        Message(role="user", content="Hello", timestamp=datetime(2024, 5, 1, 15, 30, 0)),
+        Message(role="agent", content="World", timestamp=datetime(2024, 5, 1, 15, 35, 0)),
+        Message(role="user", content="Hello. How is the weather?", timestamp=datetime(2024, 5, 1, 15, 35, 30)),
+    ])
+    assert len(transient_mem) == 3, "TransientRecallMemory should have 3 messages after insert_many"
+    assert len(transient_mem.text_search("hello")) == 2, "TransientRecallMemory: searching for `hello` should return 2 messages"
+    transient_mem.reset()
+
+def test_transient_recall_memory_buffered():
+    mem = TransientRecallMemory(buffered=True, flush_size=1000, flush_interval_s=60)
+    for i in range(10):
+        mem.insert(Message(role="user", content=f"Message number {i}", timestamp=datetime(2024, 5, 1, 15, 30, i)))
+    assert len(mem._pending) == 10, "TransientRecallMemory: buffered inserts should be queued"
+    assert len(mem.text_search("message", limit=20)) == 10, "TransientRecallMemory: searches should see queued messages"
+    assert len(mem._pending) == 0, "TransientRecallMemory: searches should flush the queue"
+
+    mem.insert(Message(role="agent", content="Goodbye", timestamp=datetime(2024, 5, 1, 15, 31, 0)))
+    mem.close()
+    assert len(mem) == 11, "TransientRecallMemory: close should commit queued messages"
+
+def test_transient_recall_memory_search_page(transient_mem):
+    transient_mem.insert_many([Message(role="user", content=f"Hello number {i}", timestamp=datetime(2024, 5, 1, 15, 30, i)) for i in range(7)])
+
+    messages, cursor = transient_mem.text_search_page("hello", limit=3)
+    seen = list(messages)
+    while cursor is not None:
+        messages, cursor = transient_mem.text_search_page("hello", limit=3, cursor=cursor)
+        seen.extend(messages)
+    assert len(seen) == 7, "TransientRecallMemory: paging through `hello` should return all 7 messages"
+    assert len({m.content for m in seen}) == 7, "TransientRecallMemory: pages should not overlap"
+
+    messages, cursor = transient_mem.date_search_page(datetime(2024, 5, 1, 15, 30, 2), datetime(2024, 5, 1, 15, 30, 5), limit=2)
+    assert [m.content for m in messages] == ["Hello number 2", "Hello number 3"], "TransientRecallMemory: date pages should be sorted by timestamp"
+    messages, cursor = transient_mem.date_search_page(None, None, cursor=cursor, limit=2)
+    assert [m.content for m in messages] == ["Hello number 4", "Hello number 5"], "TransientRecallMemory: second date page should continue from the cursor"
+    assert cursor is None, "TransientRecallMemory: cursor should be None after the last page"
+
+    with pytest.raises(ValueError):
+        transient_mem.text_search_page("hello", cursor="not-a-cursor")
+
+    assert len(list(transient_mem.iter_text_search("hello"))) == 7, "TransientRecallMemory: iter_text_search should yield all matches"
+    transient_mem.reset()
+
+def test_transient_recall_memory_caches():
+    mem = TransientRecallMemory(result_cache_size=8)
+    mem.insert(Message(role="user", content="Hello", timestamp=datetime(2024, 5, 1, 15, 30, 0)))
+    assert len(mem.text_search("hello")) == 1
+    searcher = mem._searcher
+    assert len(mem.text_search("hello")) == 1
+    assert ("text", "hello", 0, 5) in mem._result_cache, "TransientRecallMemory: repeated searches should be cached"
+    assert mem._searcher is searcher, "TransientRecallMemory: searcher should be reused while the index is unchanged"
+
+    mem.insert(Message(role="user", content="Hello again", timestamp=datetime(2024, 5, 1, 15, 31, 0)))
+    assert len(mem._result_cache) == 0, "TransientRecallMemory: inserts should invalidate the result cache"
+    assert len(mem.text_search("hello")) == 2, "TransientRecallMemory: searches should see new messages after a commit"
+    assert len(mem) == 2
+
+def test_vector_index():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(3000, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    index = VectorIndex(dim=32, ivf_threshold=1000, nprobe=64)
+    for start in range(0, 3000, 500):
+        index.add(range(start, start + 500), vectors[start:start + 500])
+    assert len(index) == 3000
+    assert index._centroids is None, "VectorIndex: training should wait for the next search"
+
+    ids, scores = index.search(vectors[1234], k=3)
+    assert index._centroids is not None, "VectorIndex: IVF quantizer should be trained above the threshold"
+    assert ids[0] == 1234, "VectorIndex: a stored vector should be its own nearest neighbour"
+    assert scores[0] == pytest.approx(1.0, abs=1e-5)
+    assert list(scores) == sorted(scores, reverse=True), "VectorIndex: results should be sorted by similarity"
+
+def test_transient_recall_memory_hybrid_search():
+    mem = TransientRecallMemory(embed=HashingVectorizer())
+    mem.insert(Message(role="browser", content="The Pro plan is priced at $20 per month.", timestamp=datetime(2024, 5, 1, 15, 30, 0)))
+    mem.insert(Message(role="browser", content="Our team is based in Toronto.", timestamp=datetime(2024, 5, 1, 15, 31, 0)))
+    mem.insert(Message(role="agent", content="I should check the contact details next.", timestamp=datetime(2024, 5, 1, 15, 32, 0)))
+
+    assert len(mem.text_search("pricing")) == 0, "TransientRecallMemory: lexical search should miss the paraphrase"
+    messages = mem.hybrid_search("what did the page say about pricing", limit=1)
+    assert messages[0].content == "The Pro plan is priced at $20 per month.", "TransientRecallMemory: hybrid search should find the paraphrase"
+
+    with pytest.raises(ValueError):
+        TransientRecallMemory().hybrid_search("pricing")
+
+def test_fifo_conversation_memory_background():
+    started, release = threading.Event(), threading.Event()
+    batches = []
+    def blocking_summarize(x):
+        started.set()
+        release.wait(timeout=10)
+        batches.append(x)
+        return _SUMMARY + f" {len(batches)}"
+
+    mem = FIFOConversationMemory(tokenize=lambda x: x.split(" "), summarize=blocking_summarize, max_size=30, trigger_threshold=0.8, target_threshold=0.5, background=True)
+    for i in range(3):
+        mem.insert(Message(role="user", content=f"message {i} " + "word " * 6, timestamp=datetime(2024, 5, 1, 15, 30, i)))
+    assert started.wait(timeout=10), "FIFOConversationMemory: summarization should start in the background"
+    for i in range(3, 9):
+        mem.insert(Message(role="user", content=f"message {i} " + "word " * 6, timestamp=datetime(2024, 5, 1, 15, 30, i)))
+
+    head = mem._message_queue[0][0]
+    assert "being summarized" in head.content, "FIFOConversationMemory: evicted messages should be represented by a placeholder"
+
+    release.set()
+    mem.flush(timeout=10)
+    assert len(batches) == 2, "FIFOConversationMemory: evictions during an in-flight summary should be coalesced into one call"
+    assert all(msg.role == "user" for msg in batches[1]), "FIFOConversationMemory: a finished summary should not be summarized again"
+    assert mem._message_queue[0][0].content == f"{_SUMMARY} 1\n{_SUMMARY} 2", "FIFOConversationMemory: placeholder should be swapped for the summaries"
+    assert sum(entry[1] for entry in mem._message_queue) == mem._current_size
+    assert str(mem) == "\n".join(str(entry[0]) for entry in mem._message_queue), "FIFOConversationMemory: cached rendering should match the queue"
+
+class _PausingLock:
+    """Wraps a lock, pausing the summary worker right after it releases the lock once `armed` is set."""
+    def __init__(self, lock):
+        self._lock = lock
+        self.armed, self.paused, self.resume = threading.Event(), threading.Event(), threading.Event()
+
+    def __enter__(self):
+        return self._lock.__enter__()
+
+    def __exit__(self, *exc):
+        self._lock.__exit__(*exc)
+        if threading.current_thread() is not threading.main_thread() and self.armed.is_set():
+            self.armed.clear()
+            self.paused.set()
+            self.resume.wait(timeout=10)
+
+def test_fifo_conversation_memory_background_no_lost_wakeup():
+    mem = FIFOConversationMemory(tokenize=lambda x: x.split(" "), summarize=lambda x: _SUMMARY, max_size=30, trigger_threshold=0.8, target_threshold=0.5, background=True)
+    lock = mem._lock = _PausingLock(mem._lock)
+    next_summary_job = mem._next_summary_job
+    def next_job():
+        # Pause the worker between finding nothing left to summarize and finishing
+        level, batch = next_summary_job()
+        if len(batch) == 0:
+            lock.armed.set()
+        return level, batch
+    mem._next_summary_job = next_job
+
+    for i in range(3):
+        mem.insert(Message(role="user", content=f"message {i} " + "word " * 6, timestamp=datetime(2024, 5, 1, 15, 30, i)))
+    assert lock.paused.wait(timeout=10)
+    for i in range(3, 6):
+        mem.insert(Message(role="user", content=f"message {i} " + "word " * 6, timestamp=datetime(2024, 5, 1, 15, 30, i)))
+    lock.resume.set()
+    mem.flush(timeout=10)
+
+    assert len(mem._evicted) == 0, "FIFOConversationMemory: messages evicted while the worker finishes should still be summarized"
+    assert "being summarized" not in str(mem), "FIFOConversationMemory: no placeholder should survive flush"
+
+def test_fifo_conversation_memory_render_cache():
+    mem = FIFOConversationMemory(tokenize=lambda x: x.split(" "), summarize=lambda x: _SUMMARY, max_size=200, trigger_threshold=0.8, target_threshold=0.5)
+    for i in range(50):
+        mem.insert(Message(role="user", content=f"message {i} " + "word " * (i % 7), timestamp=datetime(2024, 5, 1, 15, 30, i)))
+        assert str(mem) == "\n".join(str(entry[0]) for entry in mem._message_queue), "FIFOConversationMemory: cached rendering should match the queue"
+    mem.replace(Message(role="user", content="Vale.", timestamp=datetime(2024, 5, 1, 15, 31, 0)), 1)
+    assert str(mem).split("\n")[1].endswith("Vale."), "FIFOConversationMemory: replace should invalidate the cached rendering"
+
+def test_token_counter():
+    calls = []
+    def counting_tokenize(x):
+        calls.append(x)
+        return x.split(" ")
+
+    counter = TokenCounter(counting_tokenize, model="dummy", max_entries=2)
+    assert counter("a b c") == 3
+    assert counter("a b c") == 3
+    assert (counter.hits, counter.misses) == (1, 1), "TokenCounter: repeated text should be served from the cache"
+    counter("d e")
+    counter("f")
+    assert len(counter) == 2, "TokenCounter: cache should be bounded"
+
+    calls.clear()
+    mem = TextEditorMemory(tokenize=counter)
+    mem.insert("one two\nthree")
+    mem.replace("one two\nfour five", (0, 2))
+    assert calls.count("one two") == 1, "TextEditorMemory: unchanged lines should not be re-tokenized"
+    assert mem._current_size == 4
+
+def test_text_editor_memory_render_cache():
+    mem = TextEditorMemory(tokenize=lambda x: x.split(" "))
+    mem.insert("\n".join(f"line {i}" for i in range(1, 9)))
+    assert str(mem).startswith("1| line 1\n")
+    mem.insert("new line", 0)
+    assert mem._wrapped[0] is None and mem._wrapped[1] is not None, "TextEditorMemory: only edited lines should be re-wrapped"
+    rendered = str(mem)
+    assert rendered.startswith("1| new line\n2| line 1\n"), "TextEditorMemory: lines after an insert should be renumbered"
+    assert rendered.endswith("9| line 8\n")
+    assert str(mem) is rendered, "TextEditorMemory: rendering should be cached until the next edit"
+
+    mem.insert("line 9")
+    assert str(mem).startswith(" 1| new line\n"), "TextEditorMemory: line numbers should be realigned when their width changes"
+    assert mem._current_size == sum(mem._line_sizes) == 20
+    with pytest.raises(ValueError):
+        mem.insert("line 10", -2)
+
+def test_text_editor_memory_paging():
+    recall = TransientRecallMemory()
+    mem = TextEditorMemory(tokenize=lambda x: x.split(" "), max_size=40, recall=recall)
+    for i in range(10):
+        mem.insert(f"note {i} alpha beta gamma")
+    assert mem._current_size <= 40, "TextEditorMemory: the budget should be enforced"
+    assert "note 9" in str(mem) and "note 0" not in str(mem), "TextEditorMemory: the oldest lines should be paged out first"
+    assert mem._lines[0].endswith("lines paged out to recall memory as page 0]")
+    assert any("note 0" in msg.content for msg in recall.text_search("alpha", limit=20)), "TextEditorMemory: paged-out lines should be stored in recall memory"
+
+    mem.page_in(0)
+    assert str(mem).startswith("1| note 0 alpha beta gamma\n"), "TextEditorMemory: paged-in lines should replace their stub"
+    assert mem._current_size == sum(mem._line_sizes) <= 40
+    with pytest.raises(ValueError):
+        mem.page_in(0)
+
+    # Pages are only read back from recall memory
+    other = TextEditorMemory(tokenize=lambda x: x.split(" "), max_size=40, recall=TransientRecallMemory())
+    for i in range(10):
+        other.insert(f"note {i} alpha beta gamma")
+    stubs = [line for line in other._lines if "paged out" in line]
+    assert len(stubs) > 0 and all(re.fullmatch(r"\[\d+ lines paged out to recall memory as page \d+\]", stub) for stub in stubs), \
+        "TextEditorMemory: stubs should not name line numbers, which go stale with edits above them"
+    other._recall.reset()
+    with pytest.raises(ValueError):
+        other.page_in(0)
+
+    # A short line between a stub and newer lines is too small to page out, but newer lines are not
+    mem = TextEditorMemory(tokenize=lambda x: x.split(" "), max_size=30, recall=TransientRecallMemory())
+    mem.insert(" ".join(["a"] * 15))
+    mem.insert("x", 0)
+    mem.insert(" ".join(["b"] * 16), 0)
+    mem.insert("short", 1)
+    mem.insert(" ".join(["c"] * 8))
+    assert mem._current_size == sum(mem._line_sizes) <= 30, "TextEditorMemory: regions too small to page out should be passed over"
+    assert mem._lines[0].endswith("as page 1]")
+
+def test_fifo_conversation_memory_summary_tree():
+    batches = []
+    def summarize(x):
+        batches.append(x)
+        return f"summary {len(batches)}"
+
+    mem = FIFOConversationMemory(tokenize=lambda x: x.split(" "), summarize=summarize, max_size=30, trigger_threshold=0.8, target_threshold=0.5, fanout=2)
+    for i in range(40):
+        mem.insert(Message(role="user", content=f"message {i} " + "word " * 6, timestamp=datetime(2024, 5, 1, 15, 30, i)))
+
+    summarized = [msg.content for batch in batches for msg in batch]
+    assert len(summarized) == len(set(summarized)), "FIFOConversationMemory: every message and summary should be summarized at most once"
+    levels = [level for level, _ in mem._summaries]
+    assert levels == sorted(levels, reverse=True) and len(set(levels)) == len(levels), "FIFOConversationMemory: roots should have strictly decreasing levels"
+    assert mem._message_queue[0][0].content == "\n".join(summary.content for _, summary in mem._summaries)
+    assert sum(entry[1] for entry in mem._message_queue) == mem._current_size